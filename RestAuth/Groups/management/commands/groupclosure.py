@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of RestAuth (https://restauth.net).
+#
+# RestAuth is free software: you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# RestAuth is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with RestAuth. If not,
+# see <http://www.gnu.org/licenses/>.
+
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.db import transaction
+
+from Groups.models import GroupClosure
+
+
+class Command(BaseCommand):
+    help = 'Rebuild or check the table of nested groups used with the GROUP_CLOSURE option.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true', default=False,
+            help="Only verify that the table is consistent, don't modify it.")
+
+    def handle(self, *args, **options):
+        if options['check']:
+            errors = GroupClosure.objects.inconsistencies()
+            for ancestor, descendant, expected, actual in errors:
+                self.stderr.write('Group %s -> %s: expected depth %s, got %s.' % (
+                    ancestor, descendant, expected, actual))
+            if errors:
+                raise CommandError('Found %s inconsistent rows.' % len(errors))
+            self.stdout.write('Table is consistent.')
+        else:
+            with transaction.atomic():
+                rows = GroupClosure.objects.rebuild()
+            self.stdout.write('Rebuilt table with %s rows.' % rows)
@@ -24,5 +24,141 @@ class GroupManager(models.Manager):
     def get_queryset(self):
         return GroupQuerySet(self.model)
 
-    def member(self, user, service=None, depth=None):
-        return self.get_queryset().member(user, service, depth)
+    def member(self, user, service=None, depth=None, closure=False):
+        return self.get_queryset().member(user, service, depth, closure=closure)
+
+    def members(self, depth=None, closure=False):
+        return self.get_queryset().members(depth, closure=closure)
+
+
+class GroupClosureManager(models.Manager):
+    """Manager that maintains the :py:class:`~Groups.models.GroupClosure` table."""
+
+    def _edges(self):
+        return self.model._meta.get_field('ancestor').related_model.groups.through.objects
+
+    def _ancestors(self, groups, parents=None):
+        """Get a dict of ``{ancestor: depth}`` for each of the given group ids.
+
+        Parent groups are fetched from the database one level at a time unless ``parents`` is
+        given, which must then map every group id to a list of its parent group ids.
+        """
+        if parents is None:
+            parents = {}
+            fetch = True
+        else:
+            fetch = False
+
+        ancestors = dict((gid, {}) for gid in groups)
+        frontiers = dict((gid, [gid]) for gid in groups)
+        depth = 0
+        while frontiers:
+            depth += 1
+            if fetch:
+                missing = set(g for f in frontiers.values() for g in f if g not in parents)
+                for gid in missing:
+                    parents[gid] = []
+                qs = self._edges().filter(to_group_id__in=missing)
+                for parent, child in qs.values_list('from_group_id', 'to_group_id'):
+                    parents[child].append(parent)
+
+            for gid, frontier in list(frontiers.items()):
+                found = ancestors[gid]
+                frontier = [p for g in frontier for p in parents.get(g, []) if p not in found]
+                for parent in frontier:
+                    found.setdefault(parent, depth)
+                frontiers[gid] = frontier
+                if not frontier:
+                    del frontiers[gid]
+        return ancestors
+
+    def _expected(self):
+        """Compute the complete closure from the subgroup relations."""
+        parents = {}
+        for parent, child in self._edges().values_list('from_group_id', 'to_group_id'):
+            parents.setdefault(child, []).append(parent)
+        return self._ancestors(parents.keys(), parents=parents)
+
+    def descendants(self, group):
+        """Get the ids of all groups that inherit members from the group with the given id."""
+        return set(self.filter(ancestor_id=group).values_list('descendant_id', flat=True))
+
+    def add(self, group, subgroup):
+        """Update the closure after ``subgroup`` was added as subgroup of ``group``.
+
+        Both parameters are group ids. Only the rows for the descendants of ``subgroup`` are
+        touched.
+        """
+        ancestors = dict(self.filter(descendant_id=group).values_list('ancestor_id', 'depth'))
+        ancestors[group] = 0
+        descendants = dict(self.filter(ancestor_id=subgroup).values_list('descendant_id', 'depth'))
+        descendants[subgroup] = 0
+
+        existing = dict(((r.ancestor_id, r.descendant_id), r) for r in self.filter(
+            ancestor_id__in=ancestors.keys(), descendant_id__in=descendants.keys()))
+        create = []
+        update = []
+        for ancestor, ancestor_depth in ancestors.items():
+            for descendant, descendant_depth in descendants.items():
+                depth = ancestor_depth + descendant_depth + 1
+                row = existing.get((ancestor, descendant))
+                if row is None:
+                    create.append(self.model(ancestor_id=ancestor, descendant_id=descendant,
+                                             depth=depth))
+                elif row.depth > depth:
+                    row.depth = depth
+                    update.append(row)
+
+        self.bulk_create(create)
+        if update:
+            self.bulk_update(update, ['depth'])
+
+    def refresh(self, groups):
+        """Recompute the rows for the given group ids and all groups that inherit from them.
+
+        This is required whenever a subgroup relation is removed, as the remaining rows might still
+        refer to a path that no longer exists.
+        """
+        groups = set(groups)
+        for group in list(groups):
+            groups |= self.descendants(group)
+
+        self.filter(descendant_id__in=groups).delete()
+        self.bulk_create([
+            self.model(ancestor_id=ancestor, descendant_id=descendant, depth=depth)
+            for descendant, ancestors in self._ancestors(groups).items()
+            for ancestor, depth in ancestors.items()
+        ])
+
+    def rebuild(self):
+        """Rebuild the complete table from the subgroup relations.
+
+        :return: The number of rows in the table.
+        """
+        rows = [
+            self.model(ancestor_id=ancestor, descendant_id=descendant, depth=depth)
+            for descendant, ancestors in self._expected().items()
+            for ancestor, depth in ancestors.items()
+        ]
+        self.all().delete()
+        self.bulk_create(rows, batch_size=500)
+        return len(rows)
+
+    def inconsistencies(self):
+        """Compare the table with the subgroup relations.
+
+        :return: A list of ``(ancestor, descendant, expected depth, actual depth)`` tuples for all
+            rows that are missing, superfluous or have the wrong depth. A depth is ``None`` if the
+            row is missing or superfluous.
+        """
+        expected = dict(((ancestor, descendant), depth)
+                        for descendant, ancestors in self._expected().items()
+                        for ancestor, depth in ancestors.items())
+        actual = dict(((ancestor, descendant), depth) for ancestor, descendant, depth
+                      in self.values_list('ancestor_id', 'descendant_id', 'depth'))
+
+        errors = []
+        for key in sorted(set(expected) | set(actual)):
+            if expected.get(key) != actual.get(key):
+                errors.append(key + (expected.get(key), actual.get(key)))
+        return errors
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Groups', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GroupClosure',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('depth', models.PositiveIntegerField()),
+                ('ancestor', models.ForeignKey(related_name='descendant_set', to='Groups.Group', on_delete=models.CASCADE)),
+                ('descendant', models.ForeignKey(related_name='ancestor_set', to='Groups.Group', on_delete=models.CASCADE)),
+            ],
+            bases=(models.Model,),
+        ),
+        migrations.AlterUniqueTogether(
+            name='groupclosure',
+            unique_together=set([('ancestor', 'descendant')]),
+        ),
+    ]
@@ -15,13 +15,13 @@
 
 from __future__ import unicode_literals
 
-from django.conf import settings
 from django.contrib.auth.models import User as Service
 from django.db import models
 from django.db.utils import IntegrityError
 
 from Users.models import ServiceUser as User
 
+from .managers import GroupClosureManager
 from .managers import GroupManager
 
 group_permissions = (
@@ -52,19 +52,11 @@ class Group(models.Model):
         unique_together = ('name', 'service')
         permissions = group_permissions
 
-    def get_members(self, depth=None):
-        expr = models.Q(group=self)
-        if depth is None:
-            depth = settings.GROUP_RECURSION_DEPTH
+    def get_members(self, depth=None, closure=False):
+        return Group.objects.filter(pk=self.pk).members(depth=depth, closure=closure)
 
-        kwarg = 'group'
-        for i in range(depth):
-            kwarg += '__groups'
-            expr |= models.Q(**{kwarg: self})
-        return User.objects.filter(expr).distinct()
-
-    def is_member(self, username):
-        return self.get_members().filter(username=username).exists()
+    def is_member(self, username, closure=False):
+        return self.get_members(closure=closure).filter(username=username).exists()
 
     def save(self, *args, **kwargs):
         if self.service is None:
@@ -85,3 +77,22 @@ class Group(models.Model):
             return "%s/%s" % (self.name, self.service.username)
         else:
             return "%s/None" % (self.name)
+
+
+class GroupClosure(models.Model):
+    """Materialized transitive closure of nested groups.
+
+    There is one row for every group (``ancestor``) that a group (``descendant``) inherits members
+    from, ``depth`` is the shortest distance between the two groups. A group is not stored as its
+    own ancestor unless it is part of a cycle.
+
+    The table is only used and maintained if the backend is configured with ``GROUP_CLOSURE``.
+    """
+    ancestor = models.ForeignKey(Group, on_delete=models.CASCADE, related_name='descendant_set')
+    descendant = models.ForeignKey(Group, on_delete=models.CASCADE, related_name='ancestor_set')
+    depth = models.PositiveIntegerField()
+
+    objects = GroupClosureManager()
+
+    class Meta:
+        unique_together = ('ancestor', 'descendant')
@@ -16,15 +16,62 @@
 from __future__ import unicode_literals
 
 from django.conf import settings
+from django.db import connections
 from django.db import models
 from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from Users.models import ServiceUser as User
+
+# Walks from the groups selected by the inner query to their parent groups.
+# format: group table, subgroup table, inner query; params: inner params + [depth]
+_ANCESTORS_SQL = """WITH RECURSIVE ancestors(id, depth) AS (
+    SELECT g.id, 0 FROM %s g WHERE g.id IN (%s)
+  UNION
+    SELECT sg.from_group_id, a.depth + 1 FROM %s sg
+    INNER JOIN ancestors a ON sg.to_group_id = a.id WHERE a.depth < %%s
+)"""
+
+# Walks from the groups a user is a direct member of to their subgroups.
+# format: member table, subgroup table; params: [user id, depth]
+_DESCENDANTS_SQL = """WITH RECURSIVE descendants(id, depth) AS (
+    SELECT m.group_id, 0 FROM %s m WHERE m.serviceuser_id = %%s
+  UNION
+    SELECT sg.to_group_id, d.depth + 1 FROM %s sg
+    INNER JOIN descendants d ON sg.from_group_id = d.id WHERE d.depth < %%s
+)
+SELECT id FROM descendants"""
+
+
+def supports_recursive_cte(connection):
+    """Return True if the database supports ``WITH RECURSIVE`` queries."""
+
+    if connection.vendor in ('postgresql', 'sqlite'):
+        return True
+    elif connection.vendor == 'mysql':  # pragma: no cover
+        if connection.mysql_is_mariadb:
+            return connection.mysql_version >= (10, 2, 2)
+        return connection.mysql_version >= (8, 0, 1)
+    return False  # pragma: no cover
 
 
 class GroupQuerySet(models.query.QuerySet):
-    def member(self, user, service=None, depth=None):
-        if depth is None:  # pragma: no branch
-            depth = settings.GROUP_RECURSION_DEPTH
+    def _tables(self, connection):
+        qn = connection.ops.quote_name
+        return (
+            qn(self.model._meta.db_table),
+            qn(self.model.users.through._meta.db_table),
+            qn(self.model.groups.through._meta.db_table),
+        )
+
+    def _member_cte(self, user, service, depth):
+        connection = connections[self.db]
+        group_table, member_table, subgroup_table = self._tables(connection)
 
+        sql = _DESCENDANTS_SQL % (member_table, subgroup_table)
+        return self.filter(pk__in=RawSQL(sql, [user.pk, depth]), service=service)
+
+    def _member_orm(self, user, service, depth):
         expr = Q(users=user, service=service)
 
         kwarg = 'users'
@@ -33,3 +80,70 @@ class GroupQuerySet(models.query.QuerySet):
             expr |= models.Q(**{kwarg: user, 'service': service})
 
         return self.filter(expr).distinct()
+
+    def _member_closure(self, user, service, depth):
+        closure = self.model._meta.get_field('ancestor_set').related_model
+        direct = self.model.users.through.objects.filter(serviceuser=user).values('group_id')
+        inherited = closure.objects.filter(ancestor__in=direct, depth__lte=depth)
+
+        return self.filter(Q(pk__in=direct) | Q(pk__in=inherited.values('descendant_id')),
+                           service=service)
+
+    def member(self, user, service=None, depth=None, closure=False):
+        """Get all groups of the given service that the user is a (possibly inherited) member of.
+
+        The query uses a recursive common table expression where the database supports it and
+        falls back to one join per level of recursion otherwise. If ``closure`` is ``True``, the
+        precomputed :py:class:`~Groups.models.GroupClosure` table is used instead.
+        """
+        if depth is None:  # pragma: no branch
+            depth = settings.GROUP_RECURSION_DEPTH
+
+        if closure:
+            return self._member_closure(user, service, depth)
+        elif supports_recursive_cte(connections[self.db]):
+            return self._member_cte(user, service, depth)
+        return self._member_orm(user, service, depth)  # pragma: no cover
+
+    def _members_cte(self, depth):
+        connection = connections[self.db]
+        group_table, member_table, subgroup_table = self._tables(connection)
+        inner_sql, inner_params = self.values('pk').query.sql_with_params()
+
+        sql = _ANCESTORS_SQL % (group_table, inner_sql, subgroup_table)
+        sql += '\nSELECT m.serviceuser_id FROM %s m WHERE m.group_id IN (SELECT id FROM ancestors)' % (
+            member_table)
+        return User.objects.filter(pk__in=RawSQL(sql, list(inner_params) + [depth]))
+
+    def _members_orm(self, depth):
+        expr = Q(group__in=self)
+
+        kwarg = 'group'
+        for i in range(depth):
+            kwarg += '__groups'
+            expr |= Q(**{'%s__in' % kwarg: self})
+
+        return User.objects.filter(expr).distinct()
+
+    def _members_closure(self, depth):
+        inherited = Q(descendant_set__descendant__in=self, descendant_set__depth__lte=depth)
+        groups = self.model.objects.filter(Q(pk__in=self.values('pk')) | inherited)
+        members = self.model.users.through.objects.filter(group__in=groups)
+        return User.objects.filter(pk__in=members.values('serviceuser_id'))
+
+    def members(self, depth=None, closure=False):
+        """Get all users that are a member of any of the groups in this queryset.
+
+        Unlike calling :py:meth:`Group.get_members` for every group, this is resolved in a single
+        query. Like :py:meth:`member`, the query uses a recursive common table expression where the
+        database supports it or the :py:class:`~Groups.models.GroupClosure` table if ``closure`` is
+        ``True``.
+        """
+        if depth is None:
+            depth = settings.GROUP_RECURSION_DEPTH
+
+        if closure:
+            return self._members_closure(depth)
+        elif supports_recursive_cte(connections[self.db]):
+            return self._members_cte(depth)
+        return self._members_orm(depth)  # pragma: no cover
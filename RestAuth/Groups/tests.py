@@ -17,10 +17,14 @@ from __future__ import unicode_literals
 
 import unittest
 
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import CommandError
 import six
 from six.moves import http_client
 
 from backends import backend
+from backends.django import DjangoBackend
 from common.compat import encode_str as _e
 from common.testdata import CliMixin
 from common.testdata import RestAuthTransactionTest
@@ -41,6 +45,10 @@ from common.testdata import username2
 from common.testdata import username3
 from common.testdata import username4
 from common.testdata import username5
+from Users.models import ServiceUser as User
+
+from .models import Group
+from .models import GroupClosure
 
 cli = getattr(__import__('bin.restauth-group'), 'restauth-group').main
 
@@ -763,6 +771,29 @@ class VerifyUserInGroupTests(GroupUserTests):
         self.assertFalse(self.is_member(groupname1, username5))
         self.assertTrue(self.is_member(groupname2, username5))
 
+    @unittest.skipIf(backend.SUPPORTS_SUBGROUPS is False, 'Backend does not support subgroups.')
+    def test_cyclic_inheritance(self):
+        backend.add_member(group=groupname1, service=self.service, user=username1)
+        backend.add_member(group=groupname2, service=self.service, user=username2)
+        backend.add_member(group=groupname3, service=self.service, user=username3)
+        backend.add_subgroup(group=groupname1, service=self.service, subgroup=groupname2,
+                             subservice=self.service)
+        backend.add_subgroup(group=groupname2, service=self.service, subgroup=groupname3,
+                             subservice=self.service)
+        backend.add_subgroup(group=groupname3, service=self.service, subgroup=groupname1,
+                             subservice=self.service)
+
+        for group in [groupname1, groupname2, groupname3]:
+            for user in [username1, username2, username3]:
+                self.assertTrue(self.is_member(group, user))
+
+        self.assertCountEqual(backend.members(group=groupname3, service=self.service, depth=0),
+                              [username3])
+        self.assertCountEqual(backend.members(group=groupname3, service=self.service, depth=1),
+                              [username2, username3])
+        self.assertCountEqual(backend.members(group=groupname3, service=self.service, depth=5),
+                              [username1, username2, username3])
+
 
 # DELETE /groups/<group>/users/<user>/
 class DeleteUserFromGroupTests(GroupUserTests):
@@ -827,6 +858,199 @@ class DeleteUserFromGroupTests(GroupUserTests):
                               [username1])
 
 
+@unittest.skipIf(backend.SUPPORTS_SUBGROUPS is False, 'Backend does not support subgroups.')
+@unittest.skipUnless(settings.DATA_BACKEND['BACKEND'] == 'backends.django.DjangoBackend', '')
+class NestedGroupTests(GroupTests):
+    def setUp(self):
+        super(NestedGroupTests, self).setUp()
+        self.create_user(username4, password4)
+        self.create_user(username5, password5)
+        self.users = [username1, username2, username3, username4, username5]
+        self.groups = [groupname1, groupname2, groupname3, groupname4, groupname5]
+
+        # group1 is the top-level group, group5 the most deeply nested group
+        for i, (user, group) in enumerate(zip(self.users, self.groups)):
+            backend.create_group(group=group, service=self.service, users=[user])
+            if i > 0:
+                backend.add_subgroup(group=self.groups[i - 1], service=self.service, subgroup=group,
+                                     subservice=self.service)
+
+
+@unittest.skipUnless(settings.DATA_BACKEND['BACKEND'] == 'backends.django.DjangoBackend', '')
+class MembershipQueryTests(NestedGroupTests):
+    """Verify that recursive queries return the same results as the fallback using joins."""
+
+    def assertQueries(self):
+        for depth in range(6):
+            for group in self.groups:
+                qs = Group.objects.filter(name=group, service=self.service)
+                self.assertCountEqual(qs._members_cte(depth), qs._members_orm(depth))
+
+            for user in User.objects.all():
+                qs = Group.objects.all()
+                self.assertCountEqual(qs._member_cte(user, self.service, depth),
+                                      qs._member_orm(user, self.service, depth))
+
+    def test_depth(self):
+        self.assertQueries()
+
+        qs = Group.objects.filter(name=groupname5, service=self.service)
+        for depth in range(6):
+            self.assertCountEqual(qs.members(depth).values_list('username', flat=True),
+                                  self.users[4 - min(depth, 4):])
+
+    def test_cycle(self):
+        backend.add_subgroup(group=groupname5, service=self.service, subgroup=groupname1,
+                             subservice=self.service)
+        self.assertQueries()
+
+    def test_multiple_groups(self):
+        qs = Group.objects.filter(name__in=[groupname2, groupname4], service=self.service)
+        self.assertCountEqual(qs.members(depth=1).values_list('username', flat=True),
+                              [username1, username2, username3, username4])
+
+
+@unittest.skipUnless(settings.DATA_BACKEND['BACKEND'] == 'backends.django.DjangoBackend', '')
+class GroupClosureTests(NestedGroupTests):
+    """Verify that the GroupClosure table is kept up to date by the backend."""
+
+    def setUp(self):
+        super(GroupClosureTests, self).setUp()
+        self.backend = DjangoBackend(GROUP_CLOSURE=True)
+        GroupClosure.objects.rebuild()
+
+    def assertClosure(self):
+        self.assertEqual(GroupClosure.objects.inconsistencies(), [])
+
+        for depth in range(6):
+            for group in self.groups:
+                if not backend.group_exists(group=group, service=self.service):
+                    continue
+                self.assertCountEqual(
+                    self.backend.members(group=group, service=self.service, depth=depth),
+                    backend.members(group=group, service=self.service, depth=depth))
+
+            for user in User.objects.all():
+                qs = Group.objects.all()
+                self.assertCountEqual(qs.member(user, self.service, depth, closure=True),
+                                      qs.member(user, self.service, depth))
+
+    def test_rebuild(self):
+        self.assertEqual(GroupClosure.objects.count(), 10)
+        self.assertEqual(GroupClosure.objects.get(
+            ancestor__name=groupname1, descendant__name=groupname5).depth, 4)
+        self.assertClosure()
+
+    def test_add_subgroup(self):
+        # adds a shortcut from group1 to group4 and a cycle
+        self.backend.add_subgroup(group=groupname1, service=self.service, subgroup=groupname4,
+                                  subservice=self.service)
+        self.assertEqual(GroupClosure.objects.get(
+            ancestor__name=groupname1, descendant__name=groupname5).depth, 2)
+        self.backend.add_subgroup(group=groupname5, service=self.service, subgroup=groupname2,
+                                  subservice=self.service)
+        self.assertClosure()
+
+        self.assertTrue(self.backend.is_member(group=groupname2, service=self.service,
+                                               user=username5))
+        self.assertTrue(self.backend.check_password(username5, password5,
+                                                    groups=[(groupname3, self.service)]))
+        self.assertCountEqual(self.backend.list_groups(service=self.service, user=username4),
+                              self.groups[1:])
+
+    def test_set_subgroups(self):
+        self.backend.set_subgroups(group=groupname1, service=self.service,
+                                   subgroups=[groupname3, groupname5], subservice=self.service)
+        self.assertClosure()
+        self.backend.set_subgroups(group=groupname3, service=self.service, subgroups=[],
+                                   subservice=self.service)
+        self.assertClosure()
+
+    def test_remove_subgroup(self):
+        self.backend.add_subgroup(group=groupname1, service=self.service, subgroup=groupname4,
+                                  subservice=self.service)
+        self.backend.remove_subgroup(group=groupname3, service=self.service, subgroup=groupname4,
+                                     subservice=self.service)
+        self.assertClosure()
+        self.assertFalse(self.backend.is_member(group=groupname4, service=self.service,
+                                                user=username3))
+        self.assertTrue(self.backend.is_member(group=groupname5, service=self.service,
+                                               user=username1))
+
+    def test_remove_group(self):
+        self.backend.remove_group(group=groupname3, service=self.service)
+        self.assertClosure()
+        self.assertCountEqual(self.backend.members(group=groupname5, service=self.service),
+                              [username4, username5])
+
+    def test_set_service(self):
+        self.backend.set_service(group=groupname3, service=self.service, new_service=None)
+        self.assertClosure()
+
+    def test_command(self):
+        with capture() as (stdout, stderr):
+            call_command('groupclosure', check=True)
+        self.assertEqual(stdout.getvalue(), 'Table is consistent.\n')
+
+        GroupClosure.objects.filter(ancestor__name=groupname1).delete()
+        with capture() as (stdout, stderr):
+            self.assertRaises(CommandError, call_command, 'groupclosure', check=True)
+        self.assertEqual(len(stderr.getvalue().splitlines()), 4)
+
+        with capture() as (stdout, stderr):
+            call_command('groupclosure')
+        self.assertEqual(stdout.getvalue(), 'Rebuilt table with 10 rows.\n')
+        self.assertClosure()
+
+
+@unittest.skipUnless(settings.DATA_BACKEND['BACKEND'] == 'backends.redis.RedisBackend', '')
+class RedisMembershipIndexTests(GroupTests):
+    """Verify the index of group memberships maintained by the RedisBackend."""
+
+    def setUp(self):
+        super(RedisMembershipIndexTests, self).setUp()
+        backend.create_group(group=groupname1, service=self.service, users=[username1])
+        backend.create_group(group=groupname2, service=self.service2, users=[username1, username2])
+
+    def assertIndex(self, user, groups):
+        self.assertCountEqual(backend.conn.smembers('memberships_%s' % user), groups)
+
+    def test_maintenance(self):
+        sid, sid2 = self.service.id, self.service2.id
+        ref1, ref2 = '%s_%s' % (sid, groupname1), '%s_%s' % (sid2, groupname2)
+        self.assertIndex(username1, [ref1, ref2])
+
+        backend.rename_user(username1, username4)
+        self.assertIndex(username1, [])
+        self.assertIndex(username4, [ref1, ref2])
+
+        backend.set_memberships(username4, self.service, [groupname3])
+        self.assertIndex(username4, ['%s_%s' % (sid, groupname3), ref2])
+
+        backend.rename_group(groupname2, groupname4, service=self.service2)
+        self.assertIndex(username2, ['%s_%s' % (sid2, groupname4)])
+        backend.remove_group(groupname4, service=self.service2)
+        self.assertIndex(username2, [])
+
+        backend.remove_user(username4)
+        self.assertIndex(username4, [])
+
+    def test_rebuild(self):
+        backend.add_subgroup(group=groupname1, service=self.service, subgroup=groupname2,
+                             subservice=self.service2)
+        backend.conn.delete('memberships_%s' % username1)
+        backend.conn.sadd('memberships_%s' % username3, 'foo')
+
+        with capture() as (stdout, stderr):
+            call_command('redismemberships')
+        self.assertEqual(stdout.getvalue(), 'Indexed 3 memberships.\n')
+        self.assertIndex(username1, ['%s_%s' % (self.service.id, groupname1),
+                                     '%s_%s' % (self.service2.id, groupname2)])
+        self.assertIndex(username3, [])
+        self.assertCountEqual(backend.list_groups(service=self.service2, user=username1),
+                              [groupname2])
+
+
 @unittest.skipIf(backend.SUPPORTS_SUBGROUPS is False, 'Backend does not support subgroups.')
 class GetSubGroupTests(GroupUserTests):  # GET /groups/<group>/groups/
     def test_group_doesnt_exist(self):
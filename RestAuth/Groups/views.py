@@ -28,10 +28,12 @@ from RestAuthCommon.strprep import stringprep
 from backends import backend
 from common.errors import GroupNotFound
 from common.errors import UserNotFound
+from common.models import Change
 from common.responses import HttpResponseCreated
 from common.responses import HttpResponseNoContent
 from common.responses import HttpResponseNotImplemented
 from common.responses import HttpRestAuthResponse
+from common.responses import HttpRestAuthStreamingResponse
 from common.views import RestAuthResourceView
 from common.views import RestAuthSubResourceView
 from common.views import RestAuthView
@@ -83,6 +85,8 @@ class GroupsView(RestAuthView):
         # If ResourceExists: 409 Conflict
         # If UserNotFound: 404 Not Found
         backend.create_group(service=request.user, group=name, users=users, dry=dry)
+        if not dry:
+            Change.objects.group(name, Change.CREATED, service=request.user)
 
         self.log.info('%s: Created group', name, extra=largs)
         return HttpResponseCreated()  # Created
@@ -100,7 +104,13 @@ class GroupsView(RestAuthView):
         user = stringprep(user)
         groups = [stringprep(g) for g in groups]
 
+        changed = set(groups)  # groups the user is added to or removed from
+        if Change.objects.enabled():
+            changed.symmetric_difference_update(
+                backend.list_groups(service=request.user, user=user))
+
         backend.set_memberships(user=user, service=request.user, groups=groups)
+        Change.objects.members_changed([(group, request.user) for group in changed])
         return HttpResponseNoContent()
 
 
@@ -127,8 +137,14 @@ class GroupHandlerView(RestAuthResourceView):
         if not request.user.has_perm('Groups.group_delete'):
             return HttpResponseForbidden()
 
+        # subgroups lose the members inherited from this group
+        inheriting = Change.objects.inheriting([(name, request.user)])[1:]
+
         # If GroupNotFound: 404 Not Found
         backend.remove_group(group=name, service=request.user)
+        Change.objects.group(name, Change.DELETED, service=request.user)
+        Change.objects.record_many([(Change.GROUP, group, Change.CHANGED, service)
+                                    for group, service in inheriting])
         self.log.info("Deleted group", extra=largs)
         return HttpResponseNoContent()
 
@@ -149,7 +165,7 @@ class GroupUsersIndex(RestAuthResourceView):
 
         # If GroupNotFound: 404 Not Found
         users = backend.members(group=name, service=request.user)
-        return HttpRestAuthResponse(request, users)
+        return HttpRestAuthStreamingResponse(request, users)
 
     def post(self, request, largs, name):
         """Add a user to a group."""
@@ -163,6 +179,7 @@ class GroupUsersIndex(RestAuthResourceView):
         # If GroupNotFound: 404 Not Found
         # If UserNotFound: 404 Not Found
         backend.add_member(group=name, service=request.user, user=user)
+        Change.objects.members_changed([(name, request.user)])
 
         self.log.info('Add user "%s"', user, extra=largs)
         return HttpResponseNoContent()
@@ -179,6 +196,7 @@ class GroupUsersIndex(RestAuthResourceView):
         # If GroupNotFound: 404 Not Found
         # If UserNotFound: 404 Not Found
         backend.set_members(group=name, service=request.user, users=users)
+        Change.objects.members_changed([(name, request.user)])
 
         self.log.info('Set users for group "%s"', name, extra=largs)
         return HttpResponseNoContent()
@@ -212,6 +230,7 @@ class GroupUserHandler(RestAuthSubResourceView):
         # If GroupNotFound: 404 Not Found
         # If UserNotFound: 404 Not Found
         backend.remove_member(group=name, service=request.user, user=subname)
+        Change.objects.members_changed([(name, request.user)])
         self.log.info('Remove user from group', extra=largs)
         return HttpResponseNoContent()
 
@@ -250,6 +269,8 @@ class GroupGroupsIndex(RestAuthResourceView):
         # If GroupNotFound: 404 Not Found
         backend.add_subgroup(group=name, service=request.user, subgroup=subname,
                              subservice=request.user)
+        Change.objects.group(name, Change.CHANGED, service=request.user)
+        Change.objects.members_changed([(subname, request.user)])  # inherit the members of name
 
         self.log.info('Add subgroup "%s"', subname, extra=largs)
         return HttpResponseNoContent()
@@ -265,8 +286,14 @@ class GroupGroupsIndex(RestAuthResourceView):
         subgroups = [stringprep(g) for g in self._parse_put(request)]
 
         # If GroupNotFound: 404 Not Found
+        changed = [(g, request.user) for g in subgroups]
+        if Change.objects.enabled():  # old subgroups no longer inherit the members of name
+            changed += backend.subgroups(group=name, service=request.user, filter=False)
+
         backend.set_subgroups(group=name, service=request.user, subgroups=subgroups,
                               subservice=request.user)
+        Change.objects.group(name, Change.CHANGED, service=request.user)
+        Change.objects.members_changed(changed)
 
         self.log.info('Set sub-groups', extra=largs)
         return HttpResponseNoContent()
@@ -302,5 +329,7 @@ class GroupGroupHandler(RestAuthSubResourceView):
         # If GroupNotFound: 404 Not Found
         backend.remove_subgroup(group=name, service=request.user, subgroup=subname,
                                 subservice=request.user)
+        Change.objects.group(name, Change.CHANGED, service=request.user)
+        Change.objects.members_changed([(subname, request.user)])
         self.log.info('Remove subgroup %s', subname, extra=largs)
         return HttpResponseNoContent()
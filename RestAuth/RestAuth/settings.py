@@ -100,11 +100,18 @@ CONTENT_HANDLERS = (
 RELAXED_LINUX_CHECKS = False
 MIN_USERNAME_LENGTH = 3
 MAX_USERNAME_LENGTH = 255
+MAX_BATCH_OPERATIONS = 100
 MIN_PASSWORD_LENGTH = 6
 VALIDATORS = []
 GROUP_RECURSION_DEPTH = 3
 SECURE_CACHE = True
+SERVICE_CACHE = {}
 SERVICE_PASSWORD_HASHER = 'default'
+SERVICE_TOKENS = None
+USER_TOKENS = None
+PASSWORD_HASHING_POOL = None
+CACHE_INVALIDATION = None
+CHANGE_LOG = None
 
 # backends:
 GROUP_BACKEND = 'backends.django.DjangoGroupBackend'
@@ -16,6 +16,11 @@
 from django.conf.urls import include
 from django.conf.urls import url
 
+from common.views import BatchView
+from common.views import ChangesView
+from Services.decorator import login_required
+from Services.views import TokenView
+
 from .views import index
 
 urlpatterns = [
@@ -23,4 +28,7 @@ urlpatterns = [
     url(r'^users/', include('Users.urls')),
     url(r'^groups/', include('Groups.urls')),
     url(r'^test/', include('Test.urls')),
+    url(r'^batch/$', login_required(realm='/batch/')(BatchView.as_view()), name='batch'),
+    url(r'^changes/$', login_required(realm='/changes/')(ChangesView.as_view()), name='changes'),
+    url(r'^token/$', login_required(realm='/token/')(TokenView.as_view()), name='token'),
 ]
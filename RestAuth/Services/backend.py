@@ -20,10 +20,11 @@ from __future__ import unicode_literals
 import base64
 
 from django.conf import settings
-from django.core.cache import cache
 import six
 
+from Services.cache import get_service_cache
 from Services.models import Service
+from Services.tokens import verify_token
 
 
 class InternalAuthenticationBackend:
@@ -42,22 +43,26 @@ class InternalAuthenticationBackend:
         """
         Authenticate against a header as send by HTTP basic
         authentication and a host. This method takes care of decoding
-        the header.
+        the header. If :setting:`SERVICE_TOKENS` is configured, the
+        header may also contain a token (see :py:mod:`Services.tokens`).
 
         .. NOTE:: We return None as soon as any check fails in order to avoid
            any accidental pass-through to other parts of the authentication.
         """
         method, data = header.split()
+        if method.lower() == 'bearer':
+            return verify_token(data, host)
         if method.lower() != 'basic':
-            return None  # we only support basic authentication
+            return None  # we only support basic authentication and tokens
 
-        qs = Service.objects.only('username', 'password')
+        qs = Service.objects.only('username', 'password', 'is_active', 'is_superuser')
 
         if settings.SECURE_CACHE:
-            cache_key = 'service_%s' % data
-            cache_data = cache.get(cache_key)
+            cache = get_service_cache()
+            entry = cache.get(data)
 
-            if cache_data is None:
+            if entry is None:
+                generation = cache.generation
                 try:
                     name, password = self._decode(data)
                 except Exception:
@@ -68,23 +73,21 @@ class InternalAuthenticationBackend:
                 except Service.DoesNotExist:
                     return None
 
-                if serv.check_password(password):
-                    # get hosts, store data in cache:
-                    hosts = serv.hosts.values_list('address', flat=True)
-                    cache.set(cache_key, (serv, hosts))
-
-                    if host in hosts:
-                        return serv
-                    else:
-                        return None
-                else:
+                if not serv.check_password(password):
                     return None
+
+                # get permissions, store data in cache:
+                permissions = frozenset(serv.get_all_permissions())
+                entry = (serv.id, serv.username, permissions)
+                cache.set(data, entry, generation)
+
+            pk, name, permissions = entry
+            if cache.allowed(pk, host):
+                serv = Service(id=pk, username=name)
+                serv.cached_permissions = permissions
+                return serv
             else:
-                serv, hosts = cache_data
-                if host in hosts:
-                    return serv
-                else:
-                    return None
+                return None
         else:
             try:
                 name, password = self._decode(data)
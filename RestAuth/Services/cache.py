@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of RestAuth (https://restauth.net).
+#
+# RestAuth is free software: you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# RestAuth is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with RestAuth. If not,
+# see <http://www.gnu.org/licenses/>.
+
+from __future__ import unicode_literals
+
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.crypto import salted_hmac
+
+from backends.cache import LRUCache
+from common.invalidation import get_invalidation_bus
+from Services.hosts import HostIndex
+
+SERVICE_CACHE = None
+
+_SERVICES = ('services', )  # tag of all cached services
+_HOSTS = 'hosts'  # key of the host index, credential digests are hex strings
+
+
+class ServiceCache(object):
+    """Cache for authenticated services.
+
+    Entries are keyed by a keyed digest (using :setting:`SECRET_KEY`) of the credentials sent by the
+    client, so neither the key nor the cached data contains the password or its hash. Every entry
+    contains the id and name of the service and the set of its permissions. The hosts of all
+    services are kept in a single :py:class:`~Services.hosts.HostIndex` (see :py:meth:`allowed`).
+
+    Entries are kept in a bounded, in-process LRU cache. They are also stored in the cache in
+    :setting:`CACHES` named by ``SHARED`` (the ``default`` cache unless configured otherwise), so
+    that other processes don't have to check the password again. The shared cache also holds a
+    version number that is incremented by :py:meth:`invalidate`, entries of older versions are
+    ignored by all processes. If ``SHARED`` is ``None``, invalidations only reach other processes
+    via :setting:`CACHE_INVALIDATION`.
+
+    Please see :setting:`SERVICE_CACHE` for a description of the parameters.
+    """
+
+    version_key = 'restauth-service-cache-version'
+
+    def __init__(self, TIMEOUT=300, MAX_ENTRIES=1000, SHARED='default'):
+        self.timeout = TIMEOUT
+        self.local = LRUCache(max_entries=MAX_ENTRIES, timeout=TIMEOUT)
+        self.shared = caches[SHARED] if SHARED else None
+
+        self.bus = None
+        bus = get_invalidation_bus()
+        if bus is not None:
+            self.subscribe(bus)
+
+    def subscribe(self, bus):
+        """Publish invalidations to and receive them from an
+        :py:class:`~common.invalidation.InvalidationBus`."""
+
+        self.bus = bus
+        bus.subscribe(self.local.invalidate, self.local.clear)
+
+    def _key(self, credentials):
+        return salted_hmac('Services.cache.ServiceCache', credentials).hexdigest()
+
+    def _version(self):
+        if self.shared is None:
+            return 0
+
+        version = self.shared.get(self.version_key)
+        if version is None:  # never set or evicted, start with a version that was never used
+            self.shared.add(self.version_key, int(time.time() * 1000), timeout=None)
+            version = self.shared.get(self.version_key, 0)
+        return version
+
+    def allowed(self, service, host):
+        """Check if the service with the given id may connect from ``host``.
+
+        The :py:class:`~Services.hosts.HostIndex` of all services is cached like the services
+        themselves and rebuilt on the first call after it was invalidated.
+        """
+        version = self._version()
+        found, value = self.local.get(_HOSTS)
+        if found and value[0] == version:
+            return value[1].allowed(service, host)
+
+        generation = self.local.generation
+        index = HostIndex.load()
+        self.local.set(_HOSTS, (version, index), (_SERVICES, ), generation)
+        return index.allowed(service, host)
+
+    @property
+    def generation(self):
+        """Opaque value that has to be read before loading a service and passed to :py:meth:`set`.
+        """
+        return self.local.generation, self._version()
+
+    def get(self, credentials):
+        """Get a tuple of the id, name and permissions of the service or ``None`` if not cached."""
+
+        key = self._key(credentials)
+        version = self._version()
+
+        found, value = self.local.get(key)
+        if found and value[0] == version:
+            return value[1]
+
+        if self.shared is not None:
+            generation = self.local.generation
+            entry = self.shared.get('%s:%s:%s' % (self.version_key, version, key))
+            if entry is not None:
+                self.local.set(key, (version, entry), (_SERVICES, ), generation)
+                return entry
+        return None
+
+    def set(self, credentials, entry, generation):
+        """Cache an entry.
+
+        ``generation`` is the :py:attr:`generation` before the service was loaded, so the entry is
+        not stored (or only under an outdated version) if the cache was invalidated in the meantime.
+        """
+        key = self._key(credentials)
+        generation, version = generation
+
+        self.local.set(key, (version, entry), (_SERVICES, ), generation)
+        if self.shared is not None:
+            self.shared.set('%s:%s:%s' % (self.version_key, version, key), entry, self.timeout)
+
+    def invalidate(self):
+        """Remove all entries, in all processes that use the same shared cache or invalidation bus.
+        """
+        self.local.invalidate([_SERVICES])
+        if self.shared is not None:
+            try:
+                self.shared.incr(self.version_key)
+            except ValueError:  # key does not exist (yet)
+                self.shared.add(self.version_key, int(time.time() * 1000), timeout=None)
+
+        if self.bus is not None:
+            self.bus.publish([_SERVICES])
+
+
+def load_service_cache():
+    global SERVICE_CACHE
+    SERVICE_CACHE = ServiceCache(**getattr(settings, 'SERVICE_CACHE', {}))
+
+
+def get_service_cache():
+    if SERVICE_CACHE is None:
+        load_service_cache()
+    return SERVICE_CACHE
+
+
+def invalidate_service_cache():
+    """Invalidate cached services after a service was created, changed or removed."""
+
+    get_service_cache().invalidate()
@@ -23,6 +23,7 @@ from argparse import Action
 from django.contrib.auth.models import Permission
 from django.contrib.contenttypes.models import ContentType
 
+from common.models import change_permissions
 from Groups.models import group_permissions
 from Users.models import prop_permissions
 from Users.models import user_permissions
@@ -34,10 +35,12 @@ class PermissionParser(Action):
                                           model='serviceuser')
         prop_ct = ContentType.objects.get(app_label='Users', model='property')
         group_ct = ContentType.objects.get(app_label='Groups', model='group')
+        change_ct = ContentType.objects.get(app_label='common', model='change')
 
         user_perms = dict(user_permissions)
         prop_perms = dict(prop_permissions)
         group_perms = dict(group_permissions)
+        change_perms = dict(change_permissions)
 
         permissions = []
         for value in values:
@@ -62,4 +65,11 @@ class PermissionParser(Action):
                 )
                 permissions.append(perm)
 
+            for codename in fnmatch.filter(change_perms.keys(), value):
+                perm, c = Permission.objects.get_or_create(
+                    content_type=change_ct, codename=codename,
+                    defaults={'name': change_perms[codename]}
+                )
+                permissions.append(perm)
+
         setattr(namespace, self.dest, permissions)
@@ -23,6 +23,7 @@ from django.conf import settings
 from django.contrib.auth import authenticate
 from django.contrib.auth import login
 from django.http import HttpResponse
+import six
 
 log = logging.getLogger(__name__)
 
@@ -75,6 +76,7 @@ def login_required(function=None, realm=""):
     performed either by the webserver or the decorator itself.
     """
     def view_decorator(func):
+        @six.wraps(func)
         def wrapper(request, *args, **kwargs):
             return login_user(func, request, realm, *args, **kwargs)
         return wrapper
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of RestAuth (https://restauth.net).
+#
+# RestAuth is free software: you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# RestAuth is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with RestAuth. If not,
+# see <http://www.gnu.org/licenses/>.
+
+"""Addresses and networks that services may connect from."""
+
+from __future__ import unicode_literals
+
+import ipaddress
+
+from django.core.exceptions import ValidationError
+import six
+
+
+def parse_network(value):
+    """Parse an IPv4/IPv6 address or a network in CIDR notation.
+
+    Single addresses are returned as networks with the maximum prefix length, bits of a network
+    that are not part of the prefix are ignored.
+
+    :raise: :py:class:`~django:django.core.exceptions.ValidationError` if the value is invalid.
+    """
+    try:
+        return ipaddress.ip_network(six.text_type(value).strip(), strict=False)
+    except ValueError:
+        raise ValidationError('Enter a valid IPv4 or IPv6 address.', code='invalid')
+
+
+def validate_network(value):
+    parse_network(value)
+
+
+def normalize_network(value):
+    """Get the canonical string for an address or network, addresses are returned without a prefix
+    length."""
+
+    network = parse_network(value)
+    if network.prefixlen == network.max_prefixlen:
+        return six.text_type(network.network_address)
+    return six.text_type(network)
+
+
+class HostIndex(object):
+    """Prefix trie of the addresses and networks all services may connect from.
+
+    Every node of the trie is a list of the two child nodes (for the next bit of the address) and
+    the set of services that may connect from the network the node represents. Looking up an
+    address takes at most 32 (IPv4) or 128 (IPv6) steps, independent of the number of services and
+    networks.
+
+    :param hosts: Tuples of the id of a service and an address or network.
+    """
+
+    def __init__(self, hosts=()):
+        self._roots = {4: [None, None, None], 6: [None, None, None]}
+        for service, network in hosts:
+            self.add(service, network)
+
+    @classmethod
+    def load(cls):
+        """Build the index from the database."""
+
+        from Services.models import ServiceAddress  # models import this module
+
+        qs = ServiceAddress.objects.filter(services__isnull=False)
+        return cls(qs.values_list('services', 'address'))
+
+    def add(self, service, network):
+        network = parse_network(network)
+        bits = int(network.network_address)
+        node = self._roots[network.version]
+
+        for i in range(network.prefixlen):
+            bit = (bits >> (network.max_prefixlen - 1 - i)) & 1
+            if node[bit] is None:
+                node[bit] = [None, None, None]
+            node = node[bit]
+
+        if node[2] is None:
+            node[2] = set()
+        node[2].add(service)
+
+    def allowed(self, service, host):
+        """Check if a service may connect from the given address."""
+
+        try:
+            address = ipaddress.ip_address(six.text_type(host))
+        except ValueError:
+            return False
+
+        bits = int(address)
+        node = self._roots[address.version]
+        for i in range(address.max_prefixlen):
+            if node[2] is not None and service in node[2]:
+                return True
+            node = node[(bits >> (address.max_prefixlen - 1 - i)) & 1]
+            if node is None:
+                return False
+        return node[2] is not None and service in node[2]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import Services.hosts
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Services', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='serviceaddress',
+            name='address',
+            field=models.CharField(max_length=50, unique=True, validators=[Services.hosts.validate_network]),
+        ),
+    ]
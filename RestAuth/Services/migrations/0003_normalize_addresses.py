@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+from Services.hosts import normalize_network
+
+
+def normalize_addresses(apps, schema_editor):
+    """Rewrite addresses converted from the old inet column (e.g. "1.2.3.4/32" on PostgreSQL)."""
+
+    ServiceAddress = apps.get_model('Services', 'ServiceAddress')
+    for address in ServiceAddress.objects.all():
+        normalized = normalize_network(address.address)
+        if normalized == address.address:
+            continue
+
+        existing = ServiceAddress.objects.filter(address=normalized).first()
+        if existing is None:
+            address.address = normalized
+            address.save()
+        else:  # merge duplicates
+            existing.services.add(*address.services.all())
+            address.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Services', '0002_serviceaddress_networks'),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_addresses, migrations.RunPython.noop),
+    ]
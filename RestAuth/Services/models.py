@@ -22,8 +22,13 @@ from django.contrib.auth.hashers import check_password
 from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import User
 from django.core.exceptions import ImproperlyConfigured
+from django.core.exceptions import ValidationError
 from django.db import models
 
+from Services.hosts import HostIndex
+from Services.hosts import normalize_network
+from Services.hosts import validate_network
+
 SERVICE_HASHER = None
 
 
@@ -61,6 +66,11 @@ def check_service_username(name):
         raise ServiceUsernameNotValid("Service name must not contain a ':'")
 
 
+def invalidate_service_cache():
+    from Services.cache import invalidate_service_cache  # backends import this module
+    invalidate_service_cache()
+
+
 def service_create(name, password, *hosts):
     """
     :raises IntegrityError: If the service already exists.
@@ -75,10 +85,16 @@ def service_create(name, password, *hosts):
     if hosts:
         service.add_hosts(*hosts)
 
+    # a removed service with the same name might still be cached
+    invalidate_service_cache()
     return service
 
 
 class Service(User):
+    #: Precomputed set of all permissions (see :py:meth:`has_perm`), set by the authentication
+    #: backend if the service was cached.
+    cached_permissions = None
+
     class Meta:
         proxy = True
 
@@ -101,6 +117,11 @@ class Service(User):
         return check_password(raw_password, self.password, setter,
                               preferred=get_service_hasher())
 
+    def has_perm(self, perm, obj=None):
+        if self.cached_permissions is not None and obj is None:
+            return perm in self.cached_permissions
+        return super(Service, self).has_perm(perm, obj=obj)
+
     def verify(self, password, host):
         if self.check_password(password) and self.verify_host(host):
             return True
@@ -108,17 +129,25 @@ class Service(User):
             return False
 
     def verify_host(self, host):
-        if self.hosts.filter(address=host).exists():
-            return True
-        else:
-            return False
+        """Check if this service may connect from ``host``.
+
+        This always queries the database, use :py:meth:`Services.cache.ServiceCache.allowed` for
+        cached lookups.
+        """
+        hosts = self.hosts.values_list('address', flat=True)
+        return HostIndex((self.id, address) for address in hosts).allowed(self.id, host)
 
     def set_hosts(self, *raw_hosts):
         self.hosts.clear()
+        invalidate_service_cache()
         self.add_hosts(*raw_hosts)
 
     def add_hosts(self, *raw_hosts):
-        cleaned_hosts = [h.strip(', ') for h in raw_hosts]
+        """Add addresses or networks (in CIDR notation) that this service may connect from.
+
+        :raise: :py:class:`~django:django.core.exceptions.ValidationError` if a host is invalid.
+        """
+        cleaned_hosts = [normalize_network(h.strip(', ')) for h in raw_hosts]
         hosts = []
         for raw_host in cleaned_hosts:
             try:
@@ -130,16 +159,18 @@ class Service(User):
             hosts.append(host)
 
         self.hosts.add(*hosts)
+        invalidate_service_cache()
 
     def del_hosts(self, *raw_hosts):
         hosts = []
         for raw_host in raw_hosts:
-            host = raw_host.strip(', ')
             try:
+                host = normalize_network(raw_host.strip(', '))
                 hosts.append(ServiceAddress.objects.get(address=host))
-            except ServiceAddress.DoesNotExist:
+            except (ValidationError, ServiceAddress.DoesNotExist):
                 pass
         self.hosts.remove(*hosts)
+        invalidate_service_cache()
 
     @property
     def addresses(self):
@@ -151,7 +182,9 @@ class Service(User):
 
 
 class ServiceAddress(models.Model):
-    address = models.GenericIPAddressField(unique=True)
+    """An address or network (in CIDR notation) that services may connect from."""
+
+    address = models.CharField(max_length=50, unique=True, validators=[validate_network])
     services = models.ManyToManyField(User, related_name='hosts')
 
     def __unicode__(self):  # pragma: no cover
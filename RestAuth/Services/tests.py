@@ -16,12 +16,15 @@
 from __future__ import unicode_literals
 
 from base64 import b64encode
+from importlib import import_module
 
+from django.apps import apps
 from django.contrib.auth import authenticate
 from django.contrib.auth.models import Permission
 from django.contrib.contenttypes.models import ContentType
 from django.core.cache import cache
 from django.core.exceptions import ImproperlyConfigured
+from django.core.exceptions import ValidationError
 from django.db import transaction
 from django.test import TestCase
 from django.test.client import Client
@@ -30,6 +33,7 @@ from six.moves import http_client
 
 import RestAuthCommon
 
+from common.invalidation import InvalidationBus
 from common.testdata import CliMixin
 from common.testdata import RestAuthTest
 from common.testdata import capture
@@ -41,11 +45,17 @@ from common.testdata import servicename3
 from common.testdata import servicename4
 from common.testdata import servicename5
 
+from .cache import ServiceCache
+from .cache import get_service_cache
+from .cache import invalidate_service_cache
+from .hosts import HostIndex
 from .models import Service
+from .models import ServiceAddress
 from .models import ServiceUsernameNotValid
 from .models import get_service_hasher
 from .models import load_service_hasher
 from .models import service_create
+from .tokens import get_token_config
 
 PATHS = [
     (['get', 'post'], '/users/'),
@@ -242,13 +252,99 @@ class ServiceHostTests(TestCase):
         except ServiceUsernameNotValid:
             self.assertCountEqual(Service.objects.all(), [self.service])
 
+    def test_networks(self):
+        self.service.set_hosts('192.168.0.0/24', '10.1.2.3/16', 'fd00::/64', '::0001')
+        self.assertCountEqual(self.get_hosts(), ['192.168.0.0/24', '10.1.0.0/16', 'fd00::/64', '::1'])
 
-class AuthBackendTests(RestAuthTest):
+        self.assertTrue(self.service.verify_host('192.168.0.1'))
+        self.assertTrue(self.service.verify_host('192.168.0.255'))
+        self.assertTrue(self.service.verify_host('10.1.255.3'))
+        self.assertTrue(self.service.verify_host('fd00::1234'))
+        self.assertTrue(self.service.verify_host('::1'))
+        self.assertFalse(self.service.verify_host('192.168.1.1'))
+        self.assertFalse(self.service.verify_host('fd00:0:0:1::1'))
+        self.assertFalse(self.service.verify_host('::2'))
+
+        cache = get_service_cache()
+        self.assertTrue(cache.allowed(self.service.id, '192.168.0.1'))
+        with self.assertNumQueries(0):
+            self.assertTrue(cache.allowed(self.service.id, '192.168.0.1'))
+
+        self.service.del_hosts('192.168.0.0/24', 'invalid')
+        self.assertFalse(self.service.verify_host('192.168.0.1'))
+        self.assertFalse(cache.allowed(self.service.id, '192.168.0.1'))
+        self.assertTrue(self.service.verify_host('10.1.0.1'))
+
+    def test_verify_host_uncached(self):
+        self.service.set_hosts('10.0.0.0/8')
+        cache = get_service_cache()
+        self.assertTrue(cache.allowed(self.service.id, '10.1.2.3'))
+
+        # e.g. removed by another process, the local cache is not invalidated
+        self.service.hosts.through.objects.all().delete()
+        self.assertTrue(cache.allowed(self.service.id, '10.1.2.3'))
+        self.assertFalse(self.service.verify_host('10.1.2.3'))
+        self.assertFalse(self.service.verify('nopass', '10.1.2.3'))
+
+    def test_invalid_network(self):
+        self.assertRaises(ValidationError, self.service.add_hosts, '192.168.0.0/33')
+        self.assertRaises(ValidationError, self.service.add_hosts, 'example.com')
+        self.assertCountEqual(self.get_hosts(), [])
+
+    def test_normalize_migration(self):
+        # addresses as converted from the inet column by PostgreSQL
+        other = service_create('example.net', 'nopass')
+        for address, service in [('1.2.3.4/32', self.service), ('1.2.3.4', other),
+                                 ('fd00::1/128', self.service), ('10.0.0.0/8', self.service)]:
+            ServiceAddress.objects.get_or_create(address=address)[0].services.add(service)
+
+        migration = import_module('Services.migrations.0003_normalize_addresses')
+        migration.normalize_addresses(apps, None)
+
+        self.assertCountEqual(self.get_hosts(), ['1.2.3.4', 'fd00::1', '10.0.0.0/8'])
+        self.assertCountEqual(other.hosts.values_list('address', flat=True), ['1.2.3.4'])
+        self.assertCountEqual(ServiceAddress.objects.values_list('address', flat=True),
+                              ['1.2.3.4', 'fd00::1', '10.0.0.0/8'])
+        self.service.del_hosts('1.2.3.4/32')
+        self.assertCountEqual(self.get_hosts(), ['fd00::1', '10.0.0.0/8'])
+
+
+class HostIndexTests(TestCase):
+    def test_addresses(self):
+        index = HostIndex([(1, '127.0.0.1'), (1, '::1'), (2, '127.0.0.1')])
+        self.assertTrue(index.allowed(1, '127.0.0.1'))
+        self.assertTrue(index.allowed(1, '::1'))
+        self.assertTrue(index.allowed(2, '127.0.0.1'))
+        self.assertFalse(index.allowed(2, '::1'))
+        self.assertFalse(index.allowed(1, '127.0.0.2'))
+        self.assertFalse(index.allowed(3, '127.0.0.1'))
+
+    def test_networks(self):
+        index = HostIndex([(1, '10.0.0.0/8'), (2, '10.1.0.0/16'), (3, '0.0.0.0/0'), (4, '2001:db8::/32')])
+        self.assertTrue(index.allowed(1, '10.1.2.3'))
+        self.assertTrue(index.allowed(2, '10.1.2.3'))
+        self.assertTrue(index.allowed(3, '10.1.2.3'))
+        self.assertTrue(index.allowed(1, '10.2.0.0'))
+        self.assertFalse(index.allowed(2, '10.2.0.0'))
+        self.assertTrue(index.allowed(3, '192.168.0.1'))
+        self.assertFalse(index.allowed(3, '::1'))
+        self.assertTrue(index.allowed(4, '2001:db8:ffff::1'))
+        self.assertFalse(index.allowed(4, '2001:db9::1'))
+
+    def test_invalid(self):
+        index = HostIndex([(1, '0.0.0.0/0')])
+        self.assertFalse(index.allowed(1, 'example.com'))
+        self.assertFalse(index.allowed(1, ''))
+        self.assertRaises(ValidationError, index.add, 1, 'example.com')
+
+
+class AuthBackendTestBase(RestAuthTest):
     def setUp(self):
         self.service = Service.objects.create(username=servicename1)
         self.service.add_hosts('::1')
         self.service.set_password('nopass')
         self.service.save()
+        invalidate_service_cache()
 
     def auth(self, service, password, host='::1', method='Basic'):
         raw = '%s:%s' % (service.name, password)
@@ -256,6 +352,8 @@ class AuthBackendTests(RestAuthTest):
         header = '%s %s' % (method, encoded)
         return authenticate(header=header, host=host)
 
+
+class AuthBackendTests(AuthBackendTestBase):
     def test_auth(self):
         self.assertTrue(self.auth(self.service, 'nopass'))
         self.assertTrue(self.auth(self.service, 'nopass'))
@@ -280,6 +378,15 @@ class AuthBackendTests(RestAuthTest):
         self.assertTrue(self.auth(self.service, 'nopass', method='foobar') is None)
         self.assertTrue(self.auth(self.service, 'nopass', method='foobar') is None)
 
+    @override_settings(SECURE_CACHE=False)
+    def test_removed_host_uncached(self):
+        self.assertTrue(get_service_cache().allowed(self.service.id, '::1'))
+        self.assertTrue(self.auth(self.service, 'nopass'))
+
+        # the service cache of this process does not know that the host was removed
+        self.service.hosts.through.objects.all().delete()
+        self.assertIsNone(self.auth(self.service, 'nopass'))
+
     def test_wrong_format(self):
         password = 'nopass'
         host = '::1'
@@ -304,6 +411,216 @@ class AuthBackendTests(RestAuthTest):
             self.test_wrong_format()
 
 
+class ServiceCacheTests(AuthBackendTestBase):
+    def test_cached(self):
+        service = self.auth(self.service, 'nopass')
+        self.assertEqual((service.id, service.name), (self.service.id, self.service.name))
+
+        with self.assertNumQueries(0):
+            service = self.auth(self.service, 'nopass')
+            self.assertEqual((service.id, service.name), (self.service.id, self.service.name))
+            self.assertIsNone(self.auth(self.service, 'nopass', host='::2'))
+
+    def test_key(self):
+        raw = '%s:%s' % (self.service.name, 'nopass')
+        encoded = b64encode(raw.encode()).decode()
+        key = get_service_cache()._key(encoded)
+        self.assertNotIn('nopass', key)
+        self.assertNotIn(encoded, key)
+
+    def test_set_password(self):
+        self.assertTrue(self.auth(self.service, 'nopass'))
+        with capture():
+            cli(['set-password', self.service.name, '--password', password1])
+        self.assertIsNone(self.auth(self.service, 'nopass'))
+        self.assertTrue(self.auth(self.service, password1))
+
+    def test_rm_hosts(self):
+        self.assertTrue(self.auth(self.service, 'nopass'))
+        with capture():
+            cli(['rm-hosts', self.service.name, '::1'])
+        self.assertIsNone(self.auth(self.service, 'nopass'))
+
+    def test_networks(self):
+        self.service.set_hosts('192.168.0.0/24')
+        self.assertTrue(self.auth(self.service, 'nopass', host='192.168.0.10'))
+        with self.assertNumQueries(0):
+            self.assertTrue(self.auth(self.service, 'nopass', host='192.168.0.20'))
+            self.assertIsNone(self.auth(self.service, 'nopass', host='192.168.1.10'))
+            self.assertIsNone(self.auth(self.service, 'nopass'))
+
+        with capture():
+            cli(['add-hosts', self.service.name, '::/0'])
+        self.assertTrue(self.auth(self.service, 'nopass'))
+
+    def test_rm(self):
+        self.assertTrue(self.auth(self.service, 'nopass'))
+        with capture():
+            cli(['rm', self.service.name])
+        self.assertIsNone(self.auth(self.service, 'nopass'))
+
+    def test_permissions(self):
+        with capture():
+            cli(['set-permissions', self.service.name, 'users_list', 'props_list'])
+
+        service = self.auth(self.service, 'nopass')
+        with self.assertNumQueries(0):
+            self.assertTrue(service.has_perm('Users.users_list'))
+            self.assertTrue(service.has_perms(['Users.users_list', 'Users.props_list']))
+            self.assertFalse(service.has_perm('Users.user_create'))
+            self.assertFalse(service.has_perms(['Users.users_list', 'Users.user_create']))
+
+        with self.assertNumQueries(0):
+            service = self.auth(self.service, 'nopass')
+            self.assertTrue(service.has_perm('Users.users_list'))
+
+        with capture():
+            cli(['rm-permissions', self.service.name, 'users_list'])
+        service = self.auth(self.service, 'nopass')
+        self.assertFalse(service.has_perm('Users.users_list'))
+        self.assertTrue(service.has_perm('Users.props_list'))
+
+    def test_request(self):
+        with capture():
+            cli(['set-permissions', self.service.name, 'users_list'])
+        client = Client(HTTP_ACCEPT='application/json', REMOTE_ADDR='::1')
+        auth = '%s:%s' % (self.service.name, 'nopass')
+        auth = {'HTTP_AUTHORIZATION': 'Basic %s' % b64encode(auth.encode()).decode()}
+
+        self.assertEqual(client.get('/users/', **auth).status_code, http_client.OK)
+        with self.assertNumQueries(0):  # neither authentication nor the permission check
+            self.assertEqual(client.get('/groups/', **auth).status_code, http_client.FORBIDDEN)
+
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        'services': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                     'LOCATION': 'services'},
+    })
+    def test_shared(self):
+        cache1, cache2 = ServiceCache(SHARED='services'), ServiceCache(SHARED='services')
+        entry = (self.service.id, self.service.name, frozenset(['Users.users_list']))
+
+        cache1.set('credentials', entry, cache1.generation)
+        self.assertEqual(cache2.get('credentials'), entry)  # from the shared cache
+        self.assertEqual(cache2.get('credentials'), entry)  # from the local cache
+
+        cache1.invalidate()
+        self.assertIsNone(cache1.get('credentials'))
+        self.assertIsNone(cache2.get('credentials'))  # local entry has an old version
+
+        # an invalidation while loading the service prevents caching the old entry
+        generation = cache1.generation
+        cache2.invalidate()
+        cache1.set('credentials', entry, generation)
+        self.assertIsNone(cache1.get('credentials'))
+        self.assertIsNone(cache2.get('credentials'))
+
+    def test_default_shared(self):
+        # by default, all processes share the version in the default cache
+        cache1, cache2 = ServiceCache(), ServiceCache()
+        entry = (self.service.id, self.service.name, frozenset(['Users.users_list']))
+        cache1.set('credentials', entry, cache1.generation)
+        self.assertEqual(cache1.get('credentials'), entry)
+        self.assertEqual(cache2.get('credentials'), entry)
+
+        cache2.invalidate()
+        self.assertIsNone(cache1.get('credentials'))
+        self.assertIsNone(cache2.get('credentials'))
+
+        # changes made with restauth-service are seen by other processes
+        other = ServiceCache()
+        self.assertTrue(self.auth(self.service, 'nopass'))
+        self.assertTrue(other.allowed(self.service.id, '::1'))
+        with capture():
+            cli(['rm-hosts', self.service.name, '::1'])
+        self.assertFalse(other.allowed(self.service.id, '::1'))
+
+    def test_bus(self):
+        bus1, bus2 = InvalidationBus(CHANNEL='services'), InvalidationBus(CHANNEL='services')
+        try:
+            cache1, cache2 = ServiceCache(SHARED=None), ServiceCache(SHARED=None)
+            cache1.subscribe(bus1)
+            cache2.subscribe(bus2)
+            entry = (self.service.id, self.service.name, frozenset(['Users.users_list']))
+
+            cache2.set('credentials', entry, cache2.generation)
+            cache1.invalidate()
+            self.assertIsNone(cache2.get('credentials'))
+        finally:
+            bus1.close()
+            bus2.close()
+
+
+@override_settings(SERVICE_TOKENS={'KEYS': ['key1']})
+class TokenTests(AuthBackendTestBase):
+    def setUp(self):
+        super(TokenTests, self).setUp()
+        with capture():
+            cli(['set-permissions', self.service.name, 'users_list'])
+        self.handler = RestAuthCommon.handlers.JSONContentHandler()
+        self.client = Client(HTTP_ACCEPT=self.handler.mime, REMOTE_ADDR='::1')
+
+    def get_token(self, **kwargs):
+        auth = '%s:%s' % (self.service.name, 'nopass')
+        auth = {'HTTP_AUTHORIZATION': 'Basic %s' % b64encode(auth.encode()).decode()}
+        auth.update(kwargs)
+        resp = self.client.post('/token/', **auth)
+        self.assertEqual(resp.status_code, http_client.OK)
+        data = self.handler.unmarshal_dict(resp.content)
+        self.assertEqual(data['expires'], 300)
+        return data['token']
+
+    def test_token(self):
+        token = self.get_token()
+
+        with self.assertNumQueries(0):
+            service = authenticate(header='Bearer %s' % token, host='::1')
+            self.assertEqual(service.id, self.service.id)
+            self.assertEqual(service.name, self.service.name)
+            self.assertTrue(service.has_perm('Users.users_list'))
+            self.assertFalse(service.has_perm('Users.props_list'))
+
+            self.assertIsNone(authenticate(header='Bearer %s' % token, host='::2'))
+            self.assertIsNone(authenticate(header='Bearer %sx' % token, host='::1'))
+            self.assertIsNone(authenticate(header='Bearer foobar', host='::1'))
+
+    def test_request(self):
+        auth = {'HTTP_AUTHORIZATION': 'Bearer %s' % self.get_token()}
+        self.assertEqual(self.client.get('/users/', **auth).status_code, http_client.OK)
+        self.assertEqual(self.client.get('/groups/', **auth).status_code,
+                         http_client.FORBIDDEN)
+
+        # tokens cannot be renewed with a token
+        self.assertEqual(self.client.post('/token/', **auth).status_code, http_client.FORBIDDEN)
+
+    def test_rotation(self):
+        token = self.get_token()
+        header = 'Bearer %s' % token
+
+        with self.settings(SERVICE_TOKENS={'KEYS': ['key2', 'key1']}):
+            self.assertTrue(authenticate(header=header, host='::1'))
+
+            # new tokens are signed with the new key
+            new_header = 'Bearer %s' % self.get_token()
+            self.assertNotEqual(header, new_header)
+            self.assertTrue(authenticate(header=new_header, host='::1'))
+
+        with self.settings(SERVICE_TOKENS={'KEYS': ['key2']}):
+            self.assertIsNone(authenticate(header=header, host='::1'))
+            self.assertTrue(authenticate(header=new_header, host='::1'))
+
+    def test_expired(self):
+        header = 'Bearer %s' % self.get_token()
+        with self.settings(SERVICE_TOKENS={'KEYS': ['key1'], 'TIMEOUT': -1}):
+            self.assertIsNone(authenticate(header=header, host='::1'))
+
+    def test_disabled(self):
+        header = 'Bearer %s' % self.get_token()
+        with self.settings(SERVICE_TOKENS=None):
+            self.assertIsNone(get_token_config())
+            self.assertIsNone(authenticate(header=header, host='::1'))
+
+
 class ServiceHasherTests(RestAuthTest):
     def test_default(self):
         hasher = 'hashers_passlib.phpass'
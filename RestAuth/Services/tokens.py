@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of RestAuth (https://restauth.net).
+#
+# RestAuth is free software: you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# RestAuth is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with RestAuth. If not,
+# see <http://www.gnu.org/licenses/>.
+
+"""Signed tokens that services can use instead of their credentials.
+
+A token contains the id, name and permissions of the service and the address it was issued for,
+signed with a key from :setting:`SERVICE_TOKENS`. Verifying a token only requires computing an HMAC,
+so neither the database nor the (deliberately slow) password hasher is used.
+"""
+
+from __future__ import unicode_literals
+
+from django.conf import settings
+
+from common.tokens import sign
+from common.tokens import unsign
+from Services.models import Service
+
+_SALT = 'Services.tokens'
+
+
+def get_token_config():
+    """Get a tuple of the lifetime of tokens and the list of signing keys.
+
+    Returns ``None`` if tokens are disabled.
+    """
+    config = getattr(settings, 'SERVICE_TOKENS', None)
+    if config is None:
+        return None
+    return config.get('TIMEOUT', 300), list(config.get('KEYS') or [settings.SECRET_KEY])
+
+
+def create_token(service, host):
+    """Create a token for ``service`` that is only valid when used from ``host``.
+
+    The token is signed with the first key configured in :setting:`SERVICE_TOKENS`.
+    """
+    timeout, keys = get_token_config()
+
+    permissions = service.cached_permissions
+    if permissions is None:
+        permissions = service.get_all_permissions()
+
+    data = [service.id, service.username, sorted(permissions), host]
+    return sign(data, keys, _SALT)
+
+
+def verify_token(token, host):
+    """Get the service from a token or ``None`` if the token is invalid, expired or was issued for a
+    different host.
+
+    Tokens signed with any of the configured keys are accepted (see :py:mod:`common.tokens`).
+    """
+    config = get_token_config()
+    if config is None:
+        return None
+    timeout, keys = config
+
+    data = unsign(token, keys, _SALT, timeout)
+    if data is None:
+        return None
+
+    pk, name, permissions, token_host = data
+    if token_host != host:
+        return None
+
+    service = Service(id=pk, username=name)
+    service.cached_permissions = frozenset(permissions)
+    return service
@@ -14,3 +14,39 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with RestAuth.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import unicode_literals
+
+import logging
+
+from django.http import HttpResponseForbidden
+
+from common.responses import HttpResponseNotImplemented
+from common.responses import HttpRestAuthResponse
+from common.views import RestAuthView
+from Services.tokens import create_token
+from Services.tokens import get_token_config
+
+
+class TokenView(RestAuthView):
+    """Handle requests to ``/token/``."""
+
+    http_method_names = ['post']
+    log = logging.getLogger('token')
+
+    def post(self, request, largs):
+        """Create a token that the service can use instead of its credentials.
+
+        Tokens cannot be used to create new tokens, otherwise a token could be renewed forever.
+        """
+        config = get_token_config()
+        if config is None:
+            return HttpResponseNotImplemented()
+
+        method = request.META.get('HTTP_AUTHORIZATION', '').split(' ', 1)[0]
+        if method.lower() == 'bearer':
+            return HttpResponseForbidden()
+
+        token = create_token(request.user, request.META['REMOTE_ADDR'])
+        self.log.info('Created token', extra=largs)
+        return HttpRestAuthResponse(request, {'token': token, 'expires': config[0]})
@@ -15,10 +15,11 @@
 
 from __future__ import unicode_literals
 
-from django.contrib.auth.hashers import check_password
-from django.contrib.auth.hashers import make_password
 from django.db import models
 
+from common.hashers import check_password
+from common.hashers import make_password
+
 user_permissions = (
     ('users_list', 'List all users'),
     ('user_create', 'Create a new user'),
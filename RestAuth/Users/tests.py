@@ -16,12 +16,16 @@
 from __future__ import unicode_literals
 
 import re
+import shutil
+import tempfile
 from datetime import datetime
 from unittest import skipUnless
 
 from django.conf import settings
 from django.contrib.auth.hashers import check_password
+from django.core.cache import caches
 from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ImproperlyConfigured
 from django.test import TransactionTestCase
 from django.test.utils import override_settings
 import six
@@ -32,8 +36,11 @@ from backends import backend
 from common.cli.helpers import write_commands
 from common.cli.helpers import write_parameters
 from common.cli.helpers import write_usage
+from common.content_handlers import get_handler
+from common.errors import GroupNotFound
 from common.errors import PropertyNotFound
 from common.errors import UserNotFound
+from common.responses import HttpRestAuthStreamingResponse
 from common.testdata import PASSWORD_HASHERS
 from common.testdata import CliMixin
 from common.testdata import RestAuthTestBase
@@ -41,6 +48,10 @@ from common.testdata import RestAuthTransactionTest
 from common.testdata import capture
 from common.testdata import groupname1
 from common.testdata import groupname2
+from common.testdata import groupname3
+from common.testdata import groupname4
+from common.testdata import groupname5
+from common.testdata import groupname6
 from common.testdata import password1
 from common.testdata import password2
 from common.testdata import password3
@@ -56,6 +67,8 @@ from common.testdata import username1
 from common.testdata import username2
 from common.testdata import username3
 from Users.cli.parsers import parser
+from Users.tokens import get_token_config
+from Users.tokens import verify_token
 from Users.validators import load_username_validators
 
 restauth_user = getattr(__import__('bin.restauth-user'), 'restauth-user').main
@@ -82,6 +95,34 @@ class GetUsersTests(RestAuthTransactionTest):  # GET /users/
         self.assertEqual(resp.status_code, http_client.OK)
         self.assertCountEqual(self.parse(resp, 'list'), [username1, username2])
 
+    def test_get_users_in_chunks(self):
+        self.create_user(username1, password1)
+        self.create_user(username2, password1)
+        self.create_user(username3, password1)
+
+        chunk_size = HttpRestAuthStreamingResponse.chunk_size
+        HttpRestAuthStreamingResponse.chunk_size = 2
+        try:
+            resp = self.get('/users/')
+            self.assertEqual(resp.status_code, http_client.OK)
+            self.assertTrue(resp.streaming)
+            chunks = list(resp.streaming_content)
+        finally:
+            HttpRestAuthStreamingResponse.chunk_size = chunk_size
+
+        self.assertEqual(len(chunks), 4)  # "[", two chunks and "]"
+        self.assertCountEqual(self.handler.unmarshal_list(b''.join(chunks).decode('utf-8')),
+                              [username1, username2, username3])
+
+    def test_get_users_other_content_type(self):
+        self.create_user(username1, password1)
+
+        handler = get_handler('application/pickle')
+        resp = self.c.get('/users/', HTTP_ACCEPT=handler.mime)
+        self.assertEqual(resp.status_code, http_client.OK)
+        self.assertEqual(resp['Content-Type'], handler.mime)
+        self.assertEqual(handler.unmarshal_list(b''.join(resp.streaming_content)), [username1])
+
 
 class AddUserTests(RestAuthTransactionTest):  # POST /users/
     def get_usernames(self):
@@ -242,6 +283,64 @@ class AddUserTests(RestAuthTransactionTest):  # POST /users/
         self.assertEqual(self.get_usernames(), [])
 
 
+class AddUsersTests(RestAuthTransactionTest):  # POST /users/ with a list
+    def test_add_users(self):
+        resp = self.post('/users/', [
+            {'user': username1, 'password': password1},
+            {'user': username2, 'properties': {propkey1: propval1}, 'groups': [groupname1]},
+        ])
+        self.assertEqual(resp.status_code, http_client.OK)
+        self.assertEqual(self.parse(resp, 'list'), [
+            {'user': username1, 'status': 201},
+            {'user': username2, 'status': 201},
+        ])
+        self.assertCountEqual(backend.list_users(), [username1, username2])
+        self.assertPassword(username1, password1)
+        self.assertFalsePassword(username2, password1)
+        self.assertProperties(username1, {})
+        self.assertProperties(username2, {propkey1: propval1})
+        self.assertEqual(backend.members(groupname1, self.service), [username2])
+
+    def test_existing_users(self):
+        self.create_user(username1, password1)
+        resp = self.post('/users/', [
+            {'user': username1, 'password': password2},
+            {'user': username2},
+            {'user': username2, 'password': password2},
+        ])
+        self.assertEqual(resp.status_code, http_client.OK)
+        self.assertEqual([r['status'] for r in self.parse(resp, 'list')], [409, 201, 409])
+        self.assertCountEqual(backend.list_users(), [username1, username2])
+        self.assertPassword(username1, password1)
+        self.assertFalsePassword(username2, password2)
+
+    def test_invalid_users(self):
+        resp = self.post('/users/', [
+            {'user': 'foo\nbar'},
+            {'user': username1, 'password': 'a'},
+            {'foo': 'bar'},
+            'foobar',
+            {'user': username2},
+        ])
+        self.assertEqual(resp.status_code, http_client.OK)
+        self.assertEqual([r['status'] for r in self.parse(resp, 'list')],
+                         [412, 412, 400, 400, 201])
+        self.assertEqual(backend.list_users(), [username2])
+
+    def test_dry_run(self):
+        self.create_user(username1)
+        resp = self.post('/test/users/', [{'user': username1}, {'user': username2}])
+        self.assertEqual(resp.status_code, http_client.OK)
+        self.assertEqual([r['status'] for r in self.parse(resp, 'list')], [409, 201])
+        self.assertEqual(backend.list_users(), [username1])
+
+    def test_empty_list(self):
+        resp = self.post('/users/', [])
+        self.assertEqual(resp.status_code, http_client.OK)
+        self.assertEqual(self.parse(resp, 'list'), [])
+        self.assertEqual(backend.list_users(), [])
+
+
 class UserTests(RestAuthTransactionTest):
     def setUp(self):
         super(UserTests, self).setUp()
@@ -300,6 +399,46 @@ class VerifyPasswordsTest(UserTests):  # POST /users/<user>/
         resp = self.post('/users/%s/' % username1, data)
         self.assertEqual(resp.status_code, http_client.NO_CONTENT)
 
+    def test_password_groups_not_found(self):
+        resp = self.post('/users/%s/' % username1, {'password': password1, 'groups': [groupname1]})
+        self.assertEqual(resp.status_code, http_client.NOT_FOUND)
+        self.assertEqual(resp['Resource-Type'], 'group')
+
+        backend.create_group(group=groupname1, service=self.service)
+        backend.add_member(group=groupname1, service=self.service, user=username1)
+
+        # groups are checked in order, a missing group after a matching group is not an error
+        groups = [(groupname1, self.service), (groupname2, self.service)]
+        self.assertTrue(backend.check_password(user=username1, password=password1, groups=groups))
+        self.assertRaises(GroupNotFound, backend.check_password, user=username1,
+                          password=password1, groups=list(reversed(groups)))
+        self.assertRaises(GroupNotFound, backend.check_password, user=username2,
+                          password=password2, groups=groups)
+
+    @skipUnless(settings.DATA_BACKEND['BACKEND'] == 'backends.django.DjangoBackend', '')
+    def test_password_groups_queries(self):
+        groups = [groupname1, groupname2, groupname3, groupname4, groupname5]
+        for group in groups:
+            backend.create_group(group=group, service=self.service)
+        groups = [(g, self.service) for g in groups]
+
+        with self.assertNumQueries(3):
+            self.assertFalse(backend.check_password(user=username1, password=password1, groups=groups))
+
+        # inherit membership from a parent group
+        backend.create_group(group=groupname6, service=None)
+        backend.add_subgroup(group=groupname6, service=None, subgroup=groupname5,
+                             subservice=self.service)
+        backend.add_member(group=groupname6, service=None, user=username1)
+        with self.assertNumQueries(3):
+            self.assertTrue(backend.check_password(user=username1, password=password1, groups=groups))
+        with self.assertNumQueries(3):
+            self.assertFalse(backend.check_password(user=username2, password=password2, groups=groups))
+
+        # wrong password is detected after the first query
+        with self.assertNumQueries(1):
+            self.assertFalse(backend.check_password(user=username1, password=password2, groups=groups))
+
     @skipUnless(settings.DATA_BACKEND['BACKEND'] == 'backends.django.DjangoBackend', '')
     def test_update_password_hash(self):
         """Test if checking the password with an old hash automatically updates the hash."""
@@ -335,6 +474,253 @@ class VerifyPasswordsTest(UserTests):  # POST /users/<user>/
         self.assertEqual(resp.status_code, http_client.BAD_REQUEST)
 
 
+class ProfileTests(UserTests):  # POST /users/<user>/profile/
+    def setUp(self):
+        super(ProfileTests, self).setUp()
+        backend.create_property(username1, propkey1, propval1)
+        backend.create_property(username1, propkey2, propval2)
+        backend.create_group(group=groupname1, service=self.service)
+        backend.create_group(group=groupname2, service=self.service)
+        backend.add_member(group=groupname1, service=self.service, user=username1)
+
+    def test_profile(self):
+        resp = self.post('/users/%s/profile/' % username1, {'password': password1})
+        self.assertEqual(resp.status_code, http_client.OK)
+        profile = self.parse(resp, 'dict')
+        self.assertEqual(profile['groups'], [groupname1])
+        self.assertEqual(profile['properties'][propkey1], propval1)
+        self.assertEqual(profile['properties'][propkey2], propval2)
+        self.assertIn('date joined', profile['properties'])
+
+    def test_properties(self):
+        data = {'password': password1, 'properties': [propkey1, propkey3]}
+        resp = self.post('/users/%s/profile/' % username1, data)
+        self.assertEqual(resp.status_code, http_client.OK)
+        self.assertEqual(self.parse(resp, 'dict'), {
+            'properties': {propkey1: propval1},
+            'groups': [groupname1],
+        })
+
+        data['properties'] = []
+        resp = self.post('/users/%s/profile/' % username1, data)
+        self.assertEqual(resp.status_code, http_client.OK)
+        self.assertEqual(self.parse(resp, 'dict')['properties'], {})
+
+    def test_inherited_groups(self):
+        backend.add_subgroup(group=groupname1, service=self.service, subgroup=groupname2,
+                             subservice=self.service)
+        resp = self.post('/users/%s/profile/' % username1, {'password': password1})
+        self.assertEqual(resp.status_code, http_client.OK)
+        self.assertCountEqual(self.parse(resp, 'dict')['groups'], [groupname1, groupname2])
+
+    def test_groups(self):
+        data = {'password': password1, 'groups': [groupname2]}
+        resp = self.post('/users/%s/profile/' % username1, data)
+        self.assertEqual(resp.status_code, http_client.NOT_FOUND)
+
+        data['groups'] = [groupname1, groupname2]
+        resp = self.post('/users/%s/profile/' % username1, data)
+        self.assertEqual(resp.status_code, http_client.OK)
+        self.assertEqual(self.parse(resp, 'dict')['groups'], [groupname1])
+
+    def test_groups_not_found(self):
+        # same semantics as verifying the password: groups are checked in order
+        data = {'password': password1, 'groups': [groupname2, groupname3, groupname1]}
+        resp = self.post('/users/%s/profile/' % username1, data)
+        self.assertEqual(resp.status_code, http_client.NOT_FOUND)
+        self.assertEqual(resp['Resource-Type'], 'group')
+        self.assertRaises(GroupNotFound, backend.check_password, user=username1,
+                          password=password1, groups=[(g, self.service) for g in data['groups']])
+
+        data['groups'] = [groupname1, groupname3]
+        resp = self.post('/users/%s/profile/' % username1, data)
+        self.assertEqual(resp.status_code, http_client.OK)
+
+        # a wrong password is still reported as an unknown user
+        data['password'] = password2
+        resp = self.post('/users/%s/profile/' % username1, data)
+        self.assertEqual(resp.status_code, http_client.NOT_FOUND)
+        self.assertEqual(resp['Resource-Type'], 'user')
+
+    def test_wrong_password(self):
+        resp = self.post('/users/%s/profile/' % username1, {'password': password2})
+        self.assertEqual(resp.status_code, http_client.NOT_FOUND)
+        self.assertEqual(resp['Resource-Type'], 'user')
+
+    def test_user_doesnt_exist(self):
+        resp = self.post('/users/%s/profile/' % username3, {'password': password1})
+        self.assertEqual(resp.status_code, http_client.NOT_FOUND)
+        self.assertEqual(resp['Resource-Type'], 'user')
+
+    def test_bad_request(self):
+        resp = self.post('/users/%s/profile/' % username1, {'groups': [groupname1]})
+        self.assertEqual(resp.status_code, http_client.BAD_REQUEST)
+
+    def test_permissions(self):
+        self.service.user_permissions.remove(
+            *self.service.user_permissions.filter(codename='groups_for_user'))
+        resp = self.post('/users/%s/profile/' % username1, {'password': password1})
+        self.assertEqual(resp.status_code, http_client.FORBIDDEN)
+
+    @skipUnless(settings.DATA_BACKEND['BACKEND'] == 'backends.django.DjangoBackend', '')
+    def test_queries(self):
+        with self.assertNumQueries(3):
+            backend.authenticate(user=username1, password=password1, service=self.service,
+                                 groups=[groupname1], keys=[propkey1])
+
+        # wrong password is detected after the first query
+        with self.assertNumQueries(1):
+            self.assertIsNone(backend.authenticate(user=username1, password=password2,
+                                                   service=self.service))
+
+
+@override_settings(USER_TOKENS={'KEYS': ['key1'], 'CACHE': 'tokens'})
+class UserTokenTests(UserTests):  # POST /users/<user>/token/
+    def setUp(self):
+        # tokens require a cache that is shared by all processes
+        self.path = tempfile.mkdtemp()
+        self.caches = self.settings(CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+            'tokens': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                       'LOCATION': self.path},
+        })
+        self.caches.enable()
+        super(UserTokenTests, self).setUp()
+
+    def tearDown(self):
+        super(UserTokenTests, self).tearDown()
+        self.caches.disable()
+        shutil.rmtree(self.path)
+
+    def get_token(self, user=username1, password=password1):
+        resp = self.post('/users/%s/' % user, {'password': password, 'token': True})
+        self.assertEqual(resp.status_code, http_client.OK)
+        data = self.parse(resp, 'dict')
+        self.assertEqual(data['expires'], 300)
+        return data['token']
+
+    def verify(self, token, user=username1, **kwargs):
+        kwargs['token'] = token
+        return self.post('/users/%s/token/' % user, kwargs).status_code
+
+    def test_token(self):
+        token = self.get_token()
+        self.assertEqual(self.verify(token), http_client.NO_CONTENT)
+        self.assertEqual(self.verify(token), http_client.NO_CONTENT)
+
+        self.assertEqual(self.verify(token, username2), http_client.NOT_FOUND)
+        self.assertEqual(self.verify(token + 'x'), http_client.NOT_FOUND)
+        self.assertEqual(self.verify('foobar'), http_client.NOT_FOUND)
+        self.assertFalse(verify_token(token, username1, self.service2))
+
+    def test_queries(self):
+        token = self.get_token()
+        with self.assertNumQueries(0):
+            self.assertTrue(verify_token(token, username1, self.service))
+
+    def test_wrong_password(self):
+        resp = self.post('/users/%s/' % username1, {'password': password2, 'token': True})
+        self.assertEqual(resp.status_code, http_client.NOT_FOUND)
+
+        resp = self.post('/users/%s/' % username3, {'password': password1, 'token': True})
+        self.assertEqual(resp.status_code, http_client.NOT_FOUND)
+
+    def test_groups(self):
+        backend.create_group(group=groupname1, service=self.service)
+        backend.create_group(group=groupname2, service=self.service)
+        backend.add_member(group=groupname1, service=self.service, user=username1)
+        token = self.get_token()
+
+        self.assertEqual(self.verify(token, groups=[groupname2]), http_client.NOT_FOUND)
+        self.assertEqual(self.verify(token, groups=[groupname1, groupname2]),
+                         http_client.NO_CONTENT)
+        self.assertEqual(self.verify(token, groups=[groupname1.upper()]), http_client.NOT_FOUND)
+
+        # same semantics as verifying the password: groups are checked in order
+        self.assertEqual(self.verify(token, groups=[groupname1, groupname3]),
+                         http_client.NO_CONTENT)
+        resp = self.post('/users/%s/token/' % username1,
+                         {'token': token, 'groups': [groupname2, groupname3]})
+        self.assertEqual(resp.status_code, http_client.NOT_FOUND)
+        self.assertEqual(resp['Resource-Type'], 'group')
+
+    def test_change_password(self):
+        token = self.get_token()
+        other = self.get_token(username2, password2)
+
+        resp = self.put('/users/%s/' % username1, {'password': password3})
+        self.assertEqual(resp.status_code, http_client.NO_CONTENT)
+        self.assertEqual(self.verify(token), http_client.NOT_FOUND)
+        self.assertEqual(self.verify(other, username2), http_client.NO_CONTENT)
+
+        token = self.get_token(password=password3)
+        self.assertEqual(self.verify(token), http_client.NO_CONTENT)
+        with capture():
+            restauth_user(['set-password', '--password', password1, username1])
+        self.assertEqual(self.verify(token), http_client.NOT_FOUND)
+
+    def test_delete(self):
+        token = self.get_token()
+        resp = self.delete('/users/%s/' % username1)
+        self.assertEqual(resp.status_code, http_client.NO_CONTENT)
+
+        # a new user with the same name cannot use old tokens
+        self.create_user(username1, password1)
+        self.assertEqual(self.verify(token), http_client.NOT_FOUND)
+
+    def test_rename(self):
+        token = self.get_token()
+        with capture():
+            restauth_user(['rename', username1, username3])
+        self.create_user(username1, password1)
+        self.assertEqual(self.verify(token), http_client.NOT_FOUND)
+
+    def test_rotation(self):
+        token = self.get_token()
+        with self.settings(USER_TOKENS={'KEYS': ['key2', 'key1'], 'CACHE': 'tokens'}):
+            self.assertEqual(self.verify(token), http_client.NO_CONTENT)
+        with self.settings(USER_TOKENS={'KEYS': ['key2'], 'CACHE': 'tokens'}):
+            self.assertEqual(self.verify(token), http_client.NOT_FOUND)
+
+    def test_expired(self):
+        token = self.get_token()
+        with self.settings(USER_TOKENS={'KEYS': ['key1'], 'TIMEOUT': -1, 'CACHE': 'tokens'}):
+            self.assertEqual(self.verify(token), http_client.NOT_FOUND)
+
+    def test_evicted(self):
+        token = self.get_token()
+        caches['tokens'].clear()  # losing the generation of a user also invalidates tokens
+        self.assertEqual(self.verify(token), http_client.NOT_FOUND)
+
+    def test_local_cache(self):
+        with self.settings(USER_TOKENS={'KEYS': ['key1']}):
+            self.assertRaises(ImproperlyConfigured, get_token_config)
+        with self.settings(USER_TOKENS={'KEYS': ['key1'], 'CACHE': 'default'}):
+            self.assertRaises(ImproperlyConfigured, get_token_config)
+
+    def test_disabled(self):
+        token = self.get_token()
+        with self.settings(USER_TOKENS=None):
+            self.assertFalse(verify_token(token, username1, self.service))
+
+            # without the token parameter, the password is verified as usual
+            resp = self.post('/users/%s/' % username1, {'password': password1})
+            self.assertEqual(resp.status_code, http_client.NO_CONTENT)
+
+    def test_bad_request(self):
+        resp = self.post('/users/%s/token/' % username1, {'groups': [groupname1]})
+        self.assertEqual(resp.status_code, http_client.BAD_REQUEST)
+
+        resp = self.post('/users/%s/' % username1, {'password': password1, 'token': 'yes'})
+        self.assertEqual(resp.status_code, http_client.BAD_REQUEST)
+
+    def test_permissions(self):
+        token = self.get_token()
+        self.service.user_permissions.remove(
+            *self.service.user_permissions.filter(codename='user_verify_password'))
+        self.assertEqual(self.verify(token), http_client.FORBIDDEN)
+
+
 class ChangePasswordsTest(UserTests):  # PUT /users/<user>/
     def test_user_doesnt_exist(self):
         resp = self.put('/users/%s/' % username3, {'password': password3, })
@@ -485,6 +871,40 @@ class GetAllPropertiesTests(PropertyTests):  # GET /users/<user>/props/
         self.assertDictEqual(self.parse(resp, 'dict'), {propkey3: propval3, })
 
 
+class GetSelectedPropertiesTests(PropertyTests):  # GET /users/<user>/props/?keys=...
+    def setUp(self):
+        super(GetSelectedPropertiesTests, self).setUp()
+        backend.create_property(user=username1, key=propkey1, value=propval1)
+        backend.create_property(user=username1, key=propkey2, value=propval2)
+
+    def test_keys(self):
+        resp = self.get('/users/%s/props/' % username1, {'keys': [propkey1]})
+        self.assertEqual(resp.status_code, http_client.OK)
+        self.assertDictEqual(self.parse(resp, 'dict'), {propkey1: propval1})
+
+        resp = self.get('/users/%s/props/' % username1, {'keys': [propkey1, propkey2, propkey3]})
+        self.assertEqual(resp.status_code, http_client.OK)
+        self.assertDictEqual(self.parse(resp, 'dict'), {propkey1: propval1, propkey2: propval2})
+
+        resp = self.get('/users/%s/props/' % username2, {'keys': [propkey1]})
+        self.assertEqual(resp.status_code, http_client.OK)
+        self.assertDictEqual(self.parse(resp, 'dict'), {})
+
+    def test_empty_keys(self):
+        resp = self.get('/users/%s/props/' % username1, {'keys': ''})
+        self.assertEqual(resp.status_code, http_client.OK)
+        self.assertDictEqual(self.parse(resp, 'dict'), {})
+
+        self.assertEqual(backend.get_properties(user=username1, keys=[]), {})
+
+    def test_user_doesnt_exist(self):
+        resp = self.get('/users/%s/props/' % username3, {'keys': [propkey1]})
+        self.assertEqual(resp.status_code, http_client.NOT_FOUND)
+        self.assertEqual(resp['Resource-Type'], 'user')
+
+        self.assertRaises(UserNotFound, backend.get_properties, user=username3, keys=[])
+
+
 class CreatePropertyTests(PropertyTests):  # POST /users/<user>/props/
     def test_user_doesnt_exist(self):
         resp = self.post('/users/%s/props/' % username3, {'prop': propkey1, 'value': propval1, })
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of RestAuth (https://restauth.net).
+#
+# RestAuth is free software: you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# RestAuth is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with RestAuth. If not,
+# see <http://www.gnu.org/licenses/>.
+
+"""Signed tokens that prove that a user recently authenticated with their password.
+
+A token contains the name of the user, the id of the service it was issued to and the current
+generation of the user. Verifying a token only requires computing an HMAC and reading the
+generation from a cache, so the (deliberately slow) password hasher is not used.
+
+The generation of a user is incremented whenever the password of the user changes or the user is
+removed (see :py:func:`revoke_tokens`), which invalidates all tokens issued before.
+"""
+
+from __future__ import unicode_literals
+
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+
+from common.tokens import sign
+from common.tokens import unsign
+
+_SALT = 'Users.tokens'
+
+
+def get_token_config():
+    """Get a tuple of the lifetime of tokens, the list of signing keys and the cache storing the
+    generations of users.
+
+    Returns ``None`` if tokens are disabled. Raises ``ImproperlyConfigured`` if no cache is
+    configured or the cache is local to the process, since other processes (including the command
+    line tools) would then not notice that tokens were revoked.
+    """
+    config = getattr(settings, 'USER_TOKENS', None)
+    if config is None:
+        return None
+    if not config.get('CACHE'):
+        raise ImproperlyConfigured("USER_TOKENS requires a CACHE.")
+    cache = caches[config['CACHE']]
+    if isinstance(cache, (LocMemCache, DummyCache)):
+        raise ImproperlyConfigured(
+            "USER_TOKENS: CACHE must be shared by all processes: %s" % config['CACHE'])
+    return (config.get('TIMEOUT', 300), list(config.get('KEYS') or [settings.SECRET_KEY]), cache)
+
+
+def _generation_key(name):
+    # usernames may contain characters that are not allowed in memcached keys
+    return 'restauth-user-generation:%s' % hashlib.sha256(name.encode('utf-8')).hexdigest()
+
+
+def _get_generation(cache, name):
+    key = _generation_key(name)
+    generation = cache.get(key)
+    if generation is None:  # never set or evicted, start with a generation that was never used
+        cache.add(key, int(time.time() * 1000), timeout=None)
+        generation = cache.get(key)
+    return generation
+
+
+def create_token(name, service):
+    """Create a token for the user ``name`` that is only valid for ``service``."""
+
+    timeout, keys, cache = get_token_config()
+    return sign([name, service.id, _get_generation(cache, name)], keys, _SALT)
+
+
+def verify_token(token, name, service):
+    """Check if ``token`` was issued for the user ``name`` to ``service`` and is still valid."""
+
+    config = get_token_config()
+    if config is None:
+        return False
+    timeout, keys, cache = config
+
+    data = unsign(token, keys, _SALT, timeout)
+    if data is None:
+        return False
+
+    token_name, service_id, generation = data
+    return token_name == name and service_id == service.id and \
+        generation == _get_generation(cache, name)
+
+
+def revoke_tokens(name):
+    """Invalidate all tokens of the user ``name``.
+
+    Called when the password of the user changes or the user is removed.
+    """
+    config = get_token_config()
+    if config is None:
+        return
+
+    cache = config[2]
+    key = _generation_key(name)
+    try:
+        cache.incr(key)
+    except ValueError:  # key does not exist (yet)
+        cache.add(key, int(time.time() * 1000), timeout=None)
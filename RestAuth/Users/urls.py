@@ -19,15 +19,23 @@ from django.conf.urls import url
 
 from Services.decorator import login_required
 from Users.views import UserHandlerView
+from Users.views import UserProfileView
 from Users.views import UserPropHandler
 from Users.views import UserPropsIndex
 from Users.views import UsersView
+from Users.views import UserTokenView
 
 urlpatterns = [
     url(r'^$', login_required(realm='/users/')(UsersView.as_view()), name="users"),
     url(r'^(?P<name>[^/]+)/$',
         login_required(realm='/users/<user>/')(UserHandlerView.as_view()),
         name="users.user"),
+    url(r'^(?P<name>[^/]+)/profile/$',
+        login_required(realm='/users/<user>/profile/')(UserProfileView.as_view()),
+        name='users.user.profile'),
+    url(r'^(?P<name>[^/]+)/token/$',
+        login_required(realm='/users/<user>/token/')(UserTokenView.as_view()),
+        name='users.user.token'),
     url(r'^(?P<name>[^/]+)/props/$',
         login_required(realm='/users/<user>/props/')(UserPropsIndex.as_view()),
         name='users.user.props'),
@@ -18,6 +18,7 @@
 from __future__ import unicode_literals
 
 import logging
+from collections import Counter
 from datetime import datetime
 
 from django.conf import settings
@@ -28,15 +29,26 @@ from RestAuthCommon.strprep import stringcheck
 
 from backends import backend
 from common.errors import PasswordInvalid
+from common.errors import UserExists
 from common.errors import UserNotFound
+from common.middleware import exception_response
+from common.models import Change
 from common.responses import HttpResponseCreated
 from common.responses import HttpResponseNoContent
+from common.responses import HttpResponseNotImplemented
 from common.responses import HttpRestAuthResponse
+from common.responses import HttpRestAuthStreamingResponse
+from common.types import assert_format
+from common.types import parse_body
 from common.types import parse_dict
 from common.views import RestAuthResourceView
 from common.views import RestAuthSubResourceView
 from common.views import RestAuthView
 
+from .tokens import create_token
+from .tokens import get_token_config
+from .tokens import revoke_tokens
+from .tokens import verify_token
 from .validators import validate_username
 
 
@@ -65,16 +77,14 @@ class UsersView(RestAuthView):
         if not request.user.has_perm('Users.users_list'):
             return HttpResponseForbidden()
 
-        names = [n.lower() for n in backend.list_users()]
-        return HttpRestAuthResponse(request, names)
+        names = (n.lower() for n in backend.list_users())
+        return HttpRestAuthStreamingResponse(request, names)
 
-    def post(self, request, largs, dry=False):
-        """Create a new user."""
-
-        if not request.user.has_perm('Users.user_create'):
-            return HttpResponseForbidden()
+    def _parse_user(self, request, data):
+        """Parse and normalize a single user of a POST request."""
 
-        name, password, properties, groups = self._parse_post(request)
+        name, password, properties, groups = assert_format(
+            data=data, required=self.post_required, optional=self.post_optional)
         name = stringcheck(name)
 
         # If UsernameInvalid: 412 Precondition Failed
@@ -102,13 +112,83 @@ class UsersView(RestAuthView):
         if groups:
             groups = [(stringcheck(g), request.user) for g in groups]
 
+        return name, password, properties, groups
+
+    def post(self, request, largs, dry=False):
+        """Create a new user or, if the body is a list, multiple users."""
+
+        if not request.user.has_perm('Users.user_create'):
+            return HttpResponseForbidden()
+
+        data = parse_body(request)
+        if isinstance(data, list):
+            return self._post_many(request, largs, data, dry=dry)
+        assert isinstance(data, dict), "Request body is not a dictionary."
+
+        name, password, properties, groups = self._parse_user(request, data)
+
         # If UserExists: 409 Conflict
         backend.create_user(user=name, password=password, properties=properties, groups=groups,
                             dry=dry)
         self.log.info('%s: Created user', name, extra=largs)
 
+        if not dry:
+            Change.objects.user(name, Change.CREATED)
+            Change.objects.members_changed(groups or [])
+
         return HttpResponseCreated()
 
+    def _error(self, name, ex):
+        response = exception_response(ex)
+        if response is None:
+            raise ex
+        return {'user': name, 'status': response.status_code,
+                'error': response.content.decode('utf-8')}
+
+    def _post_many(self, request, largs, data, dry=False):
+        """Create multiple users with a single call to the backend.
+
+        Returns a list with the status code (and an error message, if any) for every user in the
+        same order as in the request. Invalid users do not prevent other users from being created.
+        """
+
+        results = []
+        users = []
+        for entry in data:
+            try:
+                assert isinstance(entry, dict), "User is not a dictionary: %s" % entry
+                user = self._parse_user(request, dict(entry))
+            except Exception as e:
+                name = entry.get('user') if isinstance(entry, dict) else None
+                results.append(self._error(name, e))
+            else:
+                results.append({'user': user[0], 'status': 201})
+                users.append(user)
+
+        # Only the first occurrence of a user that does not yet exist was created
+        created = Counter(u[0] for u in users)
+        created.subtract(backend.create_users(users, dry=dry))
+
+        changes = []
+        groups_changed = []
+        valid = [i for i, r in enumerate(results) if r['status'] == 201]
+        for i, (name, password, properties, groups) in zip(valid, users):
+            if created[name] <= 0:
+                results[i] = self._error(name, UserExists(name))  # 409 Conflict
+                continue
+            created[name] -= 1
+
+            self.log.info('%s: Created user', name, extra=largs)
+            changes.append((Change.USER, name, Change.CREATED, None))
+            groups_changed += groups or []
+
+        if not dry:
+            for group, service in Change.objects.inheriting(groups_changed):
+                changes.append((Change.GROUP, group, Change.CHANGED, service))
+            Change.objects.record_many(changes)
+
+        return HttpRestAuthResponse(request, results)
+
 
 class UserHandlerView(RestAuthResourceView):
     """Handle requests to ``/users/<user>/``."""
@@ -118,6 +198,7 @@ class UserHandlerView(RestAuthResourceView):
     post_required = (('password', six.string_types),)
     post_optional = (
         ('groups', list),
+        ('token', bool),
     )
     put_optional = (('password', six.string_types),)
 
@@ -133,21 +214,34 @@ class UserHandlerView(RestAuthResourceView):
             raise UserNotFound(name)  # 404 Not Found
 
     def post(self, request, largs, name):
-        """Verify a users password."""
+        """Verify a users password.
+
+        If ``token`` is true, the response contains a token that can be verified with
+        ``POST /users/<user>/token/`` instead of the password.
+        """
 
         if not request.user.has_perm('Users.user_verify_password'):
             return HttpResponseForbidden()
 
         # If BadRequest: 400 Bad Request
-        password, groups = self._parse_post(request)
+        password, groups, token = self._parse_post(request)
         if groups is not None:
             groups = [(group, request.user) for group in groups]
 
-        if backend.check_password(user=name, password=password, groups=groups):
-            return HttpResponseNoContent()
-        else:
+        config = get_token_config()
+        if token and config is None:
+            return HttpResponseNotImplemented()
+
+        if not backend.check_password(user=name, password=password, groups=groups):
             raise UserNotFound(name)
 
+        if token:
+            return HttpRestAuthResponse(request, {
+                'token': create_token(name, request.user),
+                'expires': config[0],
+            })
+        return HttpResponseNoContent()
+
     def put(self, request, largs, name):
         """Change a users password."""
 
@@ -164,6 +258,8 @@ class UserHandlerView(RestAuthResourceView):
 
         # If UserNotFound: 404 Not Found
         backend.set_password(user=name, password=password)
+        revoke_tokens(name)
+        Change.objects.user(name, Change.CHANGED)
         return HttpResponseNoContent()
 
     def delete(self, request, largs, name):
@@ -174,9 +270,85 @@ class UserHandlerView(RestAuthResourceView):
 
         # If UserNotFound: 404 Not Found
         backend.remove_user(user=name)
+        revoke_tokens(name)
+        Change.objects.user(name, Change.DELETED)
+        return HttpResponseNoContent()
+
+
+class UserTokenView(RestAuthResourceView):
+    """Handle requests to ``/users/<user>/token/``."""
+
+    http_method_names = ['post']
+    log = logging.getLogger('users.user.token')
+    post_required = (('token', six.string_types),)
+    post_optional = (
+        ('groups', list),
+    )
+
+    def post(self, request, largs, name):
+        """Verify a token created by ``POST /users/<user>/``.
+
+        If ``groups`` is given, the user must also be a member in at least one of the groups, with
+        the same semantics as when verifying the password.
+        """
+
+        if not request.user.has_perm('Users.user_verify_password'):
+            return HttpResponseForbidden()
+        if get_token_config() is None:
+            return HttpResponseNotImplemented()
+
+        # If BadRequest: 400 Bad Request
+        token, groups = self._parse_post(request)
+
+        if not verify_token(token, name, request.user):
+            raise UserNotFound(name)
+
+        if groups is not None:
+            for group in groups:
+                # If GroupNotFound or UserNotFound: 404 Not Found
+                if backend.is_member(group=group, service=request.user, user=name):
+                    break
+            else:
+                raise UserNotFound(name)
         return HttpResponseNoContent()
 
 
+class UserProfileView(RestAuthResourceView):
+    """Handle requests to ``/users/<user>/profile/``."""
+
+    http_method_names = ['post']
+    log = logging.getLogger('users.user.profile')
+    post_required = (('password', six.string_types),)
+    post_optional = (
+        ('groups', list),
+        ('properties', list),
+    )
+
+    def post(self, request, largs, name):
+        """Verify a users password and get the properties and groups of the user."""
+
+        if not request.user.has_perms(['Users.user_verify_password', 'Users.props_list',
+                                       'Groups.groups_for_user']):
+            return HttpResponseForbidden()
+
+        # If BadRequest: 400 Bad Request
+        password, groups, keys = self._parse_post(request)
+        if keys is not None:
+            keys = [stringcheck(k) for k in keys]
+
+        # If UserNotFound or GroupNotFound: 404 Not Found
+        profile = backend.authenticate(user=name, password=password, service=request.user,
+                                       groups=groups, keys=keys)
+        if profile is None:
+            raise UserNotFound(name)
+
+        properties, groups = profile
+        return HttpRestAuthResponse(request, {
+            'properties': properties,
+            'groups': [g.lower() for g in groups],
+        })
+
+
 class UserPropsIndex(RestAuthResourceView):
     """Handle requests to ``/users/<user>/props/``."""
 
@@ -185,13 +357,18 @@ class UserPropsIndex(RestAuthResourceView):
     post_required = (('prop', six.string_types), ('value', six.string_types),)
 
     def get(self, request, largs, name):
-        """Get all properties of a user."""
+        """Get all properties of a user or, if the ``keys`` parameter is given, only the properties
+        with the given keys."""
 
         if not request.user.has_perm('Users.props_list'):
             return HttpResponseForbidden()
 
+        keys = None
+        if 'keys' in request.GET:
+            keys = [stringcheck(k) for k in request.GET.getlist('keys')]
+
         # If UserNotFound: 404 Not Found
-        props = backend.get_properties(user=name)
+        props = backend.get_properties(user=name, keys=keys)
         return HttpRestAuthResponse(request, props)
 
     def post(self, request, largs, name, dry=False):
@@ -207,6 +384,8 @@ class UserPropsIndex(RestAuthResourceView):
         # If UserNotFound: 404 Not Found
         # If PropertyExists: 409 Conflict
         backend.create_property(user=name, key=key, value=value, dry=dry)
+        if not dry:
+            Change.objects.user(name, Change.CHANGED)
 
         self.log.info('Created property "%s" as "%s"', key, value, extra=largs)
         return HttpResponseCreated()
@@ -221,6 +400,7 @@ class UserPropsIndex(RestAuthResourceView):
 
         # If UserNotFound: 404 Not Found
         backend.set_properties(user=name, properties=properties)
+        Change.objects.user(name, Change.CHANGED)
         return HttpResponseNoContent()
 
 
@@ -256,6 +436,7 @@ class UserPropHandler(RestAuthSubResourceView):
 
         # If UserNotFound: 404 Not Found
         old_value = backend.set_property(user=name, key=subname, value=value)
+        Change.objects.user(name, Change.CHANGED)
 
         if old_value is None:  # new property
             self.log.info('Set to "%s"', value, extra=largs)
@@ -276,4 +457,5 @@ class UserPropHandler(RestAuthSubResourceView):
 
         # If UserNotFound: 404 Not Found
         backend.remove_property(user=name, key=subname)
+        Change.objects.user(name, Change.CHANGED)
         return HttpResponseNoContent()
@@ -19,12 +19,18 @@ from django.conf import settings
 from django.utils.module_loading import import_string
 
 
-def get_backend():
-    config = getattr(settings, 'DATA_BACKEND', {
-        'BACKEND': 'backends.django.DjangoBackend',
-    }).copy()
+def load_backend(config):
+    """Load a backend from a dictionary in the format of :setting:`DATA_BACKEND`."""
+
+    config = config.copy()
     backend_cls = import_string(config.pop('BACKEND', 'backends.django.DjangoBackend'))
     return backend_cls(**config)
 
 
+def get_backend():
+    return load_backend(getattr(settings, 'DATA_BACKEND', {
+        'BACKEND': 'backends.django.DjangoBackend',
+    }))
+
+
 backend = get_backend()
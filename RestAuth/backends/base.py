@@ -18,6 +18,9 @@ from __future__ import unicode_literals
 
 import importlib
 
+from common.errors import GroupNotFound
+from common.errors import UserExists
+
 
 class TransactionManagerBase(object):
     def __init__(self, backend, dry=False):
@@ -38,6 +41,7 @@ class BackendBase(object):  # pragma: no cover
     TRANSACTION_MANAGER = None
     SUPPORTS_GROUP_VISIBILITY = True
     SUPPORTS_SUBGROUPS = True
+    SUPPORTS_TRANSACTION_READS = True  # reads in a transaction see the writes of the transaction
 
     def _load_library(self):
         if self._library is not None:
@@ -115,9 +119,41 @@ class BackendBase(object):  # pragma: no cover
         """
         raise NotImplementedError
 
+    def create_users(self, users, dry=False):
+        """Create multiple users at once.
+
+        ``users`` is a list of tuples of the username, password, properties and groups of each user,
+        with the same meaning as the parameters of :py:meth:`create_user`. Users that already exist
+        (or that occur more than once in the list) are skipped, all other users are created.
+
+        The default implementation calls :py:meth:`create_user` for every user. Backends should
+        override this method if they can create many users more efficiently.
+
+        :param users: The users to create.
+        :type  users: list
+        :param   dry: Wether or not to actually create the users.
+        :type    dry: boolean
+        :return: A list of all users that were not created because they already exist.
+        """
+        existing = []
+        seen = set()
+        for user, password, properties, groups in users:
+            try:
+                if user in seen:
+                    raise UserExists(user)
+                seen.add(user)
+                self.create_user(user=user, password=password, properties=properties,
+                                 groups=groups, dry=dry)
+            except UserExists:
+                existing.append(user)
+        return existing
+
     def list_users(self):
         """Get a list of all users.
 
+        Backends with many users may return a generator instead of a list, ``GET /users/`` then
+        streams the response as the generator is consumed.
+
         :return: A list of usernames.
         :rtype: list
         """
@@ -166,6 +202,55 @@ class BackendBase(object):  # pragma: no cover
         """
         raise NotImplementedError
 
+    def authenticate(self, user, password, service, groups=None, keys=None):
+        """Check a users password and get the properties and groups of the user.
+
+        This is equivalent to calling :py:meth:`check_password`, :py:meth:`get_properties` and
+        :py:meth:`list_groups`, but backends should override this method if they can fetch all data
+        with fewer queries.
+
+        :param user: The username.
+        :type  user: str
+        :param password: The password to check.
+        :type  password: str
+        :param service: The service of the groups.
+        :type  service: :py:class:`~Services.models.Service`
+        :param groups: A list of group names of the given service. If given, the user must be a
+            member in at least one of the groups.
+        :type  groups: list
+        :param keys: Only return the properties with the given keys.
+        :type  keys: list
+        :return: ``None`` if the password is not correct or the user is not a member in any of the
+            given groups. Otherwise, a tuple of the properties and a list of all groups of the user.
+        :rtype: tuple
+        :raise: :py:class:`~common.errors.UserNotFound` if the user doesn't exist.
+        :raise: :py:class:`~common.errors.GroupNotFound` if a group doesn't exist, with the same
+            semantics as :py:meth:`check_password`.
+        """
+        if not self.check_password(user=user, password=password):
+            return None
+
+        memberships = list(self.list_groups(service=service, user=user))
+        if groups is not None and not self._member_of_any(groups, service, memberships):
+            return None
+
+        return self.get_properties(user=user, keys=keys), memberships
+
+    def _member_of_any(self, groups, service, memberships):
+        """Check if one of ``groups`` is in ``memberships``, the groups of a user.
+
+        Like calling :py:meth:`is_member` for every group in order, a group that does not exist
+        raises :py:class:`~common.errors.GroupNotFound` unless the user is a member of one of the
+        groups before it.
+        """
+        memberships = set(memberships)
+        for group in groups:
+            if group in memberships:
+                return True
+            if not self.group_exists(group=group, service=service):
+                raise GroupNotFound(group, service=service)
+        return False
+
     def set_password(self, user, password=None):
         """Set a new password.
 
@@ -206,11 +291,14 @@ class BackendBase(object):  # pragma: no cover
         """
         raise NotImplementedError
 
-    def get_properties(self, user):
+    def get_properties(self, user, keys=None):
         """Get a full list of all user properties.
 
         :param user: The username.
         :type  user: str
+        :param keys: If given, only return the properties with the given keys. Keys that the user
+            does not have are ignored.
+        :type  keys: list
         :return: A dictionary of key/value pairs, each describing a property.
         :rtype: dict
         :raise: :py:class:`~common.errors.UserNotFound` if the user doesn't exist.
@@ -433,7 +521,8 @@ class BackendBase(object):  # pragma: no cover
         :param depth: Override the recursion depth to use for meta-groups.  Normally, the backend
             should use :setting:`GROUP_RECURSION_DEPTH`.
         :type  depth: int
-        :return: list of strings, each representing a username
+        :return: list of strings, each representing a username. Like :py:meth:`list_users`, this may
+            also be a generator.
         :rtype: list
         :raise: :py:class:`common.errors.GroupNotFound` if the named group does not exist.
         """
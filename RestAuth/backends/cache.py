@@ -0,0 +1,472 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of RestAuth (https://restauth.net).
+#
+# RestAuth is free software: you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# RestAuth is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with RestAuth. If not,
+# see <http://www.gnu.org/licenses/>.
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import threading
+import time
+from collections import OrderedDict
+from collections import defaultdict
+
+from django.conf import settings
+
+from backends import load_backend
+from backends.base import BackendBase
+from common.errors import GroupNotFound
+from common.errors import UserNotFound
+from common.invalidation import get_invalidation_bus
+
+# Tags of cache entries. Every entry is tagged with the data it depends on, invalidating a tag
+# removes all entries with that tag.
+_USER = 'user'  # ('user', user): user_exists, get_properties, get_property, list_groups, is_member
+_GROUP = 'group'  # ('group', service name, group): members
+_GROUPS = ('groups', )  # list_groups and is_member of any service and user
+_MEMBERS = ('members', )  # members of any group
+
+
+class LRUCache(object):
+    """Thread-safe, bounded cache with a timeout for every entry.
+
+    If the cache holds ``max_entries`` entries, the least recently used entry is removed. Entries
+    are tagged with what they depend on, :py:meth:`invalidate` removes all entries with a tag.
+
+    To avoid storing stale data, callers read :py:attr:`generation` before fetching a value and
+    pass it to :py:meth:`set`. The value is not stored if an invalidation happened in the meantime.
+    """
+
+    def __init__(self, max_entries=10000, timeout=300):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.generation = 0
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires, tags, value)
+        self._tags = defaultdict(set)  # tag -> keys
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    def _remove(self, key):
+        expires, tags, value = self._entries.pop(key)
+        for tag in tags:
+            keys = self._tags[tag]
+            keys.discard(key)
+            if not keys:
+                del self._tags[tag]
+
+    def get(self, key):
+        """Get a tuple of a boolean indicating if the key was found and the value."""
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.time():
+                self._remove(key)
+                entry = None
+
+            if entry is None:
+                self._stats['misses'] += 1
+                return False, None
+
+            # move the entry to the end, so it is evicted last
+            del self._entries[key]
+            self._entries[key] = entry
+            self._stats['hits'] += 1
+            return True, entry[2]
+
+    def set(self, key, value, tags, generation):
+        with self._lock:
+            if generation != self.generation:  # invalidated while the value was fetched
+                return
+
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.time() + self.timeout, tags, value)
+            for tag in tags:
+                self._tags[tag].add(key)
+
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self._stats['evictions'] += 1
+
+    def invalidate(self, tags):
+        with self._lock:
+            self.generation += 1
+            for tag in tags:
+                for key in list(self._tags.get(tag, ())):
+                    self._remove(key)
+                    self._stats['invalidations'] += 1
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._tags.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, entries=len(self._entries))
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = float(stats['hits']) / lookups if lookups else 0.0
+        return stats
+
+
+class CachingTransactionManager(object):
+    """Transaction manager wrapping the transaction manager of the cached backend.
+
+    Inside a transaction, the cache is bypassed and all entries that are invalidated by the
+    transaction are invalidated again when it ends, so other threads cannot cache data that was
+    read before the transaction was committed.
+    """
+
+    def __init__(self, backend, dry=False):
+        self.backend = backend
+        self.transaction = backend.backend.transaction(dry=dry)
+
+    def __enter__(self):
+        local = self.backend._local
+        if not getattr(local, 'depth', 0):
+            local.tags = set()
+        local.depth = getattr(local, 'depth', 0) + 1
+        return self.transaction.__enter__()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            return self.transaction.__exit__(exc_type, exc_value, traceback)
+        finally:
+            local = self.backend._local
+            local.depth -= 1
+            if local.depth == 0:
+                self.backend._publish(local.tags)
+
+
+class CachingBackend(BackendBase):
+    """Backend caching the results of another backend in memory.
+
+    ``user_exists``, ``get_properties``, ``get_property``, ``list_groups``, ``members`` and
+    ``is_member`` are cached. Any change made through RestAuth invalidates exactly the entries it
+    affects, including members inherited through nested groups. Renaming or removing users and
+    changes to the group hierarchy (renaming, removing or moving groups and changing subgroups)
+    invalidate larger parts of the cache.
+
+    Note that the cache is local to every process. If RestAuth runs in multiple processes or on
+    multiple nodes, configure :setting:`CACHE_INVALIDATION` so that invalidations are sent to all
+    other processes. Changes made with the command line scripts or directly in the data store are
+    only visible after the timeout.
+
+    The backend supports the following options in :setting:`DATA_BACKEND`:
+
+    ``WRAPPED``
+        The configuration of the cached backend, in the same format as :setting:`DATA_BACKEND`
+        itself. The default is to cache the :py:class:`~backends.django.DjangoBackend`.
+    ``TIMEOUT``
+        Seconds that an entry is cached.
+    ``MAX_ENTRIES``
+        Maximum number of cached entries. If the cache is full, the least recently used entry is
+        removed.
+
+    Example::
+
+        DATA_BACKEND = {
+            'BACKEND': 'backends.cache.CachingBackend',
+            'WRAPPED': {
+                'BACKEND': 'backends.redis.RedisBackend',
+                'HOST': 'redis.example.com',
+            },
+            'TIMEOUT': 60,
+        }
+
+    Hit and miss statistics are available from :py:meth:`stats`.
+
+    .. versionadded:: 0.7.2
+    """
+
+    TRANSACTION_MANAGER = CachingTransactionManager
+
+    def __init__(self, WRAPPED=None, TIMEOUT=300, MAX_ENTRIES=10000):
+        if WRAPPED is None:
+            WRAPPED = {'BACKEND': 'backends.django.DjangoBackend'}
+
+        self.backend = load_backend(WRAPPED)
+        self.cache = LRUCache(max_entries=MAX_ENTRIES, timeout=TIMEOUT)
+        self._local = threading.local()
+
+        self.bus = None
+        bus = get_invalidation_bus()
+        if bus is not None:
+            self.subscribe(bus)
+
+        self.SUPPORTS_GROUP_VISIBILITY = self.backend.SUPPORTS_GROUP_VISIBILITY
+        self.SUPPORTS_SUBGROUPS = self.backend.SUPPORTS_SUBGROUPS
+        self.SUPPORTS_TRANSACTION_READS = self.backend.SUPPORTS_TRANSACTION_READS
+
+    def __getattr__(self, name):
+        # backend-specific methods, e.g. RedisBackend.rebuild_memberships()
+        if name == 'backend':  # not yet set in __init__()
+            raise AttributeError(name)
+        return getattr(self.backend, name)
+
+    def subscribe(self, bus):
+        """Publish invalidations to and receive them from an :py:class:`InvalidationBus`."""
+
+        self.bus = bus
+        bus.subscribe(self.cache.invalidate, self.cache.clear)
+
+    def stats(self):
+        """Get a dictionary with the number of hits, misses, evictions and invalidations."""
+
+        return self.cache.stats()
+
+    def _cached(self, key, tags, func, *args, **kwargs):
+        if getattr(self._local, 'depth', 0):  # inside a transaction
+            return func(*args, **kwargs)
+
+        found, value = self.cache.get(key)
+        if found:
+            return value
+
+        generation = self.cache.generation
+        value = func(*args, **kwargs)
+        self.cache.set(key, value, tags, generation)
+        return value
+
+    def _invalidate(self, *tags):
+        if getattr(self._local, 'depth', 0):  # other nodes are notified after the transaction
+            self._local.tags.update(tags)
+            self.cache.invalidate(tags)
+        else:
+            self._publish(tags)
+
+    def _publish(self, tags):
+        self.cache.invalidate(tags)
+        if self.bus is not None and tags:
+            self.bus.publish(tags)
+
+    def _user(self, user):
+        return (_USER, user)
+
+    def _group(self, group, service):
+        # tags are sent to other nodes, so they contain the name of the service
+        return (_GROUP, getattr(service, 'username', service), group)
+
+    def _descendants(self, group, service):
+        """Get tags for the group and all groups that inherit its members."""
+
+        tags = set([self._group(group, service)])
+        if not self.backend.SUPPORTS_SUBGROUPS:
+            return tags
+
+        level = [(group, service)]
+        for i in range(settings.GROUP_RECURSION_DEPTH + 1):
+            subgroups = []
+            for name, subservice in level:
+                try:
+                    subgroups += self.backend.subgroups(name, subservice, filter=False)
+                except GroupNotFound:
+                    pass
+
+            level = [g for g in subgroups if self._group(*g) not in tags]
+            if not level:
+                break
+            tags.update(self._group(*g) for g in level)
+        return tags
+
+    def testSetUp(self):
+        self.cache.clear()
+        self.backend.testSetUp()
+
+    def testTearDown(self):
+        self.cache.clear()
+        self.backend.testTearDown()
+
+    def create_user(self, user, password=None, properties=None, groups=None, dry=False):
+        self.backend.create_user(user, password=password, properties=properties, groups=groups,
+                                 dry=dry)
+        if dry is False:
+            tags = set([self._user(user)])
+            for group, service in groups or []:
+                tags |= self._descendants(group, service)
+            if groups:  # groups might have been created
+                tags.add(_GROUPS)
+            self._invalidate(*tags)
+
+    def create_users(self, users, dry=False):
+        existing = self.backend.create_users(users, dry=dry)
+        if dry is False:
+            tags = set()
+            for user, password, properties, groups in users:
+                tags.add(self._user(user))
+                for group, service in groups or []:
+                    tags |= self._descendants(group, service)
+                if groups:
+                    tags.add(_GROUPS)
+            if tags:
+                self._invalidate(*tags)
+        return existing
+
+    def list_users(self):
+        return self.backend.list_users()
+
+    def user_exists(self, user):
+        return self._cached(('user_exists', user), (self._user(user), ),
+                            self.backend.user_exists, user)
+
+    def rename_user(self, user, name):
+        self.backend.rename_user(user, name)
+        self._invalidate(self._user(user), self._user(name), _MEMBERS)
+
+    def check_password(self, user, password, groups=None):
+        return self.backend.check_password(user, password, groups=groups)
+
+    def set_password(self, user, password=None):
+        return self.backend.set_password(user, password=password)
+
+    def set_password_hash(self, user, algorithm, hash):
+        return self.backend.set_password_hash(user, algorithm, hash)
+
+    def remove_user(self, user):
+        self.backend.remove_user(user)
+        self._invalidate(self._user(user), _MEMBERS)
+
+    def get_properties(self, user, keys=None):
+        if keys is not None:
+            keys = tuple(sorted(set(keys)))
+        properties = self._cached(('get_properties', user, keys), (self._user(user), ),
+                                  self.backend.get_properties, user, keys=keys)
+        return properties.copy()
+
+    def create_property(self, user, key, value, dry=False):
+        value = self.backend.create_property(user, key, value, dry=dry)
+        if dry is False:
+            self._invalidate(self._user(user))
+        return value
+
+    def get_property(self, user, key):
+        return self._cached(('get_property', user, key), (self._user(user), ),
+                            self.backend.get_property, user, key)
+
+    def set_property(self, user, key, value):
+        old_value = self.backend.set_property(user, key, value)
+        self._invalidate(self._user(user))
+        return old_value
+
+    def set_properties(self, user, properties):
+        self.backend.set_properties(user, properties)
+        self._invalidate(self._user(user))
+
+    def remove_property(self, user, key):
+        self.backend.remove_property(user, key)
+        self._invalidate(self._user(user))
+
+    def list_groups(self, service, user=None):
+        tags = (_GROUPS, ) if user is None else (_GROUPS, self._user(user))
+        return list(self._cached(('list_groups', service, user), tags,
+                                 self.backend.list_groups, service, user=user))
+
+    def create_group(self, group, service, users=None, dry=False):
+        self.backend.create_group(group, service, users=users, dry=dry)
+        if dry is False:
+            self._invalidate(_GROUPS, self._group(group, service),
+                             *[self._user(user) for user in users or []])
+
+    def rename_group(self, group, name, service):
+        tags = self._descendants(group, service)
+        self.backend.rename_group(group, name, service)
+        self._invalidate(_GROUPS, self._group(name, service), *tags)
+
+    def set_service(self, group, service, new_service):
+        tags = self._descendants(group, service)
+        self.backend.set_service(group, service, new_service)
+        self._invalidate(_GROUPS, self._group(group, new_service), *tags)
+
+    def group_exists(self, group, service):
+        return self.backend.group_exists(group, service)
+
+    def set_memberships(self, user, service, groups):
+        tags = set([self._user(user)])
+        try:  # inherited memberships include all groups inheriting from the current groups
+            tags.update(self._group(g, service) for g in self.backend.list_groups(service, user))
+        except UserNotFound:
+            pass  # the backend raises the error again
+
+        try:
+            self.backend.set_memberships(user, service, groups)
+        finally:
+            for group in groups:
+                tags |= self._descendants(group, service)
+            self._invalidate(_GROUPS, *tags)
+
+    def set_members(self, group, service, users):
+        tags = self._descendants(group, service)
+        try:
+            tags.update(self._user(u) for u in self.backend.members(group, service, depth=0))
+        except GroupNotFound:
+            pass  # the backend raises the error again
+
+        try:
+            self.backend.set_members(group, service, users)
+        finally:
+            self._invalidate(*(tags | set(self._user(user) for user in users)))
+
+    def add_member(self, group, service, user):
+        self.backend.add_member(group, service, user)
+        self._invalidate(self._user(user), *self._descendants(group, service))
+
+    def members(self, group, service, depth=None):
+        return list(self._cached(('members', service, group, depth),
+                                 (_MEMBERS, self._group(group, service)),
+                                 self.backend.members, group, service, depth=depth))
+
+    def is_member(self, group, service, user):
+        return self._cached(('is_member', service, group, user),
+                            (_GROUPS, self._user(user)),
+                            self.backend.is_member, group, service, user)
+
+    def remove_member(self, group, service, user):
+        self.backend.remove_member(group, service, user)
+        self._invalidate(self._user(user), *self._descendants(group, service))
+
+    def add_subgroup(self, group, service, subgroup, subservice):
+        self.backend.add_subgroup(group, service, subgroup, subservice)
+        self._invalidate(_GROUPS, *self._descendants(subgroup, subservice))
+
+    def set_subgroups(self, group, service, subgroups, subservice):
+        tags = set()
+        for subgroup in self.backend.subgroups(group, service, filter=False):
+            tags |= self._descendants(*subgroup)
+
+        try:
+            self.backend.set_subgroups(group, service, subgroups, subservice)
+        finally:
+            for subgroup in subgroups:
+                tags |= self._descendants(subgroup, subservice)
+            self._invalidate(_GROUPS, *tags)
+
+    def is_subgroup(self, group, service, subgroup, subservice):
+        return self.backend.is_subgroup(group, service, subgroup, subservice)
+
+    def remove_subgroup(self, group, service, subgroup, subservice):
+        tags = self._descendants(subgroup, subservice)
+        self.backend.remove_subgroup(group, service, subgroup, subservice)
+        self._invalidate(_GROUPS, *tags)
+
+    def subgroups(self, group, service, filter=True):
+        return self.backend.subgroups(group, service, filter=filter)
+
+    def parents(self, group, service):
+        return self.backend.parents(group, service)
+
+    def remove_group(self, group, service):
+        tags = self._descendants(group, service)
+        self.backend.remove_group(group, service)
+        self._invalidate(_GROUPS, *tags)
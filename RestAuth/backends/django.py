@@ -19,6 +19,7 @@ from __future__ import unicode_literals
 from contextlib import contextmanager
 
 from django.db import transaction
+from django.db.models import Q
 from django.db.utils import IntegrityError
 import six
 
@@ -31,6 +32,7 @@ from common.errors import UserExists
 from common.errors import UserNotFound
 from common.hashers import import_hash
 from Groups.models import Group
+from Groups.models import GroupClosure
 from Users.models import Property
 from Users.models import ServiceUser as User
 
@@ -51,8 +53,22 @@ def dry_run_manager(dry=False):
 
 
 class DjangoBackend(BackendBase):
-    def __init__(self, USING=None):
+    """Default backend storing all data in the database configured in :setting:`DATABASES`.
+
+    The backend supports the following options in :setting:`DATA_BACKEND`:
+
+    ``USING``
+        The database alias to use.
+    ``GROUP_CLOSURE``
+        Set to ``True`` to maintain a table of all nested group relations and use it for all
+        membership checks. Every membership check becomes a single indexed lookup at the expense
+        of more expensive changes to subgroups. After enabling this option (or if you modified
+        subgroups without it), you have to run ``restauth-manage.py groupclosure``.
+    """
+
+    def __init__(self, USING=None, GROUP_CLOSURE=False):
         self.db = USING
+        self.closure = GROUP_CLOSURE
 
     def _user(self, username, *fields):
         try:
@@ -92,6 +108,63 @@ class DjangoBackend(BackendBase):
                         _groups.append(Group.objects.create(service=service, name=name))
                 user.group_set.add(*_groups)
 
+    def _chunks(self, items, size=500):
+        items = list(items)
+        for i in range(0, len(items), size):
+            yield items[i:i + size]
+
+    def _create_users(self, users):
+        existing = []
+        names = set()
+        for chunk in self._chunks(set(u[0] for u in users)):
+            names.update(User.objects.filter(username__in=chunk).values_list('username', flat=True))
+
+        new_users = []
+        for user, password, properties, groups in users:
+            if user in names:
+                existing.append(user)
+                continue
+            names.add(user)
+
+            obj = User(username=user)
+            obj.set_password(password)
+            new_users.append((obj, properties, groups))
+        User.objects.bulk_create([u[0] for u in new_users], batch_size=500)
+
+        # not all databases return primary keys from bulk_create()
+        ids = {}
+        for chunk in self._chunks(u[0].username for u in new_users):
+            ids.update(User.objects.filter(username__in=chunk).values_list('username', 'id'))
+
+        properties = []
+        memberships = []
+        groups = {}
+        for user, props, user_groups in new_users:
+            uid = ids[user.username]
+            for key, value in six.iteritems(props or {}):
+                properties.append(Property(user_id=uid, key=key, value=value))
+            for name, service in user_groups or []:
+                if (name, service) not in groups:
+                    try:
+                        groups[(name, service)] = Group.objects.get(service=service, name=name).id
+                    except Group.DoesNotExist:
+                        groups[(name, service)] = Group.objects.create(service=service, name=name).id
+                memberships.append((groups[(name, service)], uid))
+
+        Property.objects.bulk_create(properties, batch_size=500)
+        through = Group.users.through
+        through.objects.bulk_create([through(group_id=gid, serviceuser_id=uid)
+                                     for gid, uid in set(memberships)], batch_size=500)
+        return existing
+
+    def create_users(self, users, dry=False):
+        with self.transaction(dry=dry):
+            try:
+                with transaction.atomic():
+                    return self._create_users(users)
+            except IntegrityError:  # users were created concurrently, create them one by one
+                return super(DjangoBackend, self).create_users(users)
+
     def list_users(self):
         return list(User.objects.values_list('username', flat=True))
 
@@ -107,18 +180,53 @@ class DjangoBackend(BackendBase):
             raise UserExists("User already exists.")
 
     def check_password(self, user, password, groups=None):
-        if not self._user(user, 'password').check_password(password):
+        user = self._user(user, 'id', 'password')
+        if not user.check_password(password):
             return False  # return fast if password is incorrect.
         if groups is None:
             return True  # if no groups are given, we're ok.
+        if not groups:
+            return False
 
-        # TODO: this could be faster. from list_groups:
-        # groups = Group.objects.member(user=user, service=service)
-        # return list(groups.only('name').values_list('name', flat=True))
+        # load all groups with a single query
+        expr = Q()
         for group, service in groups:
-            if self.is_member(group=group, service=service, user=user):
-                return True
-        return False
+            expr |= Q(name=group, service=service)
+        found = {(name, service_id): pk for pk, name, service_id
+                 in Group.objects.filter(expr).values_list('pk', 'name', 'service_id')}
+
+        # Like calling is_member() for every group, a group that does not exist raises
+        # GroupNotFound unless the user is a member of one of the groups before it.
+        ids = []
+        for group, service in groups:
+            pk = found.get((group, service.id if service is not None else None))
+            if pk is None:
+                if ids and self._is_member_of_any(user, ids):
+                    return True
+                raise GroupNotFound(group, service=service)
+            ids.append(pk)
+
+        return self._is_member_of_any(user, ids)
+
+    def _is_member_of_any(self, user, groups):
+        # test membership in all groups with a single query
+        members = Group.objects.filter(pk__in=groups).members(closure=self.closure)
+        return members.filter(pk=user.pk).exists()
+
+    def authenticate(self, user, password, service, groups=None, keys=None):
+        user = self._user(user, 'id', 'password')
+        if not user.check_password(password):
+            return None
+
+        memberships = Group.objects.member(user=user, service=service, closure=self.closure)
+        memberships = list(memberships.values_list('name', flat=True))
+        if groups is not None and not self._member_of_any(groups, service, memberships):
+            return None
+
+        properties = Property.objects.filter(user_id=user.id)
+        if keys is not None:
+            properties = properties.filter(key__in=keys)
+        return dict(properties.values_list('key', 'value')), memberships
 
     def set_password(self, user, password=None):
         user = self._user(user, 'id', 'password')
@@ -142,8 +250,10 @@ class DjangoBackend(BackendBase):
         else:
             raise UserNotFound(user)
 
-    def get_properties(self, user):
+    def get_properties(self, user, keys=None):
         qs = Property.objects.filter(user__username=user)
+        if keys is not None:
+            qs = qs.filter(key__in=keys)
         properties = dict(qs.values_list('key', 'value'))
         if not properties and not self.user_exists(user=user):
             raise UserNotFound(user)
@@ -186,7 +296,7 @@ class DjangoBackend(BackendBase):
             groups = Group.objects.filter(service=service)
         else:
             user = self._user(user, 'id')
-            groups = Group.objects.member(user=user, service=service)
+            groups = Group.objects.member(user=user, service=service, closure=self.closure)
         return list(groups.only('name').values_list('name', flat=True))
 
     def create_group(self, group, service, users=None, dry=False):
@@ -213,6 +323,7 @@ class DjangoBackend(BackendBase):
             raise GroupExists(name)
 
     def set_service(self, group, service, new_service):
+        # NOTE: The group keeps its id and its subgroups, so the GroupClosure table stays valid.
         try:
             updated = Group.objects.filter(name=group, service=service).update(service=new_service)
             if updated == 0:
@@ -244,17 +355,18 @@ class DjangoBackend(BackendBase):
 
     def members(self, group, service, depth=None):
         group = self._group(group, service, 'id')
-        return list(group.get_members(depth=depth).values_list('username', flat=True))
+        members = group.get_members(depth=depth, closure=self.closure)
+        return list(members.values_list('username', flat=True))
 
     def is_member(self, group, service, user):
         group = self._group(group, service, 'id')
-        return group.is_member(user)
+        return group.is_member(user, closure=self.closure)
 
     def remove_member(self, group, service, user):
         group = self._group(group, service, 'id')
         user = self._user(user, 'id')
 
-        if group.is_member(user.username):
+        if group.is_member(user.username, closure=self.closure):
             group.users.remove(user)
         else:
             raise UserNotFound(user.username)  # 404 Not Found
@@ -262,14 +374,24 @@ class DjangoBackend(BackendBase):
     def add_subgroup(self, group, service, subgroup, subservice):
         group = self._group(group, service, 'id')
         subgroup = self._group(subgroup, subservice, 'id')
-        group.groups.add(subgroup)
+        with self.transaction():
+            group.groups.add(subgroup)
+            if self.closure:
+                GroupClosure.objects.add(group.id, subgroup.id)
 
     def set_subgroups(self, group, service, subgroups, subservice):
         group = self._group(group, service, 'id')
         subgroups = [self._group(name, subservice, 'id') for name in subgroups]
 
-        group.groups.through.objects.filter(from_group=group, to_group__service=subservice).delete()
-        group.groups.add(*subgroups)
+        with self.transaction():
+            qs = group.groups.through.objects.filter(from_group=group, to_group__service=subservice)
+            if self.closure:
+                changed = set(qs.values_list('to_group_id', flat=True))
+                changed |= set(g.id for g in subgroups)
+            qs.delete()
+            group.groups.add(*subgroups)
+            if self.closure:
+                GroupClosure.objects.refresh(changed)
 
     def is_subgroup(self, group, service, subgroup, subservice):
         group = self._group(group, service, 'id')
@@ -283,7 +405,10 @@ class DjangoBackend(BackendBase):
         except Group.DoesNotExist:
             raise GroupNotFound(subgroup, service=subservice)
 
-        group.groups.remove(subgroup)
+        with self.transaction():
+            group.groups.remove(subgroup)
+            if self.closure:
+                GroupClosure.objects.refresh([subgroup.id])
 
     def subgroups(self, group, service, filter=True):
         group = self._group(group, service, 'id')
@@ -300,4 +425,9 @@ class DjangoBackend(BackendBase):
 
     def remove_group(self, group, service):
         group = self._group(group, service, 'id')
-        group.delete()
+        with self.transaction():
+            if self.closure:
+                descendants = GroupClosure.objects.descendants(group.id) - set([group.id])
+            group.delete()
+            if self.closure:
+                GroupClosure.objects.refresh(descendants)
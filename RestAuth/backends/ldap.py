@@ -17,8 +17,10 @@ from __future__ import absolute_import
 from __future__ import unicode_literals
 
 import ldap
+from ldap.controls import SimplePagedResultsControl
 
 from .base import BackendBase
+from .pool import ConnectionPool
 
 
 class LDAPBackend(BackendBase):
@@ -38,11 +40,22 @@ class LDAPBackend(BackendBase):
     :param GROUP_ATTR: The attribute identifying a group.
     :param GROUP_SCOPE: Search scope used when searching for group, any of ldap.SCOPE_*. The default is
         ldap.SCOPE_BASE.
+    :param POOL_SIZE: Maximum number of connections to the LDAP server. Connections are bound when they
+        are created and shared by all threads of a process.
+    :param TIMEOUT: Timeout in seconds for connecting and for every operation. Also the maximum time to
+        wait for a free connection if ``POOL_SIZE`` connections are in use.
+    :param IDLE_TIMEOUT: Close connections that have not been used for this many seconds. Set this lower
+        than the idle timeout of your LDAP server.
+    :param CHECK_INTERVAL: Verify connections that have not been used for this many seconds before using
+        them again.
+    :param PAGE_SIZE: Number of entries requested at once when listing entries, using the Simple Paged
+        Results control (RFC 2696). This should be lower than the size limit of your LDAP server.
     """
     library = 'ldap'
 
     def __init__(self, LDAP_HOST, LDAP_USER, LDAP_PASS, USER_RDN, GROUP_RDN, USER_CLASSES=None,
-                 USER_ATTR='uid', USER_SCOPE=None, GROUP_CLASSES=None, GROUP_ATTR='cn', GROUP_SCOPE=None):
+                 USER_ATTR='uid', USER_SCOPE=None, GROUP_CLASSES=None, GROUP_ATTR='cn', GROUP_SCOPE=None,
+                 POOL_SIZE=10, TIMEOUT=10, IDLE_TIMEOUT=300, CHECK_INTERVAL=30, PAGE_SIZE=500):
         """
         Currently used for testing::
 
@@ -61,9 +74,16 @@ class LDAPBackend(BackendBase):
         if GROUP_SCOPE is None:
             GROUP_SCOPE = self.ldap.SCOPE_BASE
 
-        # initiate connection
-        self.conn = ldap.initialize(LDAP_HOST)
-        self.conn.bind_s(LDAP_USER, LDAP_PASS, ldap.AUTH_SIMPLE)
+        # connections are created (and bound) on demand
+        self.host = LDAP_HOST
+        self.bind_dn = LDAP_USER
+        self.bind_pw = LDAP_PASS
+        self.timeout = TIMEOUT
+        self.page_size = PAGE_SIZE
+        self.pool = ConnectionPool(
+            connect=self._connect, close=self._close, check=self._check, size=POOL_SIZE,
+            timeout=TIMEOUT, idle_timeout=IDLE_TIMEOUT, check_interval=CHECK_INTERVAL,
+            errors=(self.ldap.SERVER_DOWN, self.ldap.TIMEOUT))
 
         # set local attributes
         self.user_rdn = USER_RDN
@@ -83,6 +103,55 @@ class LDAPBackend(BackendBase):
     TRANSACTION_MANAGER = None
     SUPPORTS_GROUP_VISIBILITY = False
     SUPPORTS_SUBGROUPS = False
+    SUPPORTS_TRANSACTION_READS = False
+
+    def _connect(self):
+        conn = self.ldap.initialize(self.host)
+        if self.timeout is not None:
+            conn.set_option(self.ldap.OPT_NETWORK_TIMEOUT, self.timeout)
+            conn.set_option(self.ldap.OPT_TIMEOUT, self.timeout)
+        conn.bind_s(self.bind_dn, self.bind_pw, self.ldap.AUTH_SIMPLE)
+        return conn
+
+    def _close(self, conn):
+        conn.unbind_s()
+
+    def _check(self, conn):
+        conn.whoami_s()
+
+    def _op(self, name, *args, **kwargs):
+        """Call an operation on a pooled connection.
+
+        If the server closed the connection, the operation is retried once on a new connection.
+        """
+        try:
+            with self.pool.connection() as conn:
+                return getattr(conn, name)(*args, **kwargs)
+        except self.ldap.SERVER_DOWN:
+            with self.pool.connection() as conn:
+                return getattr(conn, name)(*args, **kwargs)
+
+    def _paged_search(self, base, scope, filterstr, attrlist):
+        """Get a list of all ``(dn, attrs)`` tuples found by a search, fetched page by page.
+
+        Servers keep the state of a paged search per connection, so all pages are fetched before
+        the connection is returned to the pool. The results are not fetched lazily, otherwise a
+        client that reads a streamed response slowly would keep the connection checked out.
+        """
+        results = []
+        control = SimplePagedResultsControl(True, size=self.page_size, cookie='')
+        with self.pool.connection() as conn:
+            while True:
+                msgid = conn.search_ext(base, scope, filterstr, attrlist, serverctrls=[control])
+                rtype, rdata, rmsgid, serverctrls = conn.result3(msgid)
+                results += rdata
+
+                cookies = [c.cookie for c in serverctrls
+                           if c.controlType == SimplePagedResultsControl.controlType]
+                if not cookies or not cookies[0]:
+                    break
+                control.cookie = cookies[0]
+        return results
 
     def testSetUp(self):
         """Set up your backend for a test run.
@@ -158,17 +227,19 @@ class LDAPBackend(BackendBase):
             ('sn', sn),
         )
         try:
-            return self.conn.add_s(self.user_dn_tmpl % user, record)
+            return self._op('add_s', self.user_dn_tmpl % user, record)
         except self.ldap.OBJECT_CLASS_VIOLATION:
             raise  # e.g. object does not have the right properties
 
     def list_users(self):
         """Get a list of all users.
 
+        Users are fetched from the server page by page.
+
         :return: A list of usernames.
         :rtype: list
         """
-        results = self.conn.search_s(self.user_rdn, self.ldap.SCOPE_SUBTREE, self.user_filter,
+        results = self._paged_search(self.user_rdn, self.ldap.SCOPE_SUBTREE, self.user_filter,
                                      [str(self.user_attr)])
         return [v[self.user_attr][0] for k, v in results]
 
@@ -182,7 +253,7 @@ class LDAPBackend(BackendBase):
         """
         dn = '%s=%s,%s' % (self.user_attr, user, self.user_rdn)
         try:
-            self.conn.search_s(dn, self.user_scope, str(self.user_filter), [str()])
+            self._op('search_s', dn, self.user_scope, str(self.user_filter), [str()])
             return True
         except ldap.NO_SUCH_OBJECT:
             return False
@@ -260,11 +331,14 @@ class LDAPBackend(BackendBase):
         """
         raise NotImplementedError
 
-    def get_properties(self, user):
+    def get_properties(self, user, keys=None):
         """Get a full list of all user properties.
 
         :param user: The username.
         :type  user: str
+        :param keys: If given, only return the properties with the given keys. Keys that the user
+            does not have are ignored.
+        :type  keys: list
         :return: A dictionary of key/value pairs, each describing a property.
         :rtype: dict
         :raise: :py:class:`~common.errors.UserNotFound` if the user doesn't exist.
@@ -16,64 +16,509 @@
 from __future__ import absolute_import
 from __future__ import unicode_literals
 
+import threading
+from array import array
+from bisect import bisect_left
 from collections import defaultdict
+from contextlib import contextmanager
 from copy import deepcopy
+from functools import wraps
 
 from django.conf import settings
-from django.contrib.auth.hashers import check_password
-from django.contrib.auth.hashers import make_password
 import six
+from six.moves import intern
 
 from backends.base import BackendBase
+from backends.wal import WriteAheadLog
 from common.errors import GroupExists
 from common.errors import GroupNotFound
 from common.errors import PropertyExists
 from common.errors import PropertyNotFound
 from common.errors import UserExists
 from common.errors import UserNotFound
+from common.hashers import check_password
 from common.hashers import import_hash
+from common.hashers import make_password
+
+
+def _intern(value):
+    """Intern a string, so that equal usernames and property keys are only stored once."""
+
+    if isinstance(value, str):  # unicode strings cannot be interned in Python 2
+        return intern(value)
+    return value
+
+
+class IdSet(object):
+    """A compact set of user ids, stored as a sorted array of unsigned integers.
+
+    Every member takes four bytes instead of the ~50 bytes needed by an element of a ``set``.
+    Lookups use binary search, adding and removing members moves the following members.
+    """
+
+    __slots__ = ('ids', )
+
+    def __init__(self, ids=()):
+        self.ids = array(str('I'), sorted(set(ids)))
+
+    def __contains__(self, id):
+        index = bisect_left(self.ids, id)
+        return index < len(self.ids) and self.ids[index] == id
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __eq__(self, other):
+        return isinstance(other, IdSet) and self.ids == other.ids
+
+    def __ne__(self, other):
+        return not self == other
+
+    def add(self, id):
+        index = bisect_left(self.ids, id)
+        if index == len(self.ids) or self.ids[index] != id:
+            self.ids.insert(index, id)
+
+    def remove(self, id):
+        index = bisect_left(self.ids, id)
+        if index == len(self.ids) or self.ids[index] != id:
+            raise KeyError(id)
+        del self.ids[index]
+
+    def discard(self, id):
+        index = bisect_left(self.ids, id)
+        if index < len(self.ids) and self.ids[index] == id:
+            del self.ids[index]
+
+
+class Record(object):
+    """Base class for records using ``__slots__`` instead of a ``__dict__`` per instance."""
+
+    __slots__ = ()
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(
+            getattr(self, attr) == getattr(other, attr) for attr in self.__slots__)
+
+    def __ne__(self, other):
+        return not self == other
+
+
+class UserRecord(Record):
+    __slots__ = ('id', 'password', 'properties')
+
+    def __init__(self, id, password=None, properties=None):
+        self.id = id
+        self.password = password
+        self.properties = {}
+        if properties:
+            self.properties.update((_intern(k), v) for k, v in six.iteritems(properties))
+
+
+class GroupRecord(Record):
+    __slots__ = ('users', 'meta_groups', 'sub_groups')
+
+    def __init__(self, users=()):
+        self.users = IdSet(users)
+        self.meta_groups = set()
+        self.sub_groups = set()
+
+
+def _apply_record(state, record):
+    """Apply a record written by :py:meth:`MemoryBackend._write_log` to a tuple of all users and
+    all groups (by service), as stored by the :py:class:`~backends.wal.WriteAheadLog`."""
+
+    if state is None:
+        state = ({}, {})
+    users, groups = state
+    changed_users, changed_groups, memberships = record
+
+    for user, user_record in six.iteritems(changed_users):
+        if user_record is None:
+            users.pop(user, None)
+        else:
+            users[user] = user_record
+    for (service, group), group_record in six.iteritems(changed_groups):
+        if group_record is None:
+            groups.get(service, {}).pop(group, None)
+        else:
+            groups.setdefault(service, {})[group] = group_record
+    for service, group, id, added in memberships:
+        if added:
+            groups[service][group].users.add(id)
+        else:
+            groups[service][group].users.discard(id)
+    return state
+
+
+class ReadWriteLock(object):
+    """A reentrant lock that can be held by many readers or by a single writer.
+
+    Waiting writers have precedence over new readers, so a steady stream of readers cannot starve
+    writers. A thread holding the write lock may acquire the read or write lock again, a thread
+    that holds a read lock may acquire the read lock again but not the write lock.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._local = threading.local()
+        self._readers = 0
+        self._writer = None
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        me = threading.current_thread()
+        if self._writer is me:  # only this thread can change _writer from or to itself
+            yield
+            return
+
+        reads = getattr(self._local, 'reads', 0)
+        with self._cond:
+            if reads == 0:  # nested reads must not wait for writers, they would wait forever
+                while self._writer is not None or self._writers_waiting:
+                    self._cond.wait()
+            self._readers += 1
+        self._local.reads = reads + 1
+
+        try:
+            yield
+        finally:
+            self._local.reads = reads
+            with self._cond:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        me = threading.current_thread()
+        if self._writer is me:
+            yield
+            return
+        if getattr(self._local, 'reads', 0):
+            raise RuntimeError("Cannot acquire the write lock while holding the read lock.")
+
+        with self._cond:
+            self._writers_waiting += 1
+            try:
+                while self._writer is not None or self._readers:
+                    self._cond.wait()
+            finally:
+                self._writers_waiting -= 1
+            self._writer = me
+
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = None
+                self._cond.notify_all()
+
+
+def reading(func):
+    """Decorator for methods that only read data, holds the read lock while the method runs."""
+
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        with self._lock.read():
+            return func(self, *args, **kwargs)
+    return wrapper
+
+
+def writing(func):
+    """Decorator for methods that modify data.
+
+    Holds the write lock while the method runs and writes all modifications to the log (if any).
+    The write lock is released before waiting for the log to be written to disk, so concurrent
+    modifications can share a single ``fsync()``.
+    """
+
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        position = None
+        try:
+            with self._lock.write():
+                self._calls += 1
+                try:
+                    return func(self, *args, **kwargs)
+                finally:
+                    self._calls -= 1
+                    if self._calls == 0 and not self._transactions:
+                        position = self._write_log()
+        finally:
+            if position is not None:
+                self._log.wait(position)
+    return wrapper
 
 
 class MemoryTransactionManager(object):
+    """Transaction manager that keeps an undo journal of all users and groups it touches.
+
+    Before a user is modified for the first time in a transaction, the backend saves a copy of its
+    previous state (or ``None`` if it did not exist) in the journal of the innermost transaction.
+    Groups can have many members, so for groups only the inverse of every change is journaled (see
+    :py:meth:`MemoryBackend._journal_group`). The journal is replayed if the transaction is a dry
+    run or if an exception occurs, so the cost of a transaction only depends on the changes it
+    makes and not on the size of the dataset. Committed nested transactions merge their journal
+    into the outer one.
+
+    The write lock of the backend is held for the whole transaction, so other threads never see
+    the changes of a transaction before it is committed.
+    """
+
     def __init__(self, backend, dry=False):
         self.backend = backend
         self.dry = dry
+        self.users = {}
+        self.groups = []
 
     def __enter__(self):
-        self.users = deepcopy(self.backend._users)
-        self.groups = deepcopy(self.backend._groups)
+        self.lock = self.backend._lock.write()
+        self.lock.__enter__()
+        self.backend._transactions.append(self)
+        self.memberships = len(self.backend._dirty_memberships)
+        return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        if self.dry or exc_type:
-            self.backend._users = self.users
-            self.backend._groups = self.groups
+        position = None
+        try:
+            self.backend._transactions.pop()
+
+            if self.dry or exc_type:
+                self.rollback()
+                # changed users and groups are logged with their restored state, but membership
+                # changes would be applied again
+                del self.backend._dirty_memberships[self.memberships:]
+                if not self.backend._transactions:  # nothing was logged
+                    self.backend._dirty_users.clear()
+                    self.backend._dirty_groups.clear()
+            elif not self.backend._transactions:
+                position = self.backend._write_log()
+            else:
+                outer = self.backend._transactions[-1]
+                for user, record in six.iteritems(self.users):
+                    outer.users.setdefault(user, record)
+                outer.groups.extend(self.groups)
+        finally:
+            self.lock.__exit__(None, None, None)
+
+        if position is not None:
+            self.backend._log.wait(position)
+
+    def rollback(self):
+        self.backend._apply(self.users, self.groups)
 
 
 class MemoryBackend(BackendBase):
+    """Backend storing all data in memory.
+
+    By default, all data is lost when RestAuth is restarted. If ``PATH`` is set, all changes are
+    written to a log and the data is restored from it when RestAuth starts.
+
+    The backend is thread-safe: Any number of threads can read data at the same time, while changes
+    and transactions are serialized by a :py:class:`ReadWriteLock`.
+
+    The backend supports the following options in :setting:`DATA_BACKEND`:
+
+    ``PATH``
+        Directory to store the log and snapshots in. Every change is on disk before the request
+        returns, concurrent changes share a single ``fsync()``. Note that only one RestAuth process
+        can use a directory at the same time.
+    ``SNAPSHOT_ENTRIES``
+        Write a snapshot of all data after this many changes. Snapshots are built in the background
+        from the previous snapshot and the log, so they never block requests. On startup, the latest
+        snapshot is loaded and only the changes after it are replayed.
+    ``SYNC``
+        Set to ``False`` to not wait until changes are on disk. Changes may be lost if the operating
+        system crashes, but not if only RestAuth crashes.
+
+    .. versionadded:: 0.7.2
+       The ``PATH``, ``SNAPSHOT_ENTRIES`` and ``SYNC`` options.
+    """
+
     TRANSACTION_MANAGER = MemoryTransactionManager
 
-    def __init__(self):
-        self._users = {}
-        self._groups = defaultdict(dict)
+    def __init__(self, PATH=None, SNAPSHOT_ENTRIES=100000, SYNC=True):
+        self._users = {}  # username -> UserRecord
+        self._names = []  # user id -> username
+        self._groups = defaultdict(dict)  # service -> group name -> GroupRecord
+        self._transactions = []
+
+        self._lock = ReadWriteLock()
+        self._log = None
+        self._calls = 0  # nesting level of methods decorated with writing
+        self._dirty_users = set()
+        self._dirty_groups = set()
+        self._dirty_memberships = []  # (service, group, user id, added)
+        if PATH is not None:
+            self._log = WriteAheadLog(PATH, _apply_record, snapshot_entries=SNAPSHOT_ENTRIES,
+                                      sync=SYNC)
+            self._recover()
+
+    def _recover(self):
+        state = self._log.recover()
+        if state is not None:
+            users, groups = state
+            for user, record in six.iteritems(users):
+                self._set_user(user, record)
+            self._groups.update(groups)
+
+    def _apply(self, users, groups):
+        for user, record in six.iteritems(users):
+            if record is None:
+                self._users.pop(user, None)
+            else:
+                self._set_user(user, record)
+        for action, service, group, attr, value in reversed(groups):
+            if action == 'group':
+                if value is None:
+                    self._groups[service].pop(group, None)
+                else:
+                    self._groups[service][group] = value
+            elif action == 'set':
+                setattr(self._groups[service][group], attr, value)
+            else:  # 'add' or 'discard'
+                getattr(getattr(self._groups[service][group], attr), action)(value)
+
+    def _write_log(self):
+        if self._log is None or not (
+                self._dirty_users or self._dirty_groups or self._dirty_memberships):
+            return
+
+        users = dict((u, self._users.get(u)) for u in self._dirty_users)
+        groups = dict(((s, g), self._groups[s].get(g)) for s, g in self._dirty_groups)
+        # groups that are logged completely already contain their membership changes
+        memberships = [m for m in self._dirty_memberships if (m[0], m[1]) not in groups]
+        self._dirty_users.clear()
+        self._dirty_groups.clear()
+        del self._dirty_memberships[:]
+        return self._log.write((users, groups, memberships))
+
+    def _journal_user(self, user):
+        """Save the current state of a user in the journal of the current transaction."""
+
+        if self._log is not None:
+            self._dirty_users.add(user)
+        if self._transactions and user not in self._transactions[-1].users:
+            self._transactions[-1].users[user] = deepcopy(self._users.get(user))
+
+    def _journal_group(self, group, service, action, attr=None, value=None, log=True):
+        """Save how to undo a change of a group in the journal of the current transaction.
+
+        ``action`` is ``'add'`` or ``'discard'`` to add ``value`` to or remove it from the set
+        ``attr`` of the group, ``'set'`` to set ``attr`` to ``value`` and ``'group'`` to restore
+        the group record ``value`` (or remove the group if it is ``None``). Since records are not
+        copied, journaling a change does not depend on the size of the group.
+
+        If ``log`` is ``False``, the group is not written to the log, the caller logs the change
+        with :py:meth:`_journal_membership` instead.
+        """
+
+        if log and self._log is not None:
+            self._dirty_groups.add((service, group))
+        if self._transactions:
+            self._transactions[-1].groups.append((action, service, group, attr, value))
+
+    def _journal_membership(self, group, service, id, added):
+        """Journal adding or removing a member, only the change and not the group is logged."""
+
+        self._journal_group(group, service, 'discard' if added else 'add', 'users', id, log=False)
+        if self._log is not None:
+            self._dirty_memberships.append((service, group, id, added))
+
+    def _set_add(self, group, service, attr, value):
+        items = getattr(self._groups[service][group], attr)
+        if value not in items:
+            self._journal_group(group, service, 'discard', attr, value)
+            items.add(value)
+
+    def _set_remove(self, group, service, attr, value):
+        items = getattr(self._groups[service][group], attr)
+        if value not in items:
+            raise KeyError(value)
+        self._journal_group(group, service, 'add', attr, value)
+        items.remove(value)
+
+    def _add_member(self, group, service, id):
+        record = self._groups[service][group]
+        if id not in record.users:
+            self._journal_membership(group, service, id, True)
+            record.users.add(id)
+
+    def _remove_member(self, group, service, id):
+        self._journal_membership(group, service, id, False)
+        self._groups[service][group].users.remove(id)
+
+    def _reserve(self, id):
+        if id >= len(self._names):
+            self._names.extend([None] * (id + 1 - len(self._names)))
+
+    def _set_user(self, user, record):
+        self._reserve(record.id)
+        self._names[record.id] = user
+        self._users[user] = record
+
+    def _get_user(self, user):
+        try:
+            return self._users[user]
+        except KeyError:
+            raise UserNotFound(user)
+
+    def _ids(self, users):
+        return [self._get_user(user).id for user in users]
+
+    def _username(self, id):
+        """Get the name of the user with the given id or ``None`` if the user was removed."""
+
+        name = self._names[id]
+        record = self._users.get(name)
+        if record is not None and record.id == id:
+            return name
 
     def testSetUp(self):
         self._users = {}
+        self._names = []
         self._groups = defaultdict(dict)
+        self._transactions = []
 
     def testTearDown(self):
         self._users = {}
+        self._names = []
         self._groups = defaultdict(dict)
+        self._transactions = []
 
     def create_user(self, user, password=None, properties=None, groups=None, dry=False):
+        # hash the password before acquiring the write lock, hashing is slow
+        if password and dry is False:
+            password = make_password(password)
+        self._create_user(user, password, properties, groups, dry=dry)
+
+    def create_users(self, users, dry=False):
+        if dry is False:
+            users = [(user, make_password(password) if password else password, properties, groups)
+                     for user, password, properties, groups in users]
+
+        existing = []
+        with self.transaction(dry=dry):  # dry-runs are rolled back by the transaction
+            for user, password, properties, groups in users:
+                try:
+                    self._create_user(user, password, properties, groups)
+                except UserExists:
+                    existing.append(user)
+        return existing
+
+    @writing
+    def _create_user(self, user, password, properties, groups, dry=False):
         if user in self._users:
             raise UserExists(user)
         if dry is False:
-            self._users[user] = {
-                'password': None,
-                'properties': properties or {},
-            }
-            if password:
-                self._users[user]['password'] = make_password(password)
+            user = _intern(user)
+            self._journal_user(user)
+            self._set_user(user, UserRecord(len(self._names), password, properties))
             if groups is not None:
                 for group, service in groups:
                     # auto-create groups
@@ -82,31 +527,37 @@ class MemoryBackend(BackendBase):
                     else:
                         self.create_group(group=group, service=service, users=[user])
 
+    @reading
     def list_users(self):
         return list(self._users.keys())
 
+    @reading
     def user_exists(self, user):
         return user in self._users
 
+    @writing
     def rename_user(self, user, name):
         if name in self._users:
             raise UserExists(name)
+        record = self._get_user(user)
 
-        try:
-            self._users[name] = self._users.pop(user)
-        except KeyError:
-            raise UserNotFound(user)
+        # group memberships refer to the id of the user, so they do not have to be updated
+        name = _intern(name)
+        self._journal_user(user)
+        self._journal_user(name)
+        del self._users[user]
+        self._set_user(name, record)
 
     def check_password(self, user, password, groups=None):
-        try:
-            stored = self._users[user]['password']
-        except KeyError:
-            raise UserNotFound(user)
+        # NOTE: The password is checked without holding any lock, as the setter acquires the write
+        #       lock if the hash needs to be updated.
+        with self._lock.read():
+            stored = self._get_user(user).password
 
         def setter(raw_password):
             self.set_password(user, raw_password)
 
-        if not password or not check_password(password, stored, setter):
+        if not password or not stored or not check_password(password, stored, setter):
             return False
 
         if groups is None:
@@ -117,130 +568,136 @@ class MemoryBackend(BackendBase):
         return False
 
     def set_password(self, user, password=None):
-        try:
-            if password:
-                self._users[user]['password'] = make_password(password)
-            else:
-                self._users[user]['password'] = None
-        except KeyError:
-            raise UserNotFound(user)
+        # hash the password before acquiring the write lock, hashing is slow
+        self._set_password(user, make_password(password) if password else None)
 
+    @writing
+    def _set_password(self, user, password):
+        record = self._get_user(user)
+        self._journal_user(user)
+        record.password = password
+
+    @writing
     def set_password_hash(self, user, algorithm, hash):
         django_hash = import_hash(algorithm, hash)
-        self._users[user]['password'] = django_hash
+        record = self._get_user(user)
+        self._journal_user(user)
+        record.password = django_hash
 
+    @writing
     def remove_user(self, user):
-        try:
-            del self._users[user]
-        except KeyError:
-            raise UserNotFound(user)
-
-    def get_properties(self, user):
-        try:
-            return self._users[user]['properties'].copy()
-        except KeyError:
-            raise UserNotFound(user)
-
+        id = self._get_user(user).id
+        for service, groups in list(six.iteritems(self._groups)):
+            for group, record in list(six.iteritems(groups)):
+                if id in record.users:
+                    self._remove_member(group, service, id)
+
+        self._journal_user(user)
+        del self._users[user]
+        self._names[id] = None
+
+    @reading
+    def get_properties(self, user, keys=None):
+        properties = self._get_user(user).properties
+        if keys is None:
+            return properties.copy()
+        return {k: properties[k] for k in keys if k in properties}
+
+    @writing
     def create_property(self, user, key, value, dry=False):
-        try:
-            properties = self._users[user]['properties']
-        except KeyError:
-            raise UserNotFound(user)
-
+        properties = self._get_user(user).properties
         if key in properties:
             raise PropertyExists(key)
 
-        if dry is False:  # TODO: can we use properties variable instead?
-            self._users[user]['properties'][key] = value
+        if dry is False:
+            self._journal_user(user)
+            properties[_intern(key)] = value
 
+    @reading
     def get_property(self, user, key):
-        try:
-            properties = self._users[user]['properties']
-        except KeyError:
-            raise UserNotFound(user)
+        properties = self._get_user(user).properties
         try:
             return properties[key]
         except KeyError:
             raise PropertyNotFound(key)
 
+    @writing
     def set_property(self, user, key, value):
-        try:
-            properties = self._users[user]['properties']
-        except KeyError:
-            raise UserNotFound(user)
+        properties = self._get_user(user).properties
 
+        self._journal_user(user)
         old_value = properties.get(key)
-        properties[key] = value
+        properties[_intern(key)] = value
         return old_value
 
+    @writing
     def set_properties(self, user, properties):
-        try:
-            existing_properties = self._users[user]['properties']
-        except KeyError:
-            raise UserNotFound(user)
+        existing_properties = self._get_user(user).properties
 
-        existing_properties.update(properties)
+        self._journal_user(user)
+        existing_properties.update((_intern(k), v) for k, v in six.iteritems(properties))
 
+    @writing
     def remove_property(self, user, key):
-        try:
-            properties = self._users[user]['properties']
-        except KeyError:
-            raise UserNotFound(user)
-
-        try:
-            del properties[key]
-        except KeyError:
+        properties = self._get_user(user).properties
+        if key not in properties:
             raise PropertyNotFound(key)
 
+        self._journal_user(user)
+        del properties[key]
+
+    @reading
     def list_groups(self, service, user=None):
         if user is None:
             return list(self._groups[service].keys())
-        elif user not in self._users:
-            raise UserNotFound(user)
-        else:
-            return [k for k, v in six.iteritems(self._groups[service])
-                    if self.is_member(k, service, user)]
 
+        id = self._get_user(user).id
+        return [k for k in self._groups[service] if self._is_member(k, service, id)]
+
+    @writing
     def create_group(self, group, service, users=None, dry=False):
         if group in self._groups[service]:
             raise GroupExists(group)
-        if users is not None and not set(self._users.keys()) >= set(users):
-            raise UserNotFound()
+        ids = self._ids(users or [])
 
         if dry is False:
-            self._groups[service][group] = {
-                'users': set(users) if users else set(),
-                'meta-groups': set(),
-                'sub-groups': set(),
-            }
+            self._journal_group(group, service, 'group')
+            self._groups[service][group] = GroupRecord(ids)
 
+    @writing
     def rename_group(self, group, name, service):
         if group not in self._groups[service]:
             raise GroupNotFound(group, service=service)
         elif name in self._groups[service]:
             raise GroupExists(name)
 
+        self._journal_group(group, service, 'group', value=self._groups[service][group])
+        self._journal_group(name, service, 'group')
         self._groups[service][name] = self._groups[service].pop(group)
 
+    @writing
     def set_service(self, group, service, new_service):
         if group not in self._groups[service]:
             raise GroupNotFound(group, service=service)
         if group in self._groups[new_service]:
             raise GroupExists(group)
 
+        self._journal_group(group, service, 'group', value=self._groups[service][group])
+        self._journal_group(group, new_service, 'group')
         self._groups[new_service][group] = self._groups[service].pop(group)
 
+    @reading
     def group_exists(self, group, service):
         return group in self._groups[service]
 
+    @writing
     def set_memberships(self, user, service, groups):
-        if user not in self._users:
-            raise UserNotFound(user)
+        id = self._get_user(user).id
 
         # delete existing memberships
-        for group in self._groups[service]:
-            if user in self._groups[service][group]['users']:
-                self._groups[service][group]['users'].remove(user)
+        for group, record in list(six.iteritems(self._groups[service])):
+            if id in record.users:
+                self._remove_member(group, service, id)
 
         # set new memberships
         for group in groups:
@@ -249,78 +706,88 @@ class MemoryBackend(BackendBase):
             else:
                 self.create_group(group=group, service=service, users=[user])
 
+    @writing
     def set_members(self, group, service, users):
         if group not in self._groups[service]:
             raise GroupNotFound(group, service=service)
-        for user in filter(lambda u: u not in self._users, users):
-            raise UserNotFound(user)
+        ids = self._ids(users)
 
-        self._groups[service][group]['users'] = set(users)
+        self._journal_group(group, service, 'set', 'users', self._groups[service][group].users)
+        self._groups[service][group].users = IdSet(ids)
 
+    @writing
     def add_member(self, group, service, user):
         if group not in self._groups[service]:
             raise GroupNotFound(group, service=service)
-        if user not in self._users:
-            raise UserNotFound(user)
-        self._groups[service][group]['users'].add(user)
+        self._add_member(group, service, self._get_user(user).id)
 
     def _members(self, group, service, depth, max_depth):
-        members = set(self._groups[service][group]['users'])
+        members = set(self._groups[service][group].users)
         if depth < max_depth:
-            for meta_group, meta_service in self._groups[service][group]['meta-groups']:
+            for meta_group, meta_service in self._groups[service][group].meta_groups:
                 members |= self._members(meta_group, meta_service,
                                          depth=depth + 1, max_depth=max_depth)
 
         return members
 
+    @reading
     def members(self, group, service, depth=None):
         if group not in self._groups[service]:
             raise GroupNotFound(group, service=service)
         if depth is None:
             depth = settings.GROUP_RECURSION_DEPTH
 
-        members = set(self._groups[service][group]['users'])
+        members = set(self._groups[service][group].users)
 
         if depth > 0:
-            for meta_group, meta_service in self._groups[service][group]['meta-groups']:
+            for meta_group, meta_service in self._groups[service][group].meta_groups:
                 members |= self._members(meta_group, meta_service, depth=1, max_depth=depth)
 
-        return list(members)
+        names = [self._username(id) for id in members]
+        return [name for name in names if name is not None]
 
-    def _is_member(self, group, service, user, depth=0):
-        if user in self._groups[service][group]['users']:
+    def _is_member(self, group, service, id, depth=0):
+        if id in self._groups[service][group].users:
             return True
 
         if depth <= settings.GROUP_RECURSION_DEPTH:
-            for meta_group, meta_service in self._groups[service][group]['meta-groups']:
-                if self._is_member(group=meta_group, service=meta_service, user=user,
+            for meta_group, meta_service in self._groups[service][group].meta_groups:
+                if self._is_member(group=meta_group, service=meta_service, id=id,
                                    depth=depth + 1):
                     return True
         return False
 
+    @reading
     def is_member(self, group, service, user):
         if group not in self._groups[service]:
             raise GroupNotFound(group, service=service)
 
-        return self._is_member(group, service, user)
+        record = self._users.get(user)
+        if record is None:
+            return False
+        return self._is_member(group, service, record.id)
 
+    @writing
     def remove_member(self, group, service, user):
         if group not in self._groups[service]:
             raise GroupNotFound(group, service=service)
-        try:
-            self._groups[service][group]['users'].remove(user)
-        except KeyError:
+        record = self._users.get(user)
+        if record is None or record.id not in self._groups[service][group].users:
             raise UserNotFound(user)
 
+        self._remove_member(group, service, record.id)
+
+    @writing
     def add_subgroup(self, group, service, subgroup, subservice):
         if group not in self._groups[service]:
             raise GroupNotFound(group, service=service)
         if subgroup not in self._groups[subservice]:
             raise GroupNotFound(subgroup, service=service)
 
-        self._groups[service][group]['sub-groups'].add((subgroup, subservice))
-        self._groups[subservice][subgroup]['meta-groups'].add((group, service))
+        self._set_add(group, service, 'sub_groups', (subgroup, subservice))
+        self._set_add(subgroup, subservice, 'meta_groups', (group, service))
 
+    @writing
     def set_subgroups(self, group, service, subgroups, subservice):
         if group not in self._groups[service]:
             raise GroupNotFound(group, service=service)
@@ -329,26 +796,29 @@ class MemoryBackend(BackendBase):
 
         # clear any existing sub-groups from the same service
         for current_subgroup, current_subservice in filter(
-                lambda t: t[1] == service, self._groups[service][group]['sub-groups']):
-            self._groups[current_subservice][current_subgroup]['meta-groups'].remove(
-                (group, service))
-        cleared = [(g, s) for g, s in self._groups[service][group]['sub-groups'] if s != service]
-        self._groups[service][group]['sub-groups'] = set(cleared)
+                lambda t: t[1] == service, self._groups[service][group].sub_groups):
+            self._set_remove(current_subgroup, current_subservice, 'meta_groups', (group, service))
+        cleared = [(g, s) for g, s in self._groups[service][group].sub_groups if s != service]
+        self._journal_group(group, service, 'set', 'sub_groups',
+                            self._groups[service][group].sub_groups)
+        self._groups[service][group].sub_groups = set(cleared)
 
         # add bi-directional relationship
         for subgroup in subgroups:
-            self._groups[subservice][subgroup]['meta-groups'].add((group, service))
+            self._set_add(subgroup, subservice, 'meta_groups', (group, service))
 
         # we update s because there might be left-over subgroups from a different service
-        self._groups[service][group]['sub-groups'] |= set(
+        self._groups[service][group].sub_groups |= set(
             [(subgroup, subservice) for subgroup in subgroups])
 
+    @reading
     def is_subgroup(self, group, service, subgroup, subservice):
         if group not in self._groups[service]:
             raise GroupNotFound(group, service=service)
 
-        return (subgroup, subservice) in self._groups[service][group]['sub-groups']
+        return (subgroup, subservice) in self._groups[service][group].sub_groups
 
+    @writing
     def remove_subgroup(self, group, service, subgroup, subservice):
         if group not in self._groups[service]:
             raise GroupNotFound(group, service=service)
@@ -356,28 +826,32 @@ class MemoryBackend(BackendBase):
             raise GroupNotFound(subgroup, service=subservice)
 
         try:
-            self._groups[service][group]['sub-groups'].remove((subgroup, subservice))
-            self._groups[service][subgroup]['meta-groups'].remove((group, service))
+            self._set_remove(group, service, 'sub_groups', (subgroup, subservice))
+            self._set_remove(subgroup, service, 'meta_groups', (group, service))
         except KeyError:
             raise GroupNotFound(subgroup, service=subservice)
 
+    @reading
     def subgroups(self, group, service, filter=True):
         if group not in self._groups[service]:
             raise GroupNotFound(group, service=service)
         if filter is True:
-            return [g for g, s in self._groups[service][group]['sub-groups'] if s == service]
+            return [g for g, s in self._groups[service][group].sub_groups if s == service]
         else:
-            return list(self._groups[service][group]['sub-groups'])
+            return list(self._groups[service][group].sub_groups)
 
+    @reading
     def parents(self, group, service):
         if group not in self._groups[service]:
             raise GroupNotFound(group, service=service)
-        return list(self._groups[service][group]['meta-groups'])
+        return list(self._groups[service][group].meta_groups)
 
+    @writing
     def remove_group(self, group, service):
         if group not in self._groups[service]:
             raise GroupNotFound(group, service=service)
 
+        self._journal_group(group, service, 'group', value=self._groups[service][group])
         del self._groups[service][group]
 
 
@@ -406,11 +880,11 @@ class NoSubgroupsBackend(MemoryBackend):
 class NoGroupVisibilityBackend(MemoryBackend):
     SUPPORTS_GROUP_VISIBILITY = False
 
-    def create_user(self, user, password=None, properties=None, groups=None, dry=False):
+    def _create_user(self, user, password, properties, groups, dry=False):
         if groups is not None:
             groups = [(g, None) for g, s in groups]
-        return super(NoGroupVisibilityBackend, self).create_user(
-            user, password=password, properties=properties, groups=groups, dry=dry)
+        return super(NoGroupVisibilityBackend, self)._create_user(
+            user, password, properties, groups, dry=dry)
 
     def check_password(self, user, password, groups=None):
         if groups is not None:
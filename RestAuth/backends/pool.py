@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of RestAuth (https://restauth.net).
+#
+# RestAuth is free software: you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# RestAuth is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with RestAuth. If not,
+# see <http://www.gnu.org/licenses/>.
+
+from __future__ import unicode_literals
+
+import threading
+import time
+from contextlib import contextmanager
+
+from common.errors import ServiceUnavailable
+
+
+class ConnectionPool(object):
+    """A thread-safe pool of connections for backends that talk to a server.
+
+    Connections are created on demand by ``connect``, at most ``size`` connections are used at the
+    same time. Idle connections are reused in LIFO order, so rarely needed connections eventually
+    exceed ``idle_timeout`` and are closed. A connection that was idle for more than
+    ``check_interval`` seconds is verified with ``check`` before it is handed out again.
+
+    :param connect: Callable returning a new connection that is ready to use.
+    :param close: Callable that closes a connection. Exceptions raised by it are ignored.
+    :param check: Callable that raises an exception if a connection is no longer usable.
+    :param size: Maximum number of connections.
+    :param timeout: Seconds to wait for a free connection before raising
+        :py:class:`~common.errors.ServiceUnavailable`. ``None`` means to wait forever.
+    :param idle_timeout: Close connections that were idle for more than this many seconds.
+    :param check_interval: Check connections that were idle for more than this many seconds.
+    :param errors: Exceptions that indicate that a connection is broken. A connection is closed
+        instead of returned to the pool if one of them is raised while it is in use.
+    """
+
+    def __init__(self, connect, close, check=None, size=10, timeout=None, idle_timeout=300,
+                 check_interval=30, errors=()):
+        self._connect = connect
+        self._close = close
+        self._check = check
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.check_interval = check_interval
+        self.errors = tuple(errors)
+
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._idle = []  # list of (connection, last used)
+
+    def _discard(self, conn):
+        try:
+            self._close(conn)
+        except Exception:
+            pass
+
+    def _get(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                conn, last_used = self._idle.pop()
+
+            idle = time.time() - last_used
+            if self.idle_timeout is not None and idle > self.idle_timeout:
+                self._discard(conn)
+                continue
+            if self._check is not None and idle > self.check_interval:
+                try:
+                    self._check(conn)
+                except Exception:
+                    self._discard(conn)
+                    continue
+            return conn
+
+        return self._connect()
+
+    @contextmanager
+    def connection(self):
+        """Context manager that checks out a connection for the duration of the block."""
+
+        if self.timeout is None:
+            acquired = self._slots.acquire()
+        else:
+            acquired = self._slots.acquire(timeout=self.timeout)
+        if not acquired:
+            raise ServiceUnavailable("No free connection to the backend.")
+
+        try:
+            conn = self._get()
+            broken = False
+            try:
+                yield conn
+            except self.errors:
+                broken = True
+                raise
+            finally:
+                if broken:
+                    self._discard(conn)
+                else:
+                    self._put(conn)
+        finally:
+            self._slots.release()
+
+    def _put(self, conn):
+        with self._lock:
+            self._idle.append((conn, time.time()))
+
+    def clear(self):
+        """Close all idle connections."""
+
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, last_used in idle:
+            self._discard(conn)
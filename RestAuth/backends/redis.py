@@ -16,9 +16,9 @@
 from __future__ import absolute_import
 from __future__ import unicode_literals
 
+import threading
+
 from django.conf import settings
-from django.contrib.auth.hashers import check_password
-from django.contrib.auth.hashers import make_password
 import six
 
 from backends.base import BackendBase
@@ -29,21 +29,40 @@ from common.errors import PropertyExists
 from common.errors import PropertyNotFound
 from common.errors import UserExists
 from common.errors import UserNotFound
+from common.hashers import check_password
 from common.hashers import import_hash
+from common.hashers import make_password
 from Services.models import Service
 
 
 class RedisTransactionManager(TransactionManagerBase):
-    # we don't really support transactions ATM
+    """Queue all writes in a MULTI/EXEC pipeline that is executed when the block exits.
+
+    The pipeline is discarded in dry-run mode or if the block raises an exception. Nested
+    transactions are merged into the outermost transaction.
+    """
 
     def __enter__(self):
-        pass
+        local = self.backend._local
+        self.outer = getattr(local, 'pipe', None) is None
+        if self.outer:
+            local.pipe = self.backend.conn.pipeline(transaction=True)
+        elif self.dry:
+            raise ValueError('Cannot start a dry-run within another transaction.')
 
     def __exit__(self, exc_type, exc_value, traceback):
-        pass
+        if not self.outer:
+            return
+
+        pipe = self.backend._local.pipe
+        self.backend._local.pipe = None
+        if self.dry or exc_type:
+            pipe.reset()
+        else:
+            pipe.execute()
 
 
-# keys=[_USERS, _PROPS % user]
+# keys=[_USERS, _PROPS % user, _MEMBERSHIPS % user]
 # args=[user, password, len(properties)] + properties + groups
 # if groups:
 #   keys += [_GROUPS] + gu_keys
@@ -59,11 +78,12 @@ if last_prop > 0 then
     redis.call('hmset', KEYS[2], unpack(ARGV, 4, 3 + last_prop))
 end
 
-if #KEYS > 2 then
-    redis.call('sadd', KEYS[3], unpack(ARGV, last_prop + 1)) -- create groups
+if #KEYS > 3 then
+    redis.call('sadd', KEYS[4], unpack(ARGV, last_prop + 4)) -- create groups
+    redis.call('sadd', KEYS[3], unpack(ARGV, last_prop + 4)) -- index memberships
 
     -- add memberships
-    for i=4, #KEYS, 1 do
+    for i=5, #KEYS, 1 do
         redis.call('sadd', KEYS[i], ARGV[1])
     end
 end
@@ -77,7 +97,7 @@ end
 redis.call('hset', KEYS[1], ARGV[1], ARGV[2])
 """
 
-# keys = [_USERS, _PROPS % user, _PROPS % name] + [members_*]
+# keys = [_USERS, _PROPS % user, _PROPS % name, _MEMBERSHIPS % user, _MEMBERSHIPS % name]
 # args = [user, name]
 _rename_user_script = """
 -- get old user
@@ -96,25 +116,33 @@ redis.call('hdel', KEYS[1], ARGV[1])
 redis.call('hset', KEYS[1], ARGV[2], hash)
 
 -- rename properties
-redis.call('rename', KEYS[2], KEYS[3])
+if redis.call('exists', KEYS[2]) == 1 then
+    redis.call('rename', KEYS[2], KEYS[3])
+end
 
-for i=4, #KEYS, 1 do
-    redis.call('srem', KEYS[i], ARGV[1])
-    redis.call('sadd', KEYS[i], ARGV[2])
+-- rename user in all groups it is a member of
+local groups = redis.call('smembers', KEYS[4])
+for i=1, #groups, 1 do
+    redis.call('srem', 'members_' .. groups[i], ARGV[1])
+    redis.call('sadd', 'members_' .. groups[i], ARGV[2])
+end
+if #groups > 0 then
+    redis.call('rename', KEYS[4], KEYS[5])
 end
 """
 
-# keys = [_USERS, _PROPS % user] + [members_*]
+# keys = [_USERS, _PROPS % user, _MEMBERSHIPS % user]
 # args = [user]
 _remove_user_script = """
 if redis.call('hdel', KEYS[1], ARGV[1]) == 0 then
     return {err="UserNotFound"}
 end
 
-redis.call('del', KEYS[2])
-for i=3, #KEYS, 1 do
-    redis.call('srem', KEYS[i], ARGV[1])
+local groups = redis.call('smembers', KEYS[3])
+for i=1, #groups, 1 do
+    redis.call('srem', 'members_' .. groups[i], ARGV[1])
 end
+redis.call('del', KEYS[2], KEYS[3])
 """
 
 _create_property_script = """
@@ -172,6 +200,9 @@ _create_group_script = _create_group_script_dry + """
 redis.call('sadd', KEYS[1], ARGV[1])
 if #KEYS > 1 then
     redis.call('sadd', KEYS[2], unpack(ARGV, 2))
+    for i=2, #ARGV, 1 do
+        redis.call('sadd', 'memberships_' .. ARGV[i], ARGV[1])
+    end
 end
 """
 
@@ -188,6 +219,13 @@ end
 redis.call('srem', KEYS[1], ARGV[1])
 redis.call('sadd', KEYS[1], ARGV[2])
 
+-- update the memberships of all members
+local members = redis.call('smembers', KEYS[2])
+for i=1, #members, 1 do
+    redis.call('srem', 'memberships_' .. members[i], ARGV[1])
+    redis.call('sadd', 'memberships_' .. members[i], ARGV[2])
+end
+
 -- rename user keys
 if redis.call('exists', KEYS[2]) == 1 then
     redis.call('rename', KEYS[2], KEYS[3])
@@ -217,6 +255,13 @@ end
 redis.call('srem', KEYS[1], ARGV[1])
 redis.call('sadd', KEYS[1], ARGV[2])
 
+-- update the memberships of all members
+local members = redis.call('smembers', KEYS[2])
+for i=1, #members, 1 do
+    redis.call('srem', 'memberships_' .. members[i], ARGV[1])
+    redis.call('sadd', 'memberships_' .. members[i], ARGV[2])
+end
+
 -- rename user keys
 if redis.call('exists', KEYS[2]) == 1 then
     redis.call('rename', KEYS[2], KEYS[3])
@@ -233,27 +278,32 @@ for i=6, #KEYS, 1 do
 end
 """
 
-# keys = [_USERS, g_key] + [self._gu_key(g, service) for g in self.conn.smembers(g_key)]
-# args = [user] + groups
+# keys = [_USERS, _GROUPS, _MEMBERSHIPS % user]
+# args = [user, sid] + groups
 _set_memberships_script = """
 if redis.call('hexists', KEYS[1], ARGV[1]) == 0 then
     return {err="UserNotFound"}
 end
 
--- remove existing memberships
-for i=3, #KEYS, 1 do
-    -- TODO: Skip keys present in ARGV[3:]?
-    redis.call('srem', KEYS[i], ARGV[1])
+-- remove existing memberships in groups of the service
+local prefix = ARGV[2] .. '_'
+local groups = redis.call('smembers', KEYS[3])
+for i=1, #groups, 1 do
+    if string.sub(groups[i], 1, #prefix) == prefix then
+        redis.call('srem', 'members_' .. groups[i], ARGV[1])
+        redis.call('srem', KEYS[3], groups[i])
+    end
 end
 
--- create any groups that don't exist yet
-if #ARGV > 1 then
-    redis.call('sadd', KEYS[2], unpack(ARGV, 2))
-end
+if #ARGV > 2 then
+    -- create any groups that don't exist yet
+    redis.call('sadd', KEYS[2], unpack(ARGV, 3))
+    redis.call('sadd', KEYS[3], unpack(ARGV, 3))
 
--- add user to groups
-for i=2, #ARGV, 1 do
-    redis.call('sadd', 'members_' .. ARGV[i], ARGV[1])
+    -- add user to groups
+    for i=3, #ARGV, 1 do
+        redis.call('sadd', 'members_' .. ARGV[i], ARGV[1])
+    end
 end
 """
 
@@ -272,13 +322,21 @@ for i=2, #ARGV, 1 do
     end
 end
 
+local members = redis.call('smembers', KEYS[2])
+for i=1, #members, 1 do
+    redis.call('srem', 'memberships_' .. members[i], ARGV[1])
+end
+
 redis.call('del', KEYS[2])
 if #ARGV > 1 then
     redis.call('sadd', KEYS[2], unpack(ARGV, 2))
+    for i=2, #ARGV, 1 do
+        redis.call('sadd', 'memberships_' .. ARGV[i], ARGV[1])
+    end
 end
 """
 
-# keys=[_GROUPS, 'user', self._gu_key(group, service)]
+# keys=[_GROUPS, 'user', self._gu_key(group, service), _MEMBERSHIPS % user]
 # args=[ref_key, user])
 _add_member_script = """
 if redis.call('sismember', KEYS[1], ARGV[1]) == 0 then
@@ -287,9 +345,10 @@ elseif redis.call('hexists', KEYS[2], ARGV[2]) == 0 then
     return {err="UserNotFound"}
 end
 redis.call('sadd', KEYS[3], ARGV[2])
+redis.call('sadd', KEYS[4], ARGV[1])
 """
 
-# keys=[_GROUPS, self._gu_key(group, service)]
+# keys=[_GROUPS, self._gu_key(group, service), _MEMBERSHIPS % user]
 # args=[ref_key, user])
 _remove_member_script = """
 if redis.call('sismember', KEYS[1], ARGV[1]) == 0 then
@@ -297,6 +356,7 @@ if redis.call('sismember', KEYS[1], ARGV[1]) == 0 then
 elseif redis.call('srem', KEYS[2], ARGV[2]) == 0 then
     return {err="UserNotFound"}
 end
+redis.call('srem', KEYS[3], ARGV[1])
 """
 
 # keys = [g_key, sg_key, self._sg_key(group, service), self._mg_key(subgroup, subservice)]
@@ -362,6 +422,55 @@ if no_groups > 0 then
 end
 """
 
+# keys = [_GROUPS]
+# args = [ref_key, depth]
+_ancestors_script = """
+if redis.call('sismember', KEYS[1], ARGV[1]) == 0 then
+    return {err="GroupNotFound"}
+end
+
+-- breadth-first search for all meta-groups up to the given depth
+local groups = {ARGV[1]}
+local visited = {[ARGV[1]]=true}
+local frontier = {ARGV[1]}
+for depth=1, tonumber(ARGV[2]), 1 do
+    local found = {}
+    for i=1, #frontier, 1 do
+        local parents = redis.call('smembers', 'metagroups_' .. frontier[i])
+        for j=1, #parents, 1 do
+            if not visited[parents[j]] then
+                visited[parents[j]] = true
+                groups[#groups+1] = parents[j]
+                found[#found+1] = parents[j]
+            end
+        end
+    end
+    if #found == 0 then
+        break
+    end
+    frontier = found
+end
+"""
+
+_members_script = _ancestors_script + """
+local keys = {}
+for i=1, #groups, 1 do
+    keys[i] = 'members_' .. groups[i]
+end
+return redis.call('sunion', unpack(keys))
+"""
+
+# keys = [_GROUPS]
+# args = [ref_key, depth, user]
+_is_member_script = _ancestors_script + """
+for i=1, #groups, 1 do
+    if redis.call('sismember', 'members_' .. groups[i], ARGV[3]) == 1 then
+        return 1
+    end
+end
+return 0
+"""
+
 # keys = [_GROUPS, sg_key]
 # args = [ref_key]
 _subgroups_script = """
@@ -404,6 +513,11 @@ if redis.call('sismember', KEYS[1], ARGV[1]) == 0 then
 end
 
 redis.call('srem', KEYS[1], ARGV[1])
+
+local members = redis.call('smembers', KEYS[2])
+for i=1, #members, 1 do
+    redis.call('srem', 'memberships_' .. members[i], ARGV[1])
+end
 redis.call('del', KEYS[2], KEYS[3], KEYS[4])
 
 for i=5, #KEYS, 1 do
@@ -414,6 +528,7 @@ end
 _USERS = 'users'
 _PROPS = 'props_%s'
 _GROUPS = 'groups'
+_MEMBERSHIPS = 'memberships_%s'  # groups a user is a direct member of
 
 
 class RedisBackend(BackendBase):
@@ -432,18 +547,30 @@ class RedisBackend(BackendBase):
     ``REDIS_DB``
         The id of the Redis database. Default: ``0``.
 
-    .. NOTE:: Transaction support of this backend is limited. Basic transaction management works,
-       but no sensible values are returned for method calls within a transaction.
+    .. versionchanged:: 0.7.2
+       The backend keeps an index of the groups of every user. Run ``restauth-manage.py
+       redismemberships`` once to build it from existing data.
+
+    .. NOTE:: Transaction support of this backend is limited. Within a transaction, all writes
+       are queued and sent to Redis in a single MULTI/EXEC block when the transaction ends, so no
+       sensible values are returned for method calls within a transaction. Except for
+       :py:class:`~common.errors.UserExists`, :py:class:`~common.errors.PropertyExists` and
+       :py:class:`~common.errors.GroupExists` raised by the ``create_*`` methods, errors are only
+       raised when the transaction ends and Redis does not roll back the other commands in that
+       case. Dry-runs and exceptions raised within the transaction discard all queued writes.
     """
 
     library = 'redis'
+    chunk_size = 1000
 
     TRANSACTION_MANAGER = RedisTransactionManager
+    SUPPORTS_TRANSACTION_READS = False  # writes are only queued in the pipeline
 
     def __init__(self, HOST='localhost', PORT=6379, DB=0, **kwargs):
         self.redis = self._load_library()
         kwargs.setdefault('decode_responses', True)
         self.conn = self.redis.StrictRedis(host=HOST, port=PORT, db=DB, **kwargs)
+        self._local = threading.local()
 
         # register scripts
         self._create_user = self.conn.register_script(_create_user_script)
@@ -462,6 +589,8 @@ class RedisBackend(BackendBase):
         self._set_members = self.conn.register_script(_set_members_script)
         self._add_member = self.conn.register_script(_add_member_script)
         self._remove_member = self.conn.register_script(_remove_member_script)
+        self._members = self.conn.register_script(_members_script)
+        self._is_member = self.conn.register_script(_is_member_script)
         self._add_subgroup = self.conn.register_script(_add_subgroup_script)
         self._set_subgroups = self.conn.register_script(_set_subgroups_script)
         self._subgroups = self.conn.register_script(_subgroups_script)
@@ -469,6 +598,17 @@ class RedisBackend(BackendBase):
         self._remove_subgroup = self.conn.register_script(_remove_subgroup_script)
         self._remove_group = self.conn.register_script(_remove_group_script)
 
+    # The pipeline of the current transaction, if any
+    @property
+    def _pipe(self):
+        return getattr(self._local, 'pipe', None)
+
+    # The client to send writes to: queue them in the current transaction, if any
+    @property
+    def _client(self):
+        pipe = self._pipe
+        return self.conn if pipe is None else pipe
+
     # serialize a dictionary into a flat list including keys and values
     def _listify(self, d):
         li = []
@@ -510,37 +650,62 @@ class RedisBackend(BackendBase):
         else:
             return (name, int(sid))
 
-    def create_user(self, user, password=None, properties=None, groups=None, dry=False):
+    def _create_user_args(self, user, password, properties, groups):
         password = make_password(password) if password else ''
-        properties = properties or {}
+        properties = self._listify(properties or {})
 
-        if dry is True:  # handle dry mode
-            if self.conn.hexists(_USERS, user):  # this is really the only error condition
-                raise UserExists(user)
-            return
-
-        properties = self._listify(properties)
-
-        keys = [_USERS, _PROPS % user]
+        keys = [_USERS, _PROPS % user, _MEMBERSHIPS % user]
         args = [user, password, len(properties)]
         if properties:
             args += properties
 
-        if groups is not None:
+        if groups:
             keys.append(_GROUPS)
 
             for group, service in groups:
                 sid = self._sid(service)
                 keys.append(self._gu_key(group, sid))
                 args.append(self._ref_key(group, sid))
+        return keys, args
 
+    def create_user(self, user, password=None, properties=None, groups=None, dry=False):
+        if dry is True:  # handle dry mode
+            if self.conn.hexists(_USERS, user):  # this is really the only error condition
+                raise UserExists(user)
+            return
+        elif self._pipe is not None and self.conn.hexists(_USERS, user):
+            # Writes in a transaction only fail when it ends, but callers rely on this error.
+            raise UserExists(user)
+
+        keys, args = self._create_user_args(user, password, properties, groups)
         try:
-            self._create_user(keys=keys, args=args)
+            self._create_user(keys=keys, args=args, client=self._client)
         except self.redis.ResponseError as e:
             if e.message == 'UserExists':
                 raise UserExists(user)
             raise
 
+    def create_users(self, users, dry=False):
+        if dry is True or self._pipe is not None:
+            return super(RedisBackend, self).create_users(users, dry=dry)
+
+        # Invoke the script for every user in a (non-transactional) pipeline, so we only need one
+        # round trip per chunk and still get a result for every user.
+        existing = []
+        for i in range(0, len(users), self.chunk_size):
+            chunk = users[i:i + self.chunk_size]
+            pipe = self.conn.pipeline(transaction=False)
+            for user, password, properties, groups in chunk:
+                keys, args = self._create_user_args(user, password, properties, groups)
+                self._create_user(keys=keys, args=args, client=pipe)
+
+            for (user, _, _, _), result in zip(chunk, pipe.execute(raise_on_error=False)):
+                if isinstance(result, self.redis.ResponseError):
+                    if result.message != 'UserExists':
+                        raise result
+                    existing.append(user)
+        return existing
+
     def list_users(self):
         return self.conn.hkeys(_USERS)
 
@@ -549,9 +714,8 @@ class RedisBackend(BackendBase):
 
     def rename_user(self, user, name):
         try:
-            keys = [_USERS, _PROPS % user, _PROPS % name]
-            keys += list(self.conn.scan_iter(match='members_*'))
-            self._rename_user(keys=keys, args=[user, name])
+            keys = [_USERS, _PROPS % user, _PROPS % name, _MEMBERSHIPS % user, _MEMBERSHIPS % name]
+            self._rename_user(keys=keys, args=[user, name], client=self._client)
         except self.redis.ResponseError as e:
             if e.message == 'UserNotFound':
                 raise UserNotFound(user)
@@ -570,7 +734,8 @@ class RedisBackend(BackendBase):
         stored = self.conn.hget(_USERS, user)
         if stored is None:
             raise UserNotFound(user)
-        matches = check_password(password, stored, setter)
+        if not check_password(password, stored, setter):
+            return False
 
         if groups is not None:
             for group, service in groups:
@@ -578,13 +743,49 @@ class RedisBackend(BackendBase):
                     return True
             return False
 
-        return matches
+        return True
+
+    def authenticate(self, user, password, service, groups=None, keys=None):
+        if password is None:
+            return None
+
+        # fetch the password hash, direct memberships and properties in one round trip
+        pipe = self.conn.pipeline()
+        pipe.hget(_USERS, user)
+        pipe.smembers(_MEMBERSHIPS % user)
+        if keys is None:
+            pipe.hgetall(_PROPS % user)
+        elif keys:
+            pipe.hmget(_PROPS % user, keys)
+        result = pipe.execute()
+        stored, ref_keys = result[:2]
+
+        if stored is None:
+            raise UserNotFound(user)
+
+        def setter(raw_password):
+            self.set_password(user, raw_password)
+
+        if not check_password(password, stored, setter):
+            return None
+
+        ref_keys |= self._subgroup_keys(ref_keys, max_depth=settings.GROUP_RECURSION_DEPTH)
+        prefix = '%s_' % self._sid(service)
+        memberships = [self._parse_key(k)[0] for k in ref_keys if k.startswith(prefix)]
+        if groups is not None and not self._member_of_any(groups, service, memberships):
+            return None
+
+        if keys is None:
+            properties = result[2]
+        else:
+            properties = {k: v for k, v in zip(keys, result[2] if keys else []) if v is not None}
+        return properties, memberships
 
     def set_password(self, user, password=None):
         password = make_password(password) if password else ''
 
         try:
-            self._set_password(keys=[_USERS], args=[user, password])
+            self._set_password(keys=[_USERS], args=[user, password], client=self._client)
         except self.redis.ResponseError as e:
             if e.message == 'UserNotFound':
                 raise UserNotFound(user)
@@ -594,7 +795,7 @@ class RedisBackend(BackendBase):
         hash = import_hash(algorithm, hash)
 
         try:
-            self._set_password(keys=[_USERS], args=[user, hash])
+            self._set_password(keys=[_USERS], args=[user, hash], client=self._client)
         except self.redis.ResponseError as e:
             if e.message == 'UserNotFound':
                 raise UserNotFound(user)
@@ -602,21 +803,32 @@ class RedisBackend(BackendBase):
 
     def remove_user(self, user):
         try:
-            keys = [_USERS, _PROPS % user] + list(self.conn.scan_iter(match='members_*'))
-            self._remove_user(keys=keys, args=[user])
+            keys = [_USERS, _PROPS % user, _MEMBERSHIPS % user]
+            self._remove_user(keys=keys, args=[user], client=self._client)
         except self.redis.ResponseError as e:
             if e.message == 'UserNotFound':
                 raise UserNotFound(user)
             raise
 
-    def get_properties(self, user):
+    def get_properties(self, user, keys=None):
+        if keys is not None:
+            keys = list(keys)
+            if not keys:  # HMGET requires at least one key
+                if not self.conn.hexists(_USERS, user):
+                    raise UserNotFound(user)
+                return {}
 
         pipe = self.conn.pipeline()
         pipe.hexists(_USERS, user)
-        pipe.hgetall(_PROPS % user)
+        if keys is None:
+            pipe.hgetall(_PROPS % user)
+        else:
+            pipe.hmget(_PROPS % user, keys)
         exists, properties = pipe.execute()
         if exists is False:
             raise UserNotFound(user)
+        if keys is not None:
+            properties = {k: v for k, v in zip(keys, properties) if v is not None}
         return properties
 
     def create_property(self, user, key, value, dry=False):
@@ -630,9 +842,12 @@ class RedisBackend(BackendBase):
             elif prop_exists is True:
                 raise PropertyExists(key)
             return
+        elif self._pipe is not None and self.conn.hexists(_PROPS % user, key):
+            raise PropertyExists(key)  # see create_user()
 
         try:
-            self._create_property(keys=[_USERS, _PROPS % user], args=[user, key, value])
+            self._create_property(keys=[_USERS, _PROPS % user], args=[user, key, value],
+                                  client=self._client)
         except self.redis.ResponseError as e:
             if e.message == 'UserNotFound':
                 raise UserNotFound(user)
@@ -653,7 +868,8 @@ class RedisBackend(BackendBase):
 
     def set_property(self, user, key, value):
         try:
-            return self._set_property(keys=[_USERS, _PROPS % user], args=[user, key, value])
+            return self._set_property(keys=[_USERS, _PROPS % user], args=[user, key, value],
+                                      client=self._client)
         except self.redis.ResponseError as e:
             if e.message == 'UserNotFound':
                 raise UserNotFound(user)
@@ -667,7 +883,7 @@ class RedisBackend(BackendBase):
 
         try:
             self._set_properties(keys=[_USERS, _PROPS % user],
-                                 args=[user, ] + self._listify(properties))
+                                 args=[user, ] + self._listify(properties), client=self._client)
         except self.redis.ResponseError as e:
             if e.message == 'UserNotFound':
                 raise UserNotFound(user)
@@ -675,7 +891,8 @@ class RedisBackend(BackendBase):
 
     def remove_property(self, user, key):
         try:
-            self._remove_property(keys=[_USERS, _PROPS % user], args=[user, key])
+            self._remove_property(keys=[_USERS, _PROPS % user], args=[user, key],
+                                  client=self._client)
         except self.redis.ResponseError as e:
             if e.message == 'UserNotFound':
                 raise UserNotFound(user)
@@ -689,16 +906,18 @@ class RedisBackend(BackendBase):
             groups = self.conn.sscan_iter(_GROUPS, match='%s_*' % sid)
             return [self._parse_key(g)[0] for g in groups]
         else:
-            # TODO: rewrite as lua script
-            if not self.conn.hexists(_USERS, user):
+            pipe = self.conn.pipeline()
+            pipe.hexists(_USERS, user)
+            pipe.smembers(_MEMBERSHIPS % user)
+            exists, ref_keys = pipe.execute()
+            if not exists:
                 raise UserNotFound(user)
 
-            groups = set()
-            for group in self.conn.sscan_iter(_GROUPS, match='%s_*' % sid):
-                group = self._parse_key(group)[0]
-                if self.is_member(group=group, service=service, user=user):
-                    groups.add(group)
-            return list(groups)
+            # add groups that inherit memberships from the groups the user is a direct member of
+            ref_keys |= self._subgroup_keys(ref_keys, max_depth=settings.GROUP_RECURSION_DEPTH)
+
+            prefix = '%s_' % sid
+            return [self._parse_key(k)[0] for k in ref_keys if k.startswith(prefix)]
 
     def create_group(self, group, service, users=None, dry=False):
         sid = self._sid(service)
@@ -724,9 +943,11 @@ class RedisBackend(BackendBase):
             elif self.conn.sismember(_GROUPS, ref_key):
                 raise GroupExists(group)
             return
+        elif self._pipe is not None and self.conn.sismember(_GROUPS, ref_key):
+            raise GroupExists(group)  # see create_user()
 
         try:
-            self._create_group(keys=keys, args=args)
+            self._create_group(keys=keys, args=args, client=self._client)
         except self.redis.ResponseError as e:
             if e.message == 'GroupExists':
                 raise GroupExists(group)
@@ -750,7 +971,7 @@ class RedisBackend(BackendBase):
         args = [old_ref, new_ref]
 
         try:
-            self._rename_group(keys=keys, args=args)
+            self._rename_group(keys=keys, args=args, client=self._client)
         except self.redis.ResponseError as e:
             if e.message == 'GroupNotFound':
                 raise GroupNotFound(group, service)
@@ -774,7 +995,7 @@ class RedisBackend(BackendBase):
         args = [old_ref, new_ref]
 
         try:
-            self._set_service(keys=keys, args=args)
+            self._set_service(keys=keys, args=args, client=self._client)
         except self.redis.ResponseError as e:
             if e.message == 'GroupNotFound':
                 raise GroupNotFound(group, service)
@@ -790,14 +1011,11 @@ class RedisBackend(BackendBase):
         sid = self._sid(service)
         groups = [self._ref_key(g, sid) for g in groups]
 
-        # All existing and created groups may be modified
-        existing_groups = self.conn.sscan_iter(_GROUPS, match='%s_*' % sid)
-        clear_groups = set(existing_groups) | set(groups)
-        keys = [_USERS, _GROUPS] + ['members_%s' % g for g in clear_groups]
-        args = [user, ] + groups
+        keys = [_USERS, _GROUPS, _MEMBERSHIPS % user]
+        args = [user, sid] + groups
 
         try:
-            self._set_memberships(keys=keys, args=args)
+            self._set_memberships(keys=keys, args=args, client=self._client)
         except self.redis.ResponseError as e:
             if e.message == 'UserNotFound':
                 raise UserNotFound(user)
@@ -812,7 +1030,7 @@ class RedisBackend(BackendBase):
             args += users
 
         try:
-            self._set_members(keys=keys, args=args)
+            self._set_members(keys=keys, args=args, client=self._client)
         except self.redis.ResponseError as e:
             if e.message == 'GroupNotFound':
                 raise GroupNotFound(group, service)
@@ -824,10 +1042,10 @@ class RedisBackend(BackendBase):
 
     def add_member(self, group, service, user):
         sid = self._sid(service)
-        keys = [_GROUPS, _USERS, self._gu_key(group, sid)]
+        keys = [_GROUPS, _USERS, self._gu_key(group, sid), _MEMBERSHIPS % user]
         args = [self._ref_key(group, sid), user]
         try:
-            self._add_member(keys=keys, args=args)
+            self._add_member(keys=keys, args=args, client=self._client)
         except self.redis.ResponseError as e:
             if e.message == 'GroupNotFound':
                 raise GroupNotFound(group, service)
@@ -835,60 +1053,44 @@ class RedisBackend(BackendBase):
                 raise UserNotFound(user)
             raise
 
-    def _parent_keys(self, ref_key, depth, max_depth):
-        parents = self.conn.smembers('metagroups_%s' % ref_key)
-        if depth < max_depth:
-            for parent in set(parents):
-                parents |= self._parent_keys(parent, depth + 1, max_depth)
-        return parents
+    def _subgroup_keys(self, ref_keys, max_depth):
+        subgroups = set()
+        frontier = ref_keys
+        for depth in range(max_depth):
+            if not frontier:
+                break
+            frontier = self.conn.sunion(*['subgroups_%s' % k for k in frontier])
+            frontier -= subgroups | ref_keys
+            subgroups |= frontier
+        return subgroups
 
     def members(self, group, service, depth=None):
-        # TODO: rewrite as lua script
-
         if depth is None:
             depth = settings.GROUP_RECURSION_DEPTH
 
-        sid = self._sid(service)
-        ref_key = self._ref_key(group, sid)
-        if not self.conn.sismember(_GROUPS, ref_key):
-            raise GroupNotFound(group, service)
-
-        members = self.conn.smembers(self._gu_key(group, sid))
-        if depth == 0:
-            return list(members)
-
-        sid = self._sid(service)
-        ref_keys = self._parent_keys(ref_key, depth=1, max_depth=depth)
-        ref_keys = ['members_%s' % k for k in ref_keys]
-        if ref_keys:
-            return list(members | self.conn.sunion(*ref_keys))
-        else:
-            return list(members)
+        try:
+            return self._members(keys=[_GROUPS],
+                                 args=[self._ref_key(group, self._sid(service)), depth])
+        except self.redis.ResponseError as e:
+            if e.message == 'GroupNotFound':
+                raise GroupNotFound(group, service)
+            raise
 
     def is_member(self, group, service, user):
-        # TODO: rewrite as lua script
-        sid = self._sid(service)
-        ref_key = self._ref_key(group, sid)
-        if not self.conn.sismember(_GROUPS, ref_key):
-            raise GroupNotFound(group, service)
-
-        members = self.conn.smembers(self._gu_key(group, sid))
-        if user in members:
-            return True
-
-        ref_keys = self._parent_keys(self._ref_key(group, sid), depth=1,
-                                     max_depth=settings.GROUP_RECURSION_DEPTH)
-        ref_keys = ['members_%s' % k for k in ref_keys]
-        if ref_keys:  # we might have no parents
-            return user in self.conn.sunion(*ref_keys)
-        return False
+        args = [self._ref_key(group, self._sid(service)), settings.GROUP_RECURSION_DEPTH, user]
+        try:
+            return self._is_member(keys=[_GROUPS], args=args) == 1
+        except self.redis.ResponseError as e:
+            if e.message == 'GroupNotFound':
+                raise GroupNotFound(group, service)
+            raise
 
     def remove_member(self, group, service, user):
         sid = self._sid(service)
-        keys = [_GROUPS, self._gu_key(group, sid)]
+        keys = [_GROUPS, self._gu_key(group, sid), _MEMBERSHIPS % user]
         args = [self._ref_key(group, sid), user]
         try:
-            self._remove_member(keys=keys, args=args)
+            self._remove_member(keys=keys, args=args, client=self._client)
         except self.redis.ResponseError as e:
             if e.message == 'GroupNotFound':
                 raise GroupNotFound(group, service)
@@ -903,7 +1105,7 @@ class RedisBackend(BackendBase):
         keys = [_GROUPS, self._sg_key(group, sid), self._mg_key(subgroup, sub_sid)]
         args = [self._ref_key(group, sid), self._ref_key(subgroup, sub_sid)]
         try:
-            self._add_subgroup(keys=keys, args=args)
+            self._add_subgroup(keys=keys, args=args, client=self._client)
         except self.redis.ResponseError as e:
             raise GroupNotFound(*self._parse_key(e.message))
 
@@ -924,7 +1126,7 @@ class RedisBackend(BackendBase):
         keys = [sg_key, _GROUPS, ] + mg_keys + [k for k in add_mg_keys if k not in mg_keys]
         args = [sid, ref_key, ] + ref_keys
         try:
-            self._set_subgroups(keys=keys, args=args)
+            self._set_subgroups(keys=keys, args=args, client=self._client)
         except self.redis.ResponseError:
             # TODO: we do not yet pass the correct value
             raise GroupNotFound(group, service=None)
@@ -982,7 +1184,7 @@ class RedisBackend(BackendBase):
         args = [meta_ref_key, sub_ref_key]
 
         try:
-            self._remove_subgroup(keys=keys, args=args)
+            self._remove_subgroup(keys=keys, args=args, client=self._client)
         except self.redis.ResponseError as e:
             raise GroupNotFound(*self._parse_key(e.message))
 
@@ -1002,12 +1204,33 @@ class RedisBackend(BackendBase):
         keys = [_GROUPS, gu_key, sg_key, mg_key] + mg_keys + sg_keys
         args = [ref_key]
         try:
-            self._remove_group(keys=keys, args=args)
+            self._remove_group(keys=keys, args=args, client=self._client)
         except self.redis.ResponseError as e:
             if e.message == 'GroupNotFound':
                 raise GroupNotFound(group, service)
             raise
 
+    def rebuild_memberships(self):
+        """Rebuild the index of groups each user is a direct member of.
+
+        The index is maintained by all operations of this backend, this method only has to be
+        called when upgrading from a version that did not yet maintain it.
+
+        :return: The number of memberships found.
+        """
+        pipe = self.conn.pipeline()
+        for key in self.conn.scan_iter(match=_MEMBERSHIPS % '*'):
+            pipe.delete(key)
+        pipe.execute()
+
+        count = 0
+        for ref_key in self.conn.sscan_iter(_GROUPS):
+            for user in self.conn.sscan_iter('members_%s' % ref_key):
+                pipe.sadd(_MEMBERSHIPS % user, ref_key)
+                count += 1
+            pipe.execute()
+        return count
+
     def testSetUp(self):
         self.conn.flushdb()
 
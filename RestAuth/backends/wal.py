@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of RestAuth (https://restauth.net).
+#
+# RestAuth is free software: you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# RestAuth is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with RestAuth. If not,
+# see <http://www.gnu.org/licenses/>.
+
+from __future__ import unicode_literals
+
+import mmap
+import os
+import re
+import struct
+import threading
+import zlib
+
+from six.moves import cPickle as pickle
+
+# every record is prefixed with its length and CRC32 checksum
+_HEADER = struct.Struct(str('>II'))
+_SEGMENT = re.compile(r'^log\.(\d{8})$')
+
+
+class WriteAheadLog(object):
+    """Durable append-only log with periodic snapshots.
+
+    The log is stored in a directory with a ``snapshot`` file and one or more log segments named
+    ``log.<number>``. Every call to :py:meth:`append` writes one record to the current segment and
+    only returns once the record is on disk. Threads appending at the same time share a single
+    ``fsync()`` ("group commit"): The first waiting thread syncs all records written so far while
+    the others wait for it to finish.
+
+    The state stored in the log is built by the ``apply`` callable, which gets the current state
+    (``None`` for an empty log) and a record and returns the new state. After ``snapshot_entries``
+    records, the current segment is closed and a new snapshot is built in a background thread: It
+    loads the previous snapshot and applies all records of the closed segments. The snapshot is
+    built from the files alone, so neither the lock of the log nor any lock of the caller is held
+    while it is built. If the previous snapshot is still being built, the next one also contains the
+    segment. The snapshot stores the number of the first segment it does not contain, so older
+    segments are removed once the snapshot is on disk.
+
+    :param path: Directory to store the log in. It is created if it does not exist.
+    :param apply: Callable that applies a record to a state and returns the new state.
+    :param snapshot_entries: Write a snapshot after this many records.
+    :param sync: Set to ``False`` to not call ``fsync()``. Records are still written, but may be lost
+        if the operating system crashes.
+    """
+
+    def __init__(self, path, apply, snapshot_entries=100000, sync=True):
+        self.path = path
+        self.apply = apply
+        self.snapshot_entries = snapshot_entries
+        self.sync = sync
+
+        self._lock = threading.Lock()
+        self._synced = threading.Condition(self._lock)
+        self._written = 0  # number of records written
+        self._flushed = 0  # number of records on disk
+        self._syncing = False
+        self._entries = 0  # number of records in the current segment
+        self._file = None
+        self._segment = 0
+        self._snapshot_thread = None
+
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+    def _segment_path(self, segment):
+        return os.path.join(self.path, 'log.%08d' % segment)
+
+    @property
+    def _snapshot_path(self):
+        return os.path.join(self.path, 'snapshot')
+
+    def _segments(self):
+        segments = []
+        for name in os.listdir(self.path):
+            match = _SEGMENT.match(name)
+            if match is not None:
+                segments.append(int(match.group(1)))
+        return sorted(segments)
+
+    def _fsync(self, fileobj):
+        if self.sync:
+            os.fsync(fileobj.fileno())
+
+    def _sync_directory(self):
+        if self.sync and hasattr(os, 'O_DIRECTORY'):
+            fd = os.open(self.path, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def _read_segment(self, segment):
+        """Yield all records of a segment, truncating a partially written record at the end."""
+
+        path = self._segment_path(segment)
+        with open(path, 'rb') as stream:
+            data = stream.read()
+
+        offset = 0
+        while offset + _HEADER.size <= len(data):
+            length, checksum = _HEADER.unpack_from(data, offset)
+            record = data[offset + _HEADER.size:offset + _HEADER.size + length]
+            if len(record) < length or zlib.crc32(record) & 0xffffffff != checksum:
+                break
+            yield pickle.loads(record)
+            offset += _HEADER.size + length
+
+        if offset < len(data):  # torn write, e.g. if the server crashed while writing
+            with open(path, 'r+b') as stream:
+                stream.truncate(offset)
+                self._fsync(stream)
+
+    def _load_snapshot(self):
+        """Get a tuple of the first segment not contained in the snapshot and its state."""
+
+        if os.path.exists(self._snapshot_path) and os.path.getsize(self._snapshot_path):
+            with open(self._snapshot_path, 'rb') as stream:
+                snapshot = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    return pickle.loads(snapshot)
+                finally:
+                    snapshot.close()
+        return 0, None
+
+    def recover(self):
+        """Load the latest snapshot and apply all records written after it.
+
+        Returns the recovered state or ``None`` if the log is empty. Records can be appended once
+        the log is recovered.
+        """
+
+        start, state = self._load_snapshot()
+        segment = start - 1
+        for segment in self._segments():
+            if segment < start:  # already contained in the snapshot
+                os.remove(self._segment_path(segment))
+                continue
+
+            for record in self._read_segment(segment):
+                state = self.apply(state, record)
+
+        # never append to an existing segment, it might have been truncated
+        self._open_segment(max(segment + 1, start))
+        return state
+
+    def _open_segment(self, segment):
+        self._segment = segment
+        self._entries = 0
+        self._file = open(self._segment_path(segment), 'ab')
+        self._sync_directory()
+
+    def append(self, record):
+        """Append a record to the log and wait until it is on disk."""
+
+        self.wait(self.write(record))
+
+    def write(self, record):
+        """Append a record to the log without waiting for it to be on disk.
+
+        Returns the position of the record that can be passed to :py:meth:`wait`.
+        """
+
+        data = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+
+        with self._lock:
+            self._file.write(_HEADER.pack(len(data), zlib.crc32(data) & 0xffffffff))
+            self._file.write(data)
+            self._written += 1
+            self._entries += 1
+            position = self._written
+
+            if self._entries >= self.snapshot_entries:
+                self._rotate()
+            return position
+
+    def wait(self, position):
+        """Wait until the record at the given position is on disk."""
+
+        with self._lock:
+            while self._flushed < position:
+                if self._syncing:  # another thread syncs, maybe including our record
+                    self._synced.wait()
+                    continue
+
+                self._syncing = True
+                target = self._written
+                fileobj = self._file
+                fileobj.flush()
+
+                self._lock.release()
+                try:
+                    self._fsync(fileobj)
+                finally:
+                    self._lock.acquire()
+                    self._syncing = False
+                    self._synced.notify_all()
+                self._flushed = target
+
+    def _rotate(self):
+        """Switch to a new segment and build a snapshot in the background."""
+
+        # the old segment must be completely on disk before the snapshot reads it
+        while self._syncing:
+            self._synced.wait()
+        self._file.flush()
+        self._fsync(self._file)
+        self._flushed = self._written
+        self._file.close()
+        self._open_segment(self._segment + 1)
+
+        # only one snapshot is built at a time, the next one includes all segments closed until then
+        if self._snapshot_thread is None or not self._snapshot_thread.is_alive():
+            self._snapshot_thread = threading.Thread(target=self._write_snapshot,
+                                                     args=(self._segment, ))
+            self._snapshot_thread.daemon = True
+            self._snapshot_thread.start()
+
+    def _write_snapshot(self, segment):
+        start, state = self._load_snapshot()
+        for old in self._segments():
+            if start <= old < segment:
+                for record in self._read_segment(old):
+                    state = self.apply(state, record)
+        data = pickle.dumps((segment, state), pickle.HIGHEST_PROTOCOL)
+
+        tmp = '%s.tmp' % self._snapshot_path
+        with open(tmp, 'wb') as stream:
+            stream.write(data)
+            stream.flush()
+            self._fsync(stream)
+        os.rename(tmp, self._snapshot_path)
+        self._sync_directory()
+
+        for old in self._segments():
+            if old < segment:
+                os.remove(self._segment_path(old))
+
+    def snapshot(self):
+        """Write a snapshot of all records appended so far and wait until it is on disk."""
+
+        with self._lock:
+            if self._snapshot_thread is not None:
+                self._snapshot_thread.join()
+            self._rotate()
+            self._snapshot_thread.join()
+
+    def close(self):
+        with self._lock:
+            if self._snapshot_thread is not None:
+                self._snapshot_thread.join()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
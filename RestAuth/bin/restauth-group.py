@@ -45,6 +45,7 @@ try:
     from common.errors import GroupExists
     from common.errors import GroupNotFound
     from common.errors import UserNotFound
+    from common.models import Change
 except ImportError:  # pragma: no cover
     sys.stderr.write(
         'Error: Cannot import RestAuth. Please make sure RestAuth is in your PYTHONPATH.\n')
@@ -58,6 +59,7 @@ def _main(args):
             backend.create_group(group=args.group, service=args.service)
         except GroupExists:
             parser.error('Group already exists.')
+        Change.objects.group(args.group, Change.CREATED, service=args.service)
     elif args.action in ['list', 'ls']:
         groups = backend.list_groups(service=args.service)
 
@@ -104,22 +106,34 @@ def _main(args):
         if backend.SUPPORTS_GROUP_VISIBILITY is False:
             parser.error('Backend does not support group visiblity.')
         backend.set_service(group=args.group, service=args.service, new_service=args.new_service)
+        Change.objects.group(args.group, Change.DELETED, service=args.service)
+        Change.objects.group(args.group, Change.CREATED, service=args.new_service)
     elif args.action == 'add-user':
         backend.add_member(group=args.group, service=args.service, user=args.user)
+        Change.objects.members_changed([(args.group, args.service)])
     elif args.action == 'add-group':
         if backend.SUPPORTS_SUBGROUPS is False:
             parser.error('Backend does not support subgroups.')
         backend.add_subgroup(group=args.group, service=args.service, subgroup=args.subgroup,
                              subservice=args.sub_service)
+        Change.objects.group(args.group, Change.CHANGED, service=args.service)
+        Change.objects.members_changed([(args.subgroup, args.sub_service)])
     elif args.action in ['delete', 'del', 'rm']:
+        inheriting = Change.objects.inheriting([(args.group, args.service)])[1:]
         backend.remove_group(group=args.group, service=args.service)
+        Change.objects.group(args.group, Change.DELETED, service=args.service)
+        Change.objects.record_many([(Change.GROUP, group, Change.CHANGED, service)
+                                    for group, service in inheriting])
     elif args.action in ['remove-user', 'rm-user', 'del-user']:
         try:
             backend.remove_member(group=args.group, service=args.service, user=args.user)
         except UserNotFound:
             parser.error('User "%s" not member of group "%s".' % (args.user, args.group))
+        Change.objects.members_changed([(args.group, args.service)])
     elif args.action == 'rename':
         backend.rename_group(args.group, args.name, service=args.service)
+        Change.objects.group(args.group, Change.DELETED, service=args.service)
+        Change.objects.group(args.name, Change.CREATED, service=args.service)
     elif args.action in ['remove-group', 'rm-group', 'del-group']:  # pragma: no branch
         if backend.SUPPORTS_SUBGROUPS is False:
             parser.error('Backend does not support subgroups.')
@@ -128,6 +142,8 @@ def _main(args):
                                     subservice=args.sub_service)
         except GroupNotFound:
             parser.error('Group "%s" is not a subgroup of "%s".' % (args.subgroup, args.group))
+        Change.objects.group(args.group, Change.CHANGED, service=args.service)
+        Change.objects.members_changed([(args.subgroup, args.sub_service)])
 
 
 def main(args=None):
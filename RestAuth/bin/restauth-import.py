@@ -53,12 +53,14 @@ try:
 
     from Services.models import Service
     from Services.models import ServiceAddress
+    from Users.tokens import revoke_tokens
     from backends import backend
     from common.cli.parsers import parser
     from common.hashers import import_hash
     from common.errors import GroupExists
     from common.errors import PropertyExists
     from common.errors import UserExists
+    from common.models import Change
 except ImportError:  # pragma: no cover
     sys.stderr.write(
         'Error: Cannot import RestAuth. Please make sure RestAuth is in your PYTHONPATH.\n')
@@ -113,9 +115,13 @@ def save_users(users, args, parser):
 
         if not created and args.skip_existing_users:
             continue
+        Change.objects.user(username, Change.CREATED if created else Change.CHANGED)
 
         # handle password:
         if 'password' in data and (created or args.overwrite_passwords):
+            if not created:
+                revoke_tokens(username)
+
             pwd = data['password']
             if isinstance(pwd, six.string_types):
                 backend.set_password(user=username, password=pwd)
@@ -172,12 +178,14 @@ def save_groups(groups, args, parser):
 
         try:
             backend.create_group(group=name, service=service)
+            Change.objects.group(name, Change.CREATED, service=service)
             print("* %s: created." % name)
         except GroupExists:
             if args.skip_existing_groups:
                 print("* %s: Already exists, skipping." % name)
                 continue
             else:
+                Change.objects.members_changed([(name, service)])
                 print("* %s: Already exists, adding memberships." % name)
 
         for username in data.get('users', []):
@@ -198,6 +206,7 @@ def save_groups(groups, args, parser):
 
                 backend.add_subgroup(group=group[0], service=group[1], subgroup=name,
                                      subservice=service)
+                Change.objects.members_changed([(name, service)])
     else:
         print('Warning: Backend does not support subgroups, subgroups discarded.')
 
@@ -42,6 +42,7 @@ try:
     from django.db import transaction
     from django.db.utils import IntegrityError
 
+    from Services.cache import invalidate_service_cache
     from Services.models import Service
     from Services.cli.parsers import parser
 except ImportError:  # pragma: no cover
@@ -103,6 +104,10 @@ def main(args=None):
     elif args.action == 'rm-permissions':  # pragma: no branch
         args.service.user_permissions.remove(*args.permissions)
 
+    if args.action not in ('ls', 'view'):
+        # services authenticated with the old credentials, hosts or permissions must not be used
+        invalidate_service_cache()
+
 
 if __name__ == '__main__':  # pragma: no cover
     main()
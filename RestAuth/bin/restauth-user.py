@@ -43,9 +43,11 @@ try:
 
     from Services.models import Service
     from Users.cli.parsers import parser
+    from Users.tokens import revoke_tokens
     from backends import backend
     from common.errors import UserExists
     from common.errors import UserNotFound
+    from common.models import Change
 except ImportError:  # pragma: no cover
     sys.stderr.write(
         'Error: Cannot import RestAuth. Please make sure RestAuth is in your PYTHONPATH.\n')
@@ -62,6 +64,7 @@ def main(args=None):
             print(args.pwd)
 
         backend.set_password(user=args.user, password=password)
+        Change.objects.user(args.user, Change.CREATED)
     elif args.action in ['ls', 'list']:
         for username in sorted(backend.list_users()):
             if six.PY3:  # pragma: py3
@@ -82,6 +85,8 @@ def main(args=None):
             print(args.pwd)
 
         backend.set_password(user=args.user, password=args.pwd)
+        revoke_tokens(args.user)
+        Change.objects.user(args.user, Change.CHANGED)
     elif args.action == 'view':
         props = backend.get_properties(user=args.user)
 
@@ -129,8 +134,13 @@ def main(args=None):
             parser.error("%s: %s" % (args.name, e))
         except UserExists as e:
             parser.error("%s: %s" % (args.name, e))
+        revoke_tokens(args.user)
+        Change.objects.user(args.user, Change.DELETED)
+        Change.objects.user(args.name, Change.CREATED)
     elif args.action in ['delete', 'rm', 'remove']:  # pragma: no branch
         backend.remove_user(user=args.user)
+        revoke_tokens(args.user)
+        Change.objects.user(args.user, Change.DELETED)
 
 
 if __name__ == '__main__':  # pragma: no cover
@@ -18,6 +18,11 @@ from __future__ import unicode_literals
 from RestAuthCommon.error import PreconditionFailed
 from RestAuthCommon.error import ResourceConflict
 from RestAuthCommon.error import ResourceNotFound
+from RestAuthCommon.error import RestAuthRuntimeException
+
+
+class ServiceUnavailable(RestAuthRuntimeException):
+    response_code = 503
 
 
 class PasswordInvalid(PreconditionFailed):
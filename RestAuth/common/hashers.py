@@ -16,10 +16,17 @@
 from __future__ import unicode_literals
 
 import hashlib
+import multiprocessing
+import os
+import threading
 from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError
 
 from hashers_passlib import PasslibHasher
 
+from django.conf import settings
+from django.contrib.auth import hashers as django_hashers
 from django.contrib.auth.hashers import BasePasswordHasher
 from django.contrib.auth.hashers import identify_hasher
 from django.contrib.auth.hashers import mask_hash
@@ -27,6 +34,10 @@ import six
 from django.utils.crypto import constant_time_compare
 from django.utils.crypto import get_random_string
 
+from common.errors import ServiceUnavailable
+
+HASHING_POOL = None
+
 
 def import_hash(algorithm, hash):
     """Import a hash as given by the RestAuth import data format.
@@ -49,6 +60,121 @@ def import_hash(algorithm, hash):
     return hasher.from_orig(hash)
 
 
+def _init_worker():
+    # Workers started with the "spawn" or "forkserver" start method have to load Django first.
+    import django
+    from django.apps import apps
+    if not apps.ready:  # pragma: no cover
+        django.setup()
+
+
+def _make_password(password, salt, hasher):
+    return django_hashers.make_password(password, salt=salt, hasher=hasher)
+
+
+def _check_password(password, encoded, preferred):
+    # The setter cannot be passed to another process, so we only report if it must be called.
+    updated = []
+    is_correct = django_hashers.check_password(password, encoded, updated.append, preferred)
+    return is_correct, bool(updated)
+
+
+class HashingPool(object):
+    """A bounded pool of worker processes that compute password hashes.
+
+    Hashing passwords is CPU-bound and holds the GIL for the whole computation, so doing it in the
+    thread handling a request blocks all other threads of the same process. This pool moves the
+    computation to worker processes instead. At most ``MAX_WORKERS`` hashes are computed at the same
+    time and at most ``MAX_QUEUE`` further requests wait for a free worker. If the pool is full,
+    :py:class:`~common.errors.ServiceUnavailable` is raised, which results in a ``503 Service
+    Unavailable`` response.
+
+    Please see :setting:`PASSWORD_HASHING_POOL` for a description of the parameters.
+    """
+
+    def __init__(self, MAX_WORKERS=None, MAX_QUEUE=None, TIMEOUT=None, START_METHOD=None):
+        if MAX_WORKERS is None:
+            MAX_WORKERS = os.cpu_count() or 1
+        if MAX_QUEUE is None:
+            MAX_QUEUE = MAX_WORKERS * 4
+
+        self.timeout = TIMEOUT
+        self._slots = threading.BoundedSemaphore(MAX_WORKERS + MAX_QUEUE)
+        self._executor = ProcessPoolExecutor(
+            max_workers=MAX_WORKERS, mp_context=multiprocessing.get_context(START_METHOD),
+            initializer=_init_worker)
+
+    def _release(self, future):
+        self._slots.release()
+
+    def _run(self, func, *args):
+        if not self._slots.acquire(False):
+            raise ServiceUnavailable("Too many pending password hashing requests.")
+
+        try:
+            future = self._executor.submit(func, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(self._release)
+
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            future.cancel()
+            raise ServiceUnavailable("Password hashing timed out.")
+
+    def make_password(self, password, salt=None, hasher='default'):
+        return self._run(_make_password, password, salt, hasher)
+
+    def check_password(self, password, encoded, setter=None, preferred='default'):
+        is_correct, must_update = self._run(_check_password, password, encoded, preferred)
+        if setter and must_update:
+            setter(password)
+        return is_correct
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+def load_hashing_pool():
+    global HASHING_POOL
+
+    config = getattr(settings, 'PASSWORD_HASHING_POOL', None)
+    if config:
+        HASHING_POOL = HashingPool(**config)
+    else:
+        HASHING_POOL = False  # hash in the current thread
+
+
+def get_hashing_pool():
+    if HASHING_POOL is None:
+        load_hashing_pool()
+    return HASHING_POOL or None
+
+
+def make_password(password, salt=None, hasher='default'):
+    """Drop-in replacement for Djangos ``make_password`` that uses the :py:class:`HashingPool`.
+
+    The pool is only used if :setting:`PASSWORD_HASHING_POOL` is configured.
+    """
+    pool = get_hashing_pool()
+    if pool is None or password is None:  # unusable passwords are cheap
+        return django_hashers.make_password(password, salt=salt, hasher=hasher)
+    return pool.make_password(password, salt=salt, hasher=hasher)
+
+
+def check_password(password, encoded, setter=None, preferred='default'):
+    """Drop-in replacement for Djangos ``check_password`` that uses the :py:class:`HashingPool`.
+
+    The pool is only used if :setting:`PASSWORD_HASHING_POOL` is configured.
+    """
+    pool = get_hashing_pool()
+    if pool is None or password is None or not django_hashers.is_password_usable(encoded):
+        return django_hashers.check_password(password, encoded, setter=setter, preferred=preferred)
+    return pool.check_password(password, encoded, setter=setter, preferred=preferred)
+
+
 class Sha512Hasher(BasePasswordHasher):
     """A basic sha512 hasher with salt.
 
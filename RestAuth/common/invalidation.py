@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of RestAuth (https://restauth.net).
+#
+# RestAuth is free software: you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# RestAuth is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with RestAuth. If not,
+# see <http://www.gnu.org/licenses/>.
+
+from __future__ import unicode_literals
+
+import json
+import logging
+import socket
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+import six
+
+log = logging.getLogger(__name__)
+
+INVALIDATION_BUS = None
+
+
+class Transport(object):
+    """Base class for transports used by :py:class:`InvalidationBus`.
+
+    A transport sends messages to all other nodes and passes any received message to
+    :py:meth:`InvalidationBus.receive`. If a transport might have missed messages, e.g. after
+    reconnecting to a server, it should call :py:meth:`InvalidationBus.flush`.
+    """
+
+    def __init__(self, bus):
+        self.bus = bus
+
+    def send(self, data):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class LocalTransport(Transport):
+    """Transport delivering messages to all buses in the same process that use the same channel.
+
+    Messages are delivered synchronously in the thread sending them. This transport is mainly
+    useful for testing.
+    """
+
+    _channels = defaultdict(list)
+
+    def __init__(self, bus, CHANNEL='restauth'):
+        super(LocalTransport, self).__init__(bus)
+        self.channel = CHANNEL
+        self._channels[self.channel].append(self)
+
+    def send(self, data):
+        for transport in list(self._channels[self.channel]):
+            transport.bus.receive(data)
+
+    def close(self):
+        self._channels[self.channel].remove(self)
+
+
+class UDPTransport(Transport):
+    """Transport sending messages as UDP datagrams to a fixed list of peers.
+
+    UDP datagrams may get lost, but the sequence numbers of the bus make sure that caches are
+    flushed when that happens.
+
+    Every process that loads the backend binds its own socket, so a fixed port can only be used by
+    a single process per host. With several workers or the command line tools, the port is already
+    in use. This transport is therefore a stand-in for tests, use :py:class:`RedisTransport` in
+    deployments with more than one process.
+
+    :param ADDRESS: Tuple of host and port to receive messages on. The default is a free port on
+        the loopback interface.
+    :param PEERS: List of tuples of host and port of all other nodes.
+    """
+
+    def __init__(self, bus, ADDRESS=('127.0.0.1', 0), PEERS=()):
+        super(UDPTransport, self).__init__(bus)
+        self.peers = list(PEERS)
+        self._closed = False
+
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.bind(tuple(ADDRESS))
+        self.address = self._socket.getsockname()
+
+        self._thread = threading.Thread(target=self._listen)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _listen(self):
+        while True:
+            try:
+                data, address = self._socket.recvfrom(65535)
+            except (OSError, socket.error):  # socket was closed
+                return
+            if self._closed:  # shutdown() wakes up recvfrom() with an empty datagram
+                return
+
+            try:
+                self.bus.receive(data)
+            except Exception as e:
+                log.exception('Could not handle invalidation message: %s', e)
+
+    def send(self, data):
+        for peer in self.peers:
+            try:
+                self._socket.sendto(data, tuple(peer))
+            except (OSError, socket.error) as e:
+                log.error('Could not send invalidation message to %s: %s', peer, e)
+
+    def close(self):
+        self._closed = True
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except (OSError, socket.error):
+            pass
+        self._socket.close()
+
+
+class RedisTransport(Transport):
+    """Transport using Redis Pub/Sub.
+
+    :param HOST: The hostname of the Redis server.
+    :param PORT: The port of the Redis server.
+    :param DB: The database of the Redis server. Note that Pub/Sub channels are shared by all
+        databases.
+    :param PASSWORD: The password used to connect to the Redis server.
+    :param CHANNEL: The Pub/Sub channel to use.
+    :param RECONNECT: Seconds to wait before reconnecting after the connection was lost.
+    """
+
+    def __init__(self, bus, HOST='localhost', PORT=6379, DB=0, PASSWORD=None,
+                 CHANNEL='restauth-invalidation', RECONNECT=1):
+        import redis
+
+        super(RedisTransport, self).__init__(bus)
+        self.channel = CHANNEL
+        self.reconnect = RECONNECT
+        self._errors = (redis.ConnectionError, redis.TimeoutError)
+        self._client = redis.StrictRedis(host=HOST, port=PORT, db=DB, password=PASSWORD)
+        self._closed = False
+
+        self._pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+        self._pubsub.subscribe(self.channel)
+        self._thread = threading.Thread(target=self._listen)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _listen(self):
+        while not self._closed:
+            try:
+                for message in self._pubsub.listen():
+                    self.bus.receive(message['data'])
+            except self._errors as e:
+                if self._closed:
+                    return
+                log.error('Lost connection to Redis: %s', e)
+                time.sleep(self.reconnect)
+
+                try:
+                    self._pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+                    self._pubsub.subscribe(self.channel)
+                except self._errors:
+                    continue
+
+                # messages sent while we were not subscribed are lost
+                self.bus.flush()
+
+    def send(self, data):
+        try:
+            self._client.publish(self.channel, data)
+        except self._errors as e:
+            log.error('Could not publish invalidation message: %s', e)
+
+    def close(self):
+        self._closed = True
+        self._pubsub.close()
+
+
+class InvalidationBus(object):
+    """Distributes cache invalidations to all RestAuth processes, possibly on different nodes.
+
+    Every message contains the id of the sending node and a sequence number that is incremented
+    with every message. If a node receives a message with a sequence number that skips a previous
+    message, it knows that it missed a message and flushes all caches. If ``HEARTBEAT`` is set, the
+    current sequence number is also sent periodically, so lost messages are detected even if no
+    further changes are made.
+
+    Please see :setting:`CACHE_INVALIDATION` for a description of the parameters.
+    """
+
+    def __init__(self, TRANSPORT='common.invalidation.LocalTransport', HEARTBEAT=None,
+                 **options):
+        self.node = uuid.uuid4().hex
+        self.heartbeat = HEARTBEAT
+
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._sequences = {}  # node -> last received sequence number
+        self._subscribers = []
+        self._closed = threading.Event()
+
+        self.transport = import_string(TRANSPORT)(self, **options)
+
+        if self.heartbeat:
+            self._thread = threading.Thread(target=self._send_heartbeats)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def subscribe(self, invalidate, flush):
+        """Subscribe to invalidations.
+
+        :param invalidate: Called with a list of invalidated tags, each a tuple of strings.
+        :param flush: Called without arguments if messages might have been missed.
+        """
+
+        self._subscribers.append((invalidate, flush))
+
+    def _send(self, seq, tags):
+        data = json.dumps({'node': self.node, 'seq': seq, 'tags': tags})
+        self.transport.send(data.encode('utf-8'))
+
+    def publish(self, tags):
+        """Send a list of invalidated tags to all other nodes."""
+
+        with self._lock:  # keep messages in order
+            self._seq += 1
+            self._send(self._seq, list(tags))
+
+    def _send_heartbeats(self):
+        while not self._closed.wait(self.heartbeat):
+            with self._lock:
+                self._send(self._seq, None)
+
+    def receive(self, data):
+        if isinstance(data, six.binary_type):
+            data = data.decode('utf-8')
+        message = json.loads(data)
+        node, seq, tags = message['node'], message['seq'], message['tags']
+        if node == self.node:
+            return
+
+        with self._lock:
+            last = self._sequences.get(node, 0)
+            self._sequences[node] = max(last, seq)
+
+        # heartbeats repeat the last sequence number
+        if seq > last + (0 if tags is None else 1):
+            log.warning('Missed invalidations from node %s (%s -> %s), flushing caches.',
+                        node, last, seq)
+            self.flush()
+
+        if tags:
+            tags = [tuple(tag) for tag in tags]
+            for invalidate, flush in self._subscribers:
+                invalidate(tags)
+
+    def flush(self):
+        for invalidate, flush in self._subscribers:
+            flush()
+
+    def close(self):
+        self._closed.set()
+        self.transport.close()
+
+
+def load_invalidation_bus():
+    global INVALIDATION_BUS
+
+    config = getattr(settings, 'CACHE_INVALIDATION', None)
+    if config:
+        INVALIDATION_BUS = InvalidationBus(**config)
+    else:
+        INVALIDATION_BUS = False  # caches are only invalidated in the current process
+
+
+def get_invalidation_bus():
+    if INVALIDATION_BUS is None:
+        load_invalidation_bus()
+    return INVALIDATION_BUS or None
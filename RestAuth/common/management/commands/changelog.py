@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of RestAuth (https://restauth.net).
+#
+# RestAuth is free software: you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# RestAuth is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with RestAuth. If not,
+# see <http://www.gnu.org/licenses/>.
+
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from common.models import Change
+
+
+class Command(BaseCommand):
+    help = 'Remove old and superseded changes from the change log.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--no-compact', action='store_false', dest='compact', default=True,
+            help="Don't remove changes that are superseded by later changes.")
+
+    def handle(self, *args, **options):
+        if not Change.objects.enabled():
+            raise CommandError('The change log is not enabled, see the CHANGE_LOG setting.')
+
+        config = settings.CHANGE_LOG
+        removed = Change.objects.purge(max_age=config.get('MAX_AGE'),
+                                       max_entries=config.get('MAX_ENTRIES'))
+        self.stdout.write('Removed %s old changes.' % removed)
+
+        if options['compact']:
+            removed = Change.objects.compact()
+            self.stdout.write('Removed %s superseded changes.' % removed)
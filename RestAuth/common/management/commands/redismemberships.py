@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of RestAuth (https://restauth.net).
+#
+# RestAuth is free software: you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# RestAuth is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with RestAuth. If not,
+# see <http://www.gnu.org/licenses/>.
+
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from backends import backend
+
+
+class Command(BaseCommand):
+    help = 'Build the index of group memberships of every user used by the RedisBackend.'
+
+    def handle(self, *args, **options):
+        if not hasattr(backend, 'rebuild_memberships'):
+            raise CommandError('This command only works with the RedisBackend.')
+
+        count = backend.rebuild_memberships()
+        self.stdout.write('Indexed %s memberships.' % count)
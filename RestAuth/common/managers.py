@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of RestAuth (https://restauth.net).
+#
+# RestAuth is free software: you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# RestAuth is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with RestAuth. If not,
+# see <http://www.gnu.org/licenses/>.
+
+from __future__ import unicode_literals
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import models
+from django.db import transaction
+from django.utils import timezone
+
+from common.errors import GroupNotFound
+
+
+class ChangeManager(models.Manager):
+    """Manager that maintains the :py:class:`~common.models.Change` log."""
+
+    chunk_size = 1000
+
+    def enabled(self):
+        return getattr(settings, 'CHANGE_LOG', None) is not None
+
+    def record(self, resource, name, action, service=None):
+        """Record a change of a user or group.
+
+        The change is only written once the current database transaction (if any) is committed,
+        so changes that are rolled back are never visible.
+        """
+        self.record_many([(resource, name, action, service)])
+
+    def record_many(self, changes):
+        """Record multiple changes at once.
+
+        ``changes`` is a list of tuples with the parameters of :py:meth:`record`. All changes are
+        written with a single query.
+
+        Sequence numbers are not assigned by the database but taken from a counter that is locked
+        until the changes are committed. Changes therefore become visible in the order of their
+        sequence numbers, and a client that has seen a change never misses one with a lower
+        sequence number that is committed later.
+        """
+        if not self.enabled() or not changes:
+            return
+
+        objs = [self.model(resource=resource, name=name, action=action, service=service)
+                for resource, name, action, service in changes]
+
+        def create():
+            with transaction.atomic():
+                counter = self._lock_counter()
+                for obj in objs:
+                    counter.seq += 1
+                    obj.pk = counter.seq
+                counter.save()
+                self.bulk_create(objs)
+        transaction.on_commit(create)
+
+    def _lock_counter(self):
+        from .models import ChangeCounter
+
+        counter = ChangeCounter.objects.select_for_update().filter(pk=1).first()
+        if counter is None:  # first change since the counter was introduced
+            seq = self.aggregate(seq=models.Max('pk'))['seq'] or 0
+            ChangeCounter.objects.get_or_create(pk=1, defaults={'seq': seq})
+            counter = ChangeCounter.objects.select_for_update().get(pk=1)
+        return counter
+
+    def user(self, name, action):
+        self.record(self.model.USER, name, action)
+
+    def group(self, name, action, service=None):
+        self.record(self.model.GROUP, name, action, service=service)
+
+    def inheriting(self, groups):
+        """Get all groups that inherit the members of ``groups``.
+
+        ``groups`` is a list of tuples with the name and service of a group, the returned list has
+        the same format and starts with the given groups (without duplicates). Subgroups are only
+        resolved up to :setting:`GROUP_RECURSION_DEPTH` and if the change log is enabled.
+        """
+        from backends import backend  # backends import the models of this app
+
+        def key(name, service):
+            return name, getattr(service, 'id', service)
+
+        result = []
+        seen = set()
+        for group in groups:
+            if key(*group) not in seen:
+                seen.add(key(*group))
+                result.append(group)
+        if not self.enabled() or not backend.SUPPORTS_SUBGROUPS:
+            return result
+
+        level = result
+        for i in range(settings.GROUP_RECURSION_DEPTH + 1):
+            subgroups = []
+            for name, service in level:
+                try:
+                    subgroups += backend.subgroups(name, service, filter=False)
+                except GroupNotFound:
+                    pass
+
+            level = []
+            for group in subgroups:
+                if key(*group) not in seen:
+                    seen.add(key(*group))
+                    level.append(group)
+            if not level:
+                break
+            result += level
+        return result
+
+    def members_changed(self, groups):
+        """Record a change of the members of ``groups`` and of all groups inheriting their members.
+
+        See :py:meth:`inheriting` for the format of ``groups``.
+        """
+
+        self.record_many([(self.model.GROUP, name, self.model.CHANGED, service)
+                          for name, service in self.inheriting(groups)])
+
+    def last_seq(self):
+        """Get the sequence number of the last change, or ``0`` if there are no changes.
+
+        Clients that have seen all changes up to this sequence number are up to date.
+        """
+        return self.aggregate(seq=models.Max('pk'))['seq'] or 0
+
+    def horizon(self):
+        """Get the sequence number of the last change removed by :py:meth:`purge`.
+
+        Clients that have not seen all changes up to this sequence number have to fetch all data
+        again. Returns ``0`` if no change was removed yet.
+        """
+        first = self.order_by('pk').first()
+        if first is not None and first.action == self.model.TRUNCATED:
+            return first.pk
+        return 0
+
+    def since(self, seq, service):
+        """Get all changes after the given sequence number that are visible to ``service``."""
+
+        qs = self.filter(pk__gt=seq).exclude(action=self.model.TRUNCATED)
+        qs = qs.filter(models.Q(resource=self.model.USER) | models.Q(service=service))
+        return qs.order_by('pk')
+
+    def purge(self, max_age=None, max_entries=None):
+        """Remove changes older than ``max_age`` seconds and all but the last ``max_entries``.
+
+        The last removed change is replaced by a marker, so :py:meth:`horizon` knows which
+        clients missed changes. Returns the number of removed changes.
+        """
+        cutoff = 0
+        if max_age is not None:
+            qs = self.filter(timestamp__lt=timezone.now() - timedelta(seconds=max_age))
+            cutoff = qs.aggregate(seq=models.Max('pk'))['seq'] or 0
+        if max_entries is not None:
+            qs = self.order_by('-pk').values_list('pk', flat=True)[max_entries:max_entries + 1]
+            cutoff = max([cutoff] + list(qs))
+
+        horizon = self.horizon()
+        if cutoff <= horizon:
+            return 0
+
+        with transaction.atomic():
+            removed, _ = self.filter(pk__lte=cutoff).delete()
+            self.create(pk=cutoff, resource='', name='', action=self.model.TRUNCATED)
+        if horizon:  # the old marker was also removed
+            removed -= 1
+        return removed
+
+    def compact(self):
+        """Remove all changes that are superseded by a later change of the same user or group.
+
+        The latest change of a user or group always describes its current state (e.g. if it still
+        exists), so clients do not miss anything if older changes are removed. Returns the number of
+        removed changes.
+        """
+        seen = set()
+        superseded = []
+        qs = self.exclude(action=self.model.TRUNCATED).order_by('-pk')
+        for pk, resource, name, service in qs.values_list('pk', 'resource', 'name', 'service_id'):
+            key = (resource, name, service)
+            if key in seen:
+                superseded.append(pk)
+            else:
+                seen.add(key)
+
+        for i in range(0, len(superseded), self.chunk_size):
+            self.filter(pk__in=superseded[i:i + self.chunk_size]).delete()
+        return len(superseded)
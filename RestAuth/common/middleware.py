@@ -59,21 +59,28 @@ class RestAuthMiddleware(MiddlewareMixin):
     def process_exception(self, request, ex):
         """Handle RestAuth related exceptions."""
 
-        if isinstance(ex, UserNotFound):
-            resp = HttpResponse(ex, status=404)
-            resp['Resource-Type'] = 'user'
-            return resp
-        elif isinstance(ex, GroupNotFound):
-            resp = HttpResponse(ex, status=404)
-            resp['Resource-Type'] = 'group'
-            return resp
-        elif isinstance(ex, PropertyNotFound):
-            resp = HttpResponse(ex, status=404)
-            resp['Resource-Type'] = 'property'
-            return resp
-        elif isinstance(ex, AssertionError):
-            return HttpResponse(' '.join(ex.args), status=400)
-        elif isinstance(ex, RestAuthException):
-            return HttpResponse(' '.join(ex.args), status=ex.response_code)
-        else:  # pragma: no cover
+        response = exception_response(ex)
+        if response is None:  # pragma: no cover
             log.critical(traceback.format_exc())
+        return response
+
+
+def exception_response(ex):
+    """Get the response for a RestAuth related exception or ``None`` for any other exception."""
+
+    if isinstance(ex, UserNotFound):
+        resp = HttpResponse(ex, status=404)
+        resp['Resource-Type'] = 'user'
+        return resp
+    elif isinstance(ex, GroupNotFound):
+        resp = HttpResponse(ex, status=404)
+        resp['Resource-Type'] = 'group'
+        return resp
+    elif isinstance(ex, PropertyNotFound):
+        resp = HttpResponse(ex, status=404)
+        resp['Resource-Type'] = 'property'
+        return resp
+    elif isinstance(ex, AssertionError):
+        return HttpResponse(' '.join(ex.args), status=400)
+    elif isinstance(ex, RestAuthException):
+        return HttpResponse(' '.join(ex.args), status=ex.response_code)
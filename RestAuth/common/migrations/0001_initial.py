@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+from django.conf import settings
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Change',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('timestamp', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('resource', models.CharField(max_length=8)),
+                ('name', models.CharField(max_length=255)),
+                ('action', models.CharField(max_length=16)),
+                ('service', models.ForeignKey(to=settings.AUTH_USER_MODEL, null=True, on_delete=models.CASCADE)),
+            ],
+            options={
+                'permissions': (('changes_list', 'List changes of users and groups'),),
+            },
+            bases=(models.Model,),
+        ),
+    ]
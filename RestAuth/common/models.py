@@ -12,3 +12,56 @@
 #
 # You should have received a copy of the GNU General Public License along with RestAuth. If not,
 # see <http://www.gnu.org/licenses/>.
+
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import models
+
+from .managers import ChangeManager
+
+change_permissions = (
+    ('changes_list', 'List changes of users and groups'),
+)
+
+
+class Change(models.Model):
+    """A change of a user or group, used by ``GET /changes/``.
+
+    The primary key is the sequence number of the change. Changes of groups are only visible to
+    the service of the group, changes of users are visible to all services.
+    """
+
+    USER = 'user'
+    GROUP = 'group'
+
+    CREATED = 'created'
+    CHANGED = 'changed'
+    DELETED = 'deleted'
+    TRUNCATED = 'truncated'  # marks the beginning of the log, see ChangeManager.purge()
+
+    timestamp = models.DateTimeField(auto_now_add=True, db_index=True)
+    resource = models.CharField(max_length=8)
+    name = models.CharField(max_length=255)
+    service = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, on_delete=models.CASCADE)
+    action = models.CharField(max_length=16)
+
+    objects = ChangeManager()
+
+    class Meta:
+        permissions = change_permissions
+
+    def as_dict(self):
+        return {
+            'seq': self.pk,
+            'type': self.resource,
+            'name': self.name,
+            'action': self.action,
+            'timestamp': self.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+
+
+class ChangeCounter(models.Model):
+    """The sequence number of the last :py:class:`Change`, see ChangeManager.record_many()."""
+
+    seq = models.BigIntegerField(default=0)
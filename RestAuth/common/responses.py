@@ -15,7 +15,10 @@
 
 from __future__ import unicode_literals
 
+from itertools import islice
+
 from django.http import HttpResponse
+from django.http import StreamingHttpResponse
 
 from .content_handlers import get_handler
 from .types import get_response_type
@@ -26,10 +29,47 @@ class HttpRestAuthResponse(HttpResponse):
         mime_type = get_response_type(request)
         handler = get_handler(mime_type)
         body = handler.marshal(response_object)
+        self.response_object = response_object
 
         HttpResponse.__init__(self, body, mime_type, status, mime_type)
 
 
+class HttpRestAuthStreamingResponse(StreamingHttpResponse):
+    """Response for a list that might be too large to marshal it at once.
+
+    The ``response_object`` may be any iterable, e.g. a generator returned by a backend. With the
+    JSON content handler, the list is marshalled and sent in chunks of ``chunk_size`` elements.
+    Other content handlers marshal the complete list at once.
+
+    The first chunk is fetched right away, so errors raised by the iterable when it is first
+    accessed still result in a normal error response.
+    """
+
+    chunk_size = 1000
+
+    def __init__(self, request, response_object, status=200):
+        mime_type = get_response_type(request)
+        handler = get_handler(mime_type)
+
+        if mime_type == 'application/json':
+            iterator = iter(response_object)
+            first = list(islice(iterator, self.chunk_size))
+            content = self._marshal_json(handler, first, iterator)
+        else:
+            content = [handler.marshal(list(response_object))]
+
+        super(HttpRestAuthStreamingResponse, self).__init__(content, mime_type, status)
+
+    def _marshal_json(self, handler, chunk, iterator):
+        yield b'['
+        separator = b''
+        while chunk:
+            yield separator + handler.marshal_list(chunk)[1:-1]  # strip "[" and "]"
+            separator = b','
+            chunk = list(islice(iterator, self.chunk_size))
+        yield b']'
+
+
 class HttpResponseNoContent(HttpResponse):
     status_code = 204
 
@@ -32,6 +32,7 @@ from six import StringIO
 from RestAuthCommon import handlers
 
 from backends import backend
+from common.models import change_permissions
 from Groups.models import group_permissions
 from Services.models import service_create
 from Users.models import prop_permissions
@@ -98,6 +99,7 @@ class RestAuthTestBase(object):
         u_ct = ContentType.objects.get(app_label="Users", model="serviceuser")
         p_ct = ContentType.objects.get(app_label="Users", model="property")
         g_ct = ContentType.objects.get(app_label="Groups", model="group")
+        c_ct = ContentType.objects.get(app_label="common", model="change")
 
         # add user-permissions:
         for codename, name in user_permissions:
@@ -115,6 +117,11 @@ class RestAuthTestBase(object):
                 codename=codename, content_type=g_ct, defaults={'name': name})
             self.service.user_permissions.add(p)
 
+        for codename, name in change_permissions:
+            p, c = Permission.objects.get_or_create(
+                codename=codename, content_type=c_ct, defaults={'name': name})
+            self.service.user_permissions.add(p)
+
         cache.clear()
 
     def get(self, url, data=None, **kwargs):
@@ -138,7 +145,10 @@ class RestAuthTestBase(object):
         return self.c.delete(url, **kwargs)
 
     def parse(self, response, typ):
-        body = response.content.decode('utf-8')
+        if response.streaming:
+            body = b''.join(response.streaming_content).decode('utf-8')
+        else:
+            body = response.content.decode('utf-8')
         func = getattr(self.handler, 'unmarshal_%s' % typ)
         return func(body)
 
@@ -16,12 +16,26 @@
 from __future__ import unicode_literals
 
 import inspect
+import json
+import multiprocessing
 import os
 import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from unittest import skipIf
 from unittest import skipUnless
 
 from django.conf import settings
+from django.contrib.auth.hashers import check_password
+from django.contrib.auth.hashers import make_password
 from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.test import TestCase
 from django.test.client import Client
 from django.test.client import RequestFactory
@@ -32,7 +46,13 @@ from six.moves import http_client
 from RestAuthCommon import handlers
 
 from backends import backend
+from backends import memory
 from backends.base import BackendBase
+from backends.cache import CachingBackend
+from backends.memory import IdSet
+from backends.memory import MemoryBackend
+from backends.memory import ReadWriteLock
+from backends.pool import ConnectionPool
 from Services.models import Service
 from Users.validators import Validator
 from Users.validators import get_validators
@@ -41,8 +61,17 @@ from Users.validators import validate_username
 
 from .content_handlers import get_handler
 from .content_handlers import load_handlers
+from .errors import GroupExists
+from .errors import GroupNotFound
+from .errors import PropertyExists
+from .errors import ServiceUnavailable
+from .errors import UserExists
 from .errors import UsernameInvalid
+from .hashers import HashingPool
+from .invalidation import InvalidationBus
 from .middleware import RestAuthMiddleware
+from .models import Change
+from .models import ChangeCounter
 from .testdata import CliMixin
 from .testdata import RestAuthTest
 from .testdata import RestAuthTransactionTest
@@ -51,6 +80,8 @@ from .testdata import groupname1
 from .testdata import groupname2
 from .testdata import groupname3
 from .testdata import groupname4
+from .testdata import password1
+from .testdata import password2
 from .testdata import propkey1
 from .testdata import propkey2
 from .testdata import propval1
@@ -61,7 +92,9 @@ from .testdata import username2
 from .testdata import username3
 from .testdata import username4
 
+restauth_group = getattr(__import__('bin.restauth-group'), 'restauth-group').main
 restauth_import = getattr(__import__('bin.restauth-import'), 'restauth-import').main
+restauth_user = getattr(__import__('bin.restauth-user'), 'restauth-user').main
 PASSWORD_HASHERS = (
     'django.contrib.auth.hashers.PBKDF2PasswordHasher',
     'django.contrib.auth.hashers.MD5PasswordHasher',
@@ -155,6 +188,1321 @@ class BackendInterfaceTest(RestAuthTest):
             )
 
 
+class BackendTransactionTests(RestAuthTransactionTest):
+    def test_commit(self):
+        with backend.transaction():
+            backend.create_user(username1, password1)
+            backend.create_property(username1, propkey1, propval1)
+            backend.create_group(group=groupname1, service=self.service)
+            backend.add_member(group=groupname1, service=self.service, user=username1)
+
+        self.assertEqual(backend.get_properties(username1), {propkey1: propval1})
+        self.assertTrue(backend.is_member(group=groupname1, service=self.service, user=username1))
+
+    def test_dry_run(self):
+        with backend.transaction(dry=True):
+            backend.create_user(username1, password1)
+            backend.create_group(group=groupname1, service=self.service)
+        self.assertFalse(backend.user_exists(username1))
+        self.assertFalse(backend.group_exists(group=groupname1, service=self.service))
+
+    def test_rollback(self):
+        backend.create_user(username1, password1)
+
+        try:
+            with backend.transaction():
+                backend.create_property(username1, propkey1, propval1)
+                backend.create_user(username2, password2)
+                raise ValueError()
+        except ValueError:
+            pass
+
+        self.assertEqual(backend.get_properties(username1), {})
+        self.assertFalse(backend.user_exists(username2))
+
+    def test_exists(self):
+        backend.create_user(username1, password1)
+        backend.create_property(username1, propkey1, propval1)
+        backend.create_group(group=groupname1, service=self.service)
+
+        with backend.transaction():
+            self.assertRaises(UserExists, backend.create_user, username1)
+            self.assertRaises(PropertyExists, backend.create_property, username1, propkey1,
+                              propval2)
+            self.assertRaises(GroupExists, backend.create_group, group=groupname1,
+                              service=self.service)
+        self.assertEqual(backend.get_properties(username1), {propkey1: propval1})
+
+
+class BackendCreateUsersTests(RestAuthTransactionTest):
+    def test_create_users(self):
+        backend.create_user(username1, password1)
+        existing = backend.create_users([
+            (username1, password2, {}, None),
+            (username2, password2, {propkey1: propval1}, [(groupname1, self.service)]),
+            (username3, None, {}, [(groupname1, self.service), (groupname2, self.service)]),
+            (username3, password1, {}, None),
+        ])
+
+        self.assertEqual(existing, [username1, username3])
+        self.assertCountEqual(backend.list_users(), [username1, username2, username3])
+        self.assertTrue(backend.check_password(username1, password1))
+        self.assertTrue(backend.check_password(username2, password2))
+        self.assertFalse(backend.check_password(username3, password1))
+        self.assertEqual(backend.get_properties(username2), {propkey1: propval1})
+        self.assertCountEqual(backend.members(groupname1, self.service), [username2, username3])
+        self.assertEqual(backend.members(groupname2, self.service), [username3])
+
+    def test_dry_run(self):
+        backend.create_user(username1, password1)
+        existing = backend.create_users([
+            (username1, password2, {}, None),
+            (username2, password2, {}, [(groupname1, self.service)]),
+        ], dry=True)
+
+        self.assertEqual(existing, [username1])
+        self.assertEqual(backend.list_users(), [username1])
+        self.assertFalse(backend.group_exists(groupname1, self.service))
+
+
+@skipUnless(settings.DATA_BACKEND['BACKEND'] == 'backends.memory.MemoryBackend', '')
+class MemoryTransactionTests(RestAuthTransactionTest):
+    def test_journal(self):
+        backend.create_user(username1, password1)
+        backend.create_user(username2, password2)
+        backend.create_group(group=groupname1, service=self.service)
+        backend.create_group(group=groupname2, service=self.service)
+
+        with backend.transaction(dry=True) as transaction:
+            backend.create_property(username1, propkey1, propval1)
+            backend.add_member(group=groupname1, service=self.service, user=username1)
+
+            # only touched users are journaled, with their state before the transaction
+            self.assertEqual(list(transaction.users), [username1])
+            self.assertEqual(transaction.users[username1].properties, {})
+
+            # groups only journal how to undo the change
+            id = backend._users[username1].id
+            self.assertEqual(transaction.groups,
+                             [('discard', self.service, groupname1, 'users', id)])
+
+        self.assertEqual(backend.get_properties(username1), {})
+        self.assertFalse(backend.is_member(group=groupname1, service=self.service, user=username1))
+
+    def test_rollback_groups(self):
+        backend.create_user(username1, password1)
+        backend.create_group(group=groupname1, service=self.service)
+        backend.create_group(group=groupname2, service=self.service)
+        backend.add_subgroup(group=groupname1, service=self.service, subgroup=groupname2,
+                             subservice=self.service)
+
+        with backend.transaction(dry=True):
+            backend.rename_user(username1, username2)
+            backend.create_group(group=groupname3, service=self.service, users=[username2])
+            backend.set_subgroups(group=groupname1, service=self.service, subgroups=[groupname3],
+                                  subservice=self.service)
+            backend.remove_group(group=groupname2, service=self.service)
+
+        self.assertEqual(backend.list_users(), [username1])
+        self.assertCountEqual(backend.list_groups(service=self.service), [groupname1, groupname2])
+        self.assertEqual(backend.subgroups(group=groupname1, service=self.service), [groupname2])
+        self.assertEqual(backend.parents(group=groupname2, service=self.service),
+                         [(groupname1, self.service)])
+
+    def test_rollback_members(self):
+        backend.create_user(username1, password1)
+        backend.create_user(username2, password2)
+        backend.create_group(group=groupname1, service=self.service, users=[username1])
+        backend.create_group(group=groupname2, service=self.service)
+        backend.add_subgroup(group=groupname1, service=self.service, subgroup=groupname2,
+                             subservice=self.service)
+
+        with backend.transaction(dry=True):
+            # unchanged memberships must not be removed on rollback
+            backend.add_member(group=groupname1, service=self.service, user=username1)
+            backend.add_subgroup(group=groupname1, service=self.service, subgroup=groupname2,
+                                 subservice=self.service)
+
+            backend.set_members(group=groupname1, service=self.service, users=[username2])
+            backend.add_member(group=groupname1, service=self.service, user=username1)
+            backend.remove_subgroup(group=groupname1, service=self.service, subgroup=groupname2,
+                                    subservice=self.service)
+
+        self.assertEqual(backend.members(group=groupname1, service=self.service), [username1])
+        self.assertEqual(backend.subgroups(group=groupname1, service=self.service), [groupname2])
+        self.assertEqual(backend.parents(group=groupname2, service=self.service),
+                         [(groupname1, self.service)])
+
+    def test_nested(self):
+        backend.create_user(username1, password1)
+
+        with backend.transaction():
+            backend.create_property(username1, propkey1, propval1)
+            with backend.transaction(dry=True):
+                backend.create_property(username1, propkey2, propval2)
+                backend.create_user(username2, password2)
+            with backend.transaction():
+                backend.create_user(username3, password1)
+
+            self.assertEqual(backend.get_properties(username1), {propkey1: propval1})
+            self.assertFalse(backend.user_exists(username2))
+
+        self.assertEqual(backend.get_properties(username1), {propkey1: propval1})
+        self.assertCountEqual(backend.list_users(), [username1, username3])
+
+    def test_nested_rollback(self):
+        backend.create_user(username1, password1)
+
+        try:
+            with backend.transaction():
+                backend.set_property(username1, propkey1, propval1)
+                with backend.transaction():
+                    backend.set_property(username1, propkey1, propval2)
+                    backend.create_user(username2, password2)
+                raise ValueError()
+        except ValueError:
+            pass
+
+        self.assertEqual(backend.get_properties(username1), {})
+        self.assertEqual(backend.list_users(), [username1])
+
+
+class MemoryRecordTests(TestCase):
+    def setUp(self):
+        self.backend = MemoryBackend()
+
+    def test_id_set(self):
+        ids = IdSet([5, 3, 3])
+        ids.add(4)
+        ids.add(5)
+        self.assertEqual(list(ids), [3, 4, 5])
+        self.assertEqual(len(ids), 3)
+        self.assertIn(4, ids)
+        self.assertNotIn(6, ids)
+
+        ids.remove(4)
+        self.assertRaises(KeyError, ids.remove, 4)
+        self.assertEqual(ids, IdSet([3, 5]))
+
+    def test_records(self):
+        self.backend.create_user(username1, properties={propkey1: propval1})
+        self.backend.create_user(username2, properties={propkey1: propval2})
+        self.backend.create_group(group=groupname1, service='vowi', users=[username1, username2])
+
+        user1 = self.backend._users[username1]
+        user2 = self.backend._users[username2]
+        self.assertFalse(hasattr(user1, '__dict__'))
+        self.assertEqual(list(self.backend._groups['vowi'][groupname1].users), [user1.id, user2.id])
+
+        # property keys are only stored once
+        key1, key2 = list(user1.properties)[0], list(user2.properties)[0]
+        self.assertIs(key1, key2)
+
+    def test_rename_user(self):
+        self.backend.create_user(username1, groups=[(groupname1, 'vowi')])
+        self.backend.rename_user(username1, username2)
+
+        self.assertEqual(self.backend.members(group=groupname1, service='vowi'), [username2])
+        self.assertEqual(self.backend.list_groups(service='vowi', user=username2), [groupname1])
+
+    def test_removed_user(self):
+        self.backend.create_user(username1, groups=[(groupname1, 'vowi'), (groupname2, None)])
+        id = self.backend._users[username1].id
+        self.backend.remove_user(username1)
+        self.assertEqual(self.backend.members(group=groupname1, service='vowi'), [])
+
+        # no references to the removed user are left
+        self.assertEqual(len(self.backend._groups['vowi'][groupname1].users), 0)
+        self.assertEqual(len(self.backend._groups[None][groupname2].users), 0)
+        self.assertIsNone(self.backend._names[id])
+
+        # a new user with the same name gets a new id
+        self.backend.create_user(username1)
+        self.assertFalse(self.backend.is_member(group=groupname1, service='vowi', user=username1))
+        self.assertEqual(self.backend.members(group=groupname1, service='vowi'), [])
+
+    def test_hashing_outside_of_lock(self):
+        writers = []
+        original = memory.make_password
+
+        def make_password(password):
+            writers.append(self.backend._lock._writer)
+            return original(password)
+
+        memory.make_password = make_password
+        try:
+            self.backend.create_user(username1, password1)
+            self.backend.set_password(username1, password2)
+        finally:
+            memory.make_password = original
+
+        self.assertEqual(writers, [None, None])
+        self.assertTrue(self.backend.check_password(username1, password2))
+
+    def test_rolled_back_remove(self):
+        self.backend.create_user(username1, groups=[(groupname1, 'vowi')])
+        with self.backend.transaction(dry=True):
+            self.backend.remove_user(username1)
+        self.assertEqual(self.backend.members(group=groupname1, service='vowi'), [username1])
+        self.assertEqual(self.backend.list_groups(service='vowi', user=username1), [groupname1])
+
+    def test_rolled_back_rename(self):
+        self.backend.create_user(username1, groups=[(groupname1, 'vowi')])
+        with self.backend.transaction(dry=True):
+            self.backend.rename_user(username1, username2)
+        self.assertEqual(self.backend.members(group=groupname1, service='vowi'), [username1])
+
+
+class DurableMemoryBackendTests(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.backends = []
+        self.backend = self.load()
+
+    def tearDown(self):
+        for loaded in self.backends:
+            loaded._log.close()
+        shutil.rmtree(self.path)
+
+    def load(self, **kwargs):
+        loaded = MemoryBackend(PATH=self.path, **kwargs)
+        self.backends.append(loaded)
+        return loaded
+
+    def assertRecovered(self, **kwargs):
+        recovered = self.load(**kwargs)
+        self.assertEqual(recovered._users, self.backend._users)
+        self.assertEqual(recovered._groups, self.backend._groups)
+        return recovered
+
+    def records(self, segment=0):
+        return list(self.backend._log._read_segment(segment))
+
+    def test_recover(self):
+        self.backend.create_user(username1, password1, properties={propkey1: propval1})
+        self.backend.create_user(username2, password2, groups=[(groupname1, 'vowi')])
+        self.backend.create_group(group=groupname2, service='vowi')
+        self.backend.add_subgroup(group=groupname1, service='vowi', subgroup=groupname2,
+                                  subservice='vowi')
+        self.backend.set_property(username1, propkey2, propval2)
+        self.backend.rename_user(username1, username3)
+        self.backend.create_user(username4)
+        self.backend.remove_user(username4)
+
+        recovered = self.assertRecovered()
+        self.assertTrue(recovered.check_password(username3, password1))
+        self.assertTrue(recovered.is_member(group=groupname1, service='vowi', user=username2))
+
+    def test_removed_user(self):
+        self.backend.create_user(username1, groups=[(groupname1, 'vowi')])
+        self.backend.remove_user(username1)
+
+        recovered = self.assertRecovered()
+        self.assertEqual(len(recovered._groups['vowi'][groupname1].users), 0)
+        recovered.create_user(username2)
+        self.assertFalse(recovered.is_member(group=groupname1, service='vowi', user=username2))
+
+    def test_transactions(self):
+        self.backend.create_user(username1, password1)
+
+        with self.backend.transaction():
+            self.backend.create_property(username1, propkey1, propval1)
+            self.backend.create_group(group=groupname1, service='vowi', users=[username1])
+        with self.backend.transaction(dry=True):
+            self.backend.create_user(username2, password2)
+        try:
+            with self.backend.transaction():
+                self.backend.create_user(username3, password2)
+                raise ValueError()
+        except ValueError:
+            pass
+
+        # one record per change outside of a transaction and one per committed transaction
+        self.assertEqual(len(self.records()), 2)
+        self.assertEqual(self.records()[1], ({username1: self.backend._users[username1]}, {
+            ('vowi', groupname1): self.backend._groups['vowi'][groupname1],
+        }, []))
+        self.assertRecovered()
+
+    def test_memberships(self):
+        self.backend.create_user(username1)
+        self.backend.create_user(username2)
+        self.backend.create_group(group=groupname1, service='vowi')
+        id1 = self.backend._users[username1].id
+
+        # membership changes only log the change and not the whole group
+        self.backend.add_member(group=groupname1, service='vowi', user=username1)
+        self.assertEqual(self.records()[-1], ({}, {}, [('vowi', groupname1, id1, True)]))
+        self.backend.set_memberships(username1, 'vowi', [])
+        self.assertEqual(self.records()[-1], ({}, {}, [('vowi', groupname1, id1, False)]))
+
+        # changes of a rolled back nested transaction are not logged
+        with self.backend.transaction():
+            self.backend.add_member(group=groupname1, service='vowi', user=username1)
+            with self.backend.transaction(dry=True):
+                self.backend.add_member(group=groupname1, service='vowi', user=username2)
+        self.assertEqual(self.records()[-1], ({}, {}, [('vowi', groupname1, id1, True)]))
+        self.assertEqual(self.backend.members(group=groupname1, service='vowi'), [username1])
+
+        # the group is logged completely if it changes otherwise, too
+        self.backend.create_group(group=groupname2, service='vowi')
+        with self.backend.transaction():
+            self.backend.add_member(group=groupname2, service='vowi', user=username2)
+            self.backend.rename_group(groupname2, groupname3, service='vowi')
+        self.assertEqual(self.records()[-1], ({}, {
+            ('vowi', groupname2): None,
+            ('vowi', groupname3): self.backend._groups['vowi'][groupname3],
+        }, []))
+
+        recovered = self.assertRecovered()
+        self.assertEqual(recovered.members(group=groupname3, service='vowi'), [username2])
+
+    def test_snapshot(self):
+        self.backend = self.load(SNAPSHOT_ENTRIES=3)
+        for username in [username1, username2, username3, username4]:
+            self.backend.create_user(username, password1)
+            self.backend.set_property(username, propkey1, propval1)
+        self.backend._log.snapshot()
+
+        self.assertTrue(os.path.exists(os.path.join(self.path, 'snapshot')))
+        self.assertEqual(self.backend._log._segments(), [self.backend._log._segment])
+
+        self.backend.remove_user(username1)
+        self.assertRecovered()
+
+    def test_background_snapshot(self):
+        self.backend = self.load(SNAPSHOT_ENTRIES=2)
+        log = self.backend._log
+        apply, started, release = log.apply, threading.Event(), threading.Event()
+
+        def blocking_apply(state, record):
+            started.set()
+            release.wait(5)
+            return apply(state, record)
+        log.apply = blocking_apply
+
+        self.backend.create_user(username1, password1)
+        self.backend.create_user(username2, password2)  # starts building a snapshot
+        self.assertTrue(started.wait(5))
+
+        # the snapshot is built from the log files, so the backend can still be modified
+        self.backend.create_user(username3, password1)
+        self.backend.create_user(username4, password2)
+        self.backend.create_group(group=groupname1, service='vowi', users=[username1])
+        release.set()
+
+        log.snapshot()
+        self.assertEqual(log._segments(), [log._segment])
+        self.assertRecovered()
+
+    def test_torn_write(self):
+        self.backend.create_user(username1, password1)
+        self.backend.create_user(username2, password2)
+        with open(os.path.join(self.path, 'log.00000000'), 'ab') as stream:
+            stream.write(b'\x00\x00\x01\x00garbage')
+
+        self.assertRecovered()
+        self.assertEqual(len(self.records()), 2)
+
+    def test_group_commit(self):
+        syncs = []
+
+        def fsync(fileobj):
+            syncs.append(fileobj)
+            time.sleep(0.05)
+        self.backend._log._fsync = fsync
+
+        threads = [threading.Thread(target=self.backend._log.append, args=(({i: None}, {}, []), ))
+                   for i in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(self.records()), 10)
+        self.assertLess(len(syncs), 10)
+
+
+class ReadWriteLockTests(TestCase):
+    def setUp(self):
+        self.lock = ReadWriteLock()
+
+    def run_threads(self, target, count):
+        threads = [threading.Thread(target=target) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+            self.assertFalse(thread.is_alive())
+
+    def test_concurrent_readers(self):
+        barrier = threading.Barrier(5, timeout=5)
+
+        def read():
+            with self.lock.read():
+                barrier.wait()  # only returns if all readers hold the lock at the same time
+        self.run_threads(read, 5)
+        self.assertFalse(barrier.broken)
+
+    def test_exclusive_writer(self):
+        active = []
+        overlaps = []
+
+        def write():
+            for i in range(100):
+                with self.lock.write():
+                    active.append(1)
+                    if len(active) > 1:
+                        overlaps.append(len(active))
+                    with self.lock.read():  # reentrant
+                        time.sleep(0)
+                    active.pop()
+        self.run_threads(write, 5)
+        self.assertEqual(overlaps, [])
+
+    def test_writer_precedence(self):
+        acquired = threading.Event()
+
+        def write():
+            with self.lock.write():
+                acquired.set()
+
+        with self.lock.read():
+            thread = threading.Thread(target=write)
+            thread.start()
+            while not self.lock._writers_waiting:
+                time.sleep(0.001)
+
+            with self.lock.read():  # nested reads do not wait for the waiting writer
+                self.assertFalse(acquired.is_set())
+        thread.join(5)
+        self.assertTrue(acquired.is_set())
+
+    def test_upgrade(self):
+        with self.lock.read():
+            with self.assertRaises(RuntimeError):
+                with self.lock.write():
+                    pass
+
+        with self.lock.write():  # the failed upgrade did not leave the lock acquired
+            pass
+
+
+class MemoryBackendStressTests(TestCase):
+    threads = 8
+    iterations = 300
+
+    def setUp(self):
+        self.backend = MemoryBackend()
+        self.errors = []
+
+        # switch threads as often as possible to provoke race conditions
+        self.switchinterval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+
+    def tearDown(self):
+        sys.setswitchinterval(self.switchinterval)
+
+    def run_threads(self, *targets):
+        def wrapper(target, i):
+            try:
+                target(i)
+            except Exception as e:  # pragma: no cover
+                self.errors.append(e)
+
+        threads = [threading.Thread(target=wrapper, args=(target, i))
+                   for target in targets for i in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.errors, [])
+
+    @override_settings(PASSWORD_HASHERS=('django.contrib.auth.hashers.MD5PasswordHasher', ))
+    def test_stress(self):
+        backend = self.backend
+        backend.create_user(username1, password1, properties={'a': 0, 'b': 0})
+        backend.create_group(group=groupname1, service='vowi')
+        backend.create_group(group=groupname2, service='vowi')
+
+        def write(i):
+            for j in range(self.iterations):
+                user = 'user-%s-%s' % (i, j)
+                backend.create_user(user, password1, groups=[(groupname1, 'vowi')])
+
+                # both properties are always changed in one transaction
+                with backend.transaction():
+                    value = backend.get_property(username1, 'a') + 1
+                    backend.set_property(username1, 'a', value)
+                    backend.set_property(username1, 'b', value)
+
+                # move the user to the other group
+                with backend.transaction():
+                    backend.remove_member(group=groupname1, service='vowi', user=user)
+                    backend.add_member(group=groupname2, service='vowi', user=user)
+
+        def read(i):
+            for j in range(self.iterations):
+                properties = backend.get_properties(username1)
+                if properties['a'] != properties['b']:  # pragma: no cover
+                    raise AssertionError('Saw a partial transaction: %s' % properties)
+
+                # no user is ever in both groups
+                with backend._lock.read():
+                    members1 = backend.members(group=groupname1, service='vowi')
+                    members2 = backend.members(group=groupname2, service='vowi')
+                if set(members1) & set(members2):  # pragma: no cover
+                    raise AssertionError('User in both groups: %s' % (set(members1) & set(members2)))
+                if not backend.check_password(username1, password1):  # pragma: no cover
+                    raise AssertionError('Could not verify password.')
+
+        self.run_threads(write, read)
+
+        users = self.threads * self.iterations
+        self.assertEqual(len(backend.list_users()), users + 1)
+        self.assertEqual(backend.get_properties(username1), {'a': users, 'b': users})
+        self.assertEqual(backend.members(group=groupname1, service='vowi'), [])
+        self.assertEqual(len(backend.members(group=groupname2, service='vowi')), users)
+
+
+class CachingBackendTests(TestCase):
+    def setUp(self):
+        self.backend = self.load()
+
+    def load(self, **kwargs):
+        return CachingBackend(WRAPPED={'BACKEND': 'backends.memory.MemoryBackend'}, **kwargs)
+
+    def test_hits(self):
+        self.backend.create_user(username1, properties={propkey1: propval1})
+        self.assertEqual(self.backend.get_properties(username1), {propkey1: propval1})
+
+        properties = self.backend.get_properties(username1)
+        properties[propkey2] = propval2  # does not modify the cached dictionary
+        self.assertEqual(self.backend.get_properties(username1), {propkey1: propval1})
+
+        stats = self.backend.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries']), (2, 1, 1))
+        self.assertEqual(stats['hit_rate'], 2.0 / 3)
+
+    def test_hits_members(self):
+        self.backend.create_user(username1)
+        self.backend.create_group(group=groupname1, service='vowi', users=[username1])
+        self.assertEqual(self.backend.members(group=groupname1, service='vowi'), [username1])
+
+        members = self.backend.members(group=groupname1, service='vowi')
+        members.append(username2)  # does not modify the cached list
+        self.assertEqual(self.backend.members(group=groupname1, service='vowi'), [username1])
+
+        groups = self.backend.list_groups(service='vowi')
+        groups.append(groupname2)
+        self.assertEqual(self.backend.list_groups(service='vowi'), [groupname1])
+
+    def test_users(self):
+        self.assertFalse(self.backend.user_exists(username1))
+        self.backend.create_user(username1)
+        self.assertTrue(self.backend.user_exists(username1))
+
+        self.backend.set_property(username1, propkey1, propval1)
+        self.assertEqual(self.backend.get_property(username1, propkey1), propval1)
+        self.backend.set_property(username1, propkey1, propval2)
+        self.assertEqual(self.backend.get_property(username1, propkey1), propval2)
+        self.backend.remove_property(username1, propkey1)
+        self.assertEqual(self.backend.get_properties(username1), {})
+
+        self.backend.rename_user(username1, username2)
+        self.assertFalse(self.backend.user_exists(username1))
+        self.assertTrue(self.backend.user_exists(username2))
+
+    def test_nested_groups(self):
+        self.backend.create_user(username1)
+        self.backend.create_user(username2)
+        self.backend.create_group(group=groupname1, service='vowi')
+        self.backend.create_group(group=groupname2, service='vowi')
+        self.backend.create_group(group=groupname3, service='vowi')
+        self.backend.add_subgroup(group=groupname1, service='vowi', subgroup=groupname2,
+                                  subservice='vowi')
+        self.backend.add_subgroup(group=groupname2, service='vowi', subgroup=groupname3,
+                                  subservice='vowi')
+
+        # groupname3 inherits the members of groupname1
+        self.assertEqual(self.backend.members(group=groupname3, service='vowi'), [])
+        self.assertFalse(self.backend.is_member(group=groupname3, service='vowi', user=username1))
+        self.assertEqual(self.backend.list_groups(service='vowi', user=username1), [])
+
+        self.backend.add_member(group=groupname1, service='vowi', user=username1)
+        self.assertEqual(self.backend.members(group=groupname3, service='vowi'), [username1])
+        self.assertTrue(self.backend.is_member(group=groupname3, service='vowi', user=username1))
+        self.assertCountEqual(self.backend.list_groups(service='vowi', user=username1),
+                              [groupname1, groupname2, groupname3])
+
+        # entries of unrelated users are not invalidated
+        self.assertFalse(self.backend.is_member(group=groupname3, service='vowi', user=username2))
+        self.backend.remove_member(group=groupname1, service='vowi', user=username1)
+        self.assertFalse(self.backend.is_member(group=groupname3, service='vowi', user=username1))
+        misses = self.backend.stats()['misses']
+        self.assertFalse(self.backend.is_member(group=groupname3, service='vowi', user=username2))
+        self.assertEqual(self.backend.stats()['misses'], misses)
+
+        self.backend.set_members(group=groupname1, service='vowi', users=[username2])
+        self.assertEqual(self.backend.members(group=groupname3, service='vowi'), [username2])
+        self.backend.remove_subgroup(group=groupname2, service='vowi', subgroup=groupname3,
+                                     subservice='vowi')
+        self.assertEqual(self.backend.members(group=groupname3, service='vowi'), [])
+        self.assertEqual(self.backend.list_groups(service='vowi', user=username2),
+                         [groupname1, groupname2])
+
+    def test_groups(self):
+        self.backend.create_user(username1)
+        self.assertEqual(self.backend.list_groups(service='vowi'), [])
+        self.backend.set_memberships(username1, 'vowi', [groupname1])
+        self.assertEqual(self.backend.list_groups(service='vowi'), [groupname1])
+        self.assertEqual(self.backend.members(group=groupname1, service='vowi'), [username1])
+
+        self.backend.rename_group(groupname1, groupname2, service='vowi')
+        self.assertEqual(self.backend.list_groups(service='vowi', user=username1), [groupname2])
+        self.assertRaises(GroupNotFound, self.backend.members, group=groupname1, service='vowi')
+
+        self.backend.remove_user(username1)
+        self.assertEqual(self.backend.members(group=groupname2, service='vowi'), [])
+        self.backend.remove_group(group=groupname2, service='vowi')
+        self.assertEqual(self.backend.list_groups(service='vowi'), [])
+
+    def test_eviction(self):
+        self.backend = self.load(MAX_ENTRIES=2)
+        for user in [username1, username2, username1, username3]:
+            self.backend.user_exists(user)
+
+        # username2 was least recently used
+        self.assertEqual(list(self.backend.cache._entries),
+                         [('user_exists', username1), ('user_exists', username3)])
+        self.assertEqual(self.backend.stats()['evictions'], 1)
+
+    def test_timeout(self):
+        self.backend = self.load(TIMEOUT=-1)
+        self.backend.user_exists(username1)
+        self.backend.user_exists(username1)
+        self.assertEqual(self.backend.stats()['hits'], 0)
+
+    def test_stale(self):
+        generation = self.backend.cache.generation
+        self.backend.cache.invalidate([('user', username1)])
+        self.backend.cache.set('key', 'value', (), generation)
+        self.assertEqual(self.backend.cache.get('key'), (False, None))
+
+    def test_transaction(self):
+        self.assertFalse(self.backend.user_exists(username1))
+
+        with self.backend.transaction(dry=True):
+            self.backend.create_user(username1)
+            self.assertTrue(self.backend.user_exists(username1))
+        self.assertFalse(self.backend.user_exists(username1))
+
+        with self.backend.transaction():
+            self.backend.create_user(username1)
+        self.assertTrue(self.backend.user_exists(username1))
+
+
+class InvalidationBusTests(TestCase):
+    def setUp(self):
+        self.buses = []
+        self.received = defaultdict(list)
+        self.flushed = defaultdict(int)
+
+    def tearDown(self):
+        for bus in self.buses:
+            bus.close()
+
+    def bus(self, **kwargs):
+        if 'TRANSPORT' not in kwargs:
+            kwargs['CHANNEL'] = 'test'
+        bus = InvalidationBus(**kwargs)
+        bus.subscribe(self.received[bus.node].extend, lambda: self.flush(bus))
+        self.buses.append(bus)
+        return bus
+
+    def flush(self, bus):
+        self.flushed[bus.node] += 1
+
+    def message(self, seq, tags, node='other'):
+        return json.dumps({'node': node, 'seq': seq, 'tags': tags}).encode('utf-8')
+
+    def test_local(self):
+        bus1, bus2 = self.bus(), self.bus()
+        bus1.publish([('user', username1), ('groups', )])
+
+        self.assertEqual(self.received[bus1.node], [])
+        self.assertEqual(self.received[bus2.node], [('user', username1), ('groups', )])
+        self.assertEqual(self.flushed, {})
+
+    def test_missed_message(self):
+        bus = self.bus()
+        bus.receive(self.message(1, [['user', username1]]))
+        bus.receive(self.message(2, [['user', username2]]))
+        self.assertEqual(self.flushed[bus.node], 0)
+
+        bus.receive(self.message(4, [['user', username3]]))
+        self.assertEqual(self.flushed[bus.node], 1)
+        self.assertEqual(self.received[bus.node],
+                         [('user', username1), ('user', username2), ('user', username3)])
+
+        # a late message is still applied, but does not cause another flush
+        bus.receive(self.message(3, [['user', username4]]))
+        self.assertEqual(self.flushed[bus.node], 1)
+        self.assertEqual(self.received[bus.node][-1], ('user', username4))
+
+    def test_heartbeat(self):
+        bus = self.bus()
+        bus.receive(self.message(1, [['user', username1]]))
+        bus.receive(self.message(1, None))
+        self.assertEqual(self.flushed[bus.node], 0)
+
+        bus.receive(self.message(2, None))  # message 2 was lost
+        self.assertEqual(self.flushed[bus.node], 1)
+
+    def test_send_heartbeat(self):
+        bus1 = self.bus(HEARTBEAT=0.01)
+        bus2 = self.bus()
+        bus1.publish([('groups', )])
+        bus2.receive(self.message(2, None, node=bus1.node))  # simulates a lost message
+        self.assertEqual(self.flushed[bus2.node], 1)
+
+        time.sleep(0.05)  # heartbeats repeat the current sequence number
+        self.assertEqual(self.flushed[bus2.node], 1)
+
+    def test_udp(self):
+        received = threading.Event()
+        # the default address is a free port, so several transports do not collide
+        bus1 = self.bus(TRANSPORT='common.invalidation.UDPTransport')
+        bus2 = self.bus(TRANSPORT='common.invalidation.UDPTransport')
+        bus2.subscribe(lambda tags: received.set(), lambda: None)
+        bus1.transport.peers = [bus2.transport.address]
+
+        bus1.publish([('user', username1)])
+        self.assertTrue(received.wait(5))
+        self.assertEqual(self.received[bus2.node], [('user', username1)])
+
+    @skipUnless(settings.DATA_BACKEND['BACKEND'] == 'backends.redis.RedisBackend', '')
+    def test_redis(self):
+        received = threading.Event()
+        bus1 = self.bus(TRANSPORT='common.invalidation.RedisTransport', CHANNEL='restauth-test',
+                        **settings.DATA_BACKEND.get('OPTIONS', {}))
+        bus2 = self.bus(TRANSPORT='common.invalidation.RedisTransport', CHANNEL='restauth-test',
+                        **settings.DATA_BACKEND.get('OPTIONS', {}))
+        bus2.subscribe(lambda tags: received.set(), lambda: None)
+
+        bus1.publish([('user', username1)])
+        self.assertTrue(received.wait(5))
+        self.assertEqual(self.received[bus2.node], [('user', username1)])
+
+    def test_caching_backend(self):
+        # both wrap the DjangoBackend, so they share the same database
+        node1 = CachingBackend()
+        node2 = CachingBackend()
+        node1.subscribe(self.bus())
+        node2.subscribe(self.bus())
+        service = Service.objects.create(username='vowi')
+
+        self.assertFalse(node1.user_exists(username1))
+        node2.create_user(username1, groups=[(groupname1, service)])
+        self.assertTrue(node1.user_exists(username1))
+        self.assertEqual(node1.members(group=groupname1, service=service), [username1])
+
+        with node2.transaction():
+            node2.remove_member(group=groupname1, service=service, user=username1)
+            self.assertEqual(node1.members(group=groupname1, service=service), [username1])
+        self.assertEqual(node1.members(group=groupname1, service=service), [])
+
+
+@override_settings(CHANGE_LOG={})
+class ChangeLogTests(RestAuthTransactionTest):
+    def changes(self, since=None):
+        resp = self.get('/changes/', {} if since is None else {'since': since})
+        self.assertEqual(resp.status_code, http_client.OK)
+        return [(c['type'], c['name'], c['action']) for c in self.parse(resp, 'list')]
+
+    def seq(self):
+        return Change.objects.order_by('-pk').first().pk
+
+    def test_users(self):
+        self.assertEqual(self.changes(), [])
+        resp = self.post('/users/', {'user': username1, 'password': password1})
+        self.assertEqual(resp.status_code, http_client.CREATED)
+        seq = self.seq()
+
+        resp = self.put('/users/%s/props/%s/' % (username1, propkey1), {'value': propval1})
+        self.assertEqual(resp.status_code, http_client.CREATED)
+        resp = self.delete('/users/%s/' % username1)
+        self.assertEqual(resp.status_code, http_client.NO_CONTENT)
+
+        self.assertEqual(self.changes(), [
+            ('user', username1, 'created'),
+            ('user', username1, 'changed'),
+            ('user', username1, 'deleted'),
+        ])
+        self.assertEqual(self.changes(since=seq), [
+            ('user', username1, 'changed'),
+            ('user', username1, 'deleted'),
+        ])
+        self.assertEqual(self.changes(since=self.seq()), [])
+
+    def test_groups(self):
+        self.create_user(username1)
+        resp = self.post('/groups/', {'group': groupname1})
+        self.assertEqual(resp.status_code, http_client.CREATED)
+        resp = self.post('/groups/%s/users/' % groupname1, {'user': username1})
+        self.assertEqual(resp.status_code, http_client.NO_CONTENT)
+        resp = self.put('/groups/', {'user': username1, 'groups': [groupname2]})
+        self.assertEqual(resp.status_code, http_client.NO_CONTENT)
+
+        self.assertCountEqual(self.changes(), [
+            ('group', groupname1, 'created'),
+            ('group', groupname1, 'changed'),
+            ('group', groupname1, 'changed'),
+            ('group', groupname2, 'changed'),
+        ])
+
+        # changes of groups are only visible to the service of the group
+        self.c.defaults['REMOTE_USER'] = self.service2.username
+        self.service2.user_permissions.add(*self.service.user_permissions.all())
+        self.assertEqual(self.changes(), [])
+
+    @skipIf(backend.SUPPORTS_SUBGROUPS is False, 'Backend does not support subgroups.')
+    def test_subgroups(self):
+        # subgroups inherit the members of their meta-groups
+        self.create_user(username1)
+        backend.create_group(group=groupname1, service=self.service, users=[username1])
+        backend.create_group(group=groupname2, service=self.service)
+        backend.create_group(group=groupname3, service=self.service)
+        backend.add_subgroup(group=groupname2, service=self.service, subgroup=groupname3,
+                             subservice=self.service)
+
+        resp = self.post('/groups/%s/groups/' % groupname1, {'group': groupname2})
+        self.assertEqual(resp.status_code, http_client.NO_CONTENT)
+        self.assertEqual(self.changes(), [
+            ('group', groupname1, 'changed'),
+            ('group', groupname2, 'changed'),
+            ('group', groupname3, 'changed'),
+        ])
+
+        seq = self.seq()
+        resp = self.delete('/groups/%s/users/%s/' % (groupname1, username1))
+        self.assertEqual(resp.status_code, http_client.NO_CONTENT)
+        self.assertEqual(self.changes(since=seq), [
+            ('group', groupname1, 'changed'),
+            ('group', groupname2, 'changed'),
+            ('group', groupname3, 'changed'),
+        ])
+
+        seq = self.seq()
+        resp = self.delete('/groups/%s/groups/%s/' % (groupname2, groupname3))
+        self.assertEqual(resp.status_code, http_client.NO_CONTENT)
+        self.assertEqual(self.changes(since=seq), [
+            ('group', groupname2, 'changed'),
+            ('group', groupname3, 'changed'),
+        ])
+
+        seq = self.seq()
+        with capture():
+            restauth_group(['add-group', '--service=%s' % self.service.username,
+                            '--sub-service=%s' % self.service.username, groupname3, groupname1])
+        self.assertEqual(self.changes(since=seq), [
+            ('group', groupname3, 'changed'),
+            ('group', groupname1, 'changed'),
+            ('group', groupname2, 'changed'),
+        ])
+
+        seq = self.seq()
+        resp = self.delete('/groups/%s/' % groupname3)
+        self.assertEqual(resp.status_code, http_client.NO_CONTENT)
+        self.assertEqual(self.changes(since=seq), [
+            ('group', groupname3, 'deleted'),
+            ('group', groupname1, 'changed'),
+            ('group', groupname2, 'changed'),
+        ])
+
+    def test_dry_run(self):
+        resp = self.post('/test/users/', {'user': username1})
+        self.assertEqual(resp.status_code, http_client.CREATED)
+        self.assertEqual(self.changes(), [])
+
+    def test_disabled(self):
+        with self.settings(CHANGE_LOG=None):
+            self.create_user(username1)
+            resp = self.delete('/users/%s/' % username1)
+            self.assertEqual(resp.status_code, http_client.NO_CONTENT)
+        self.assertFalse(Change.objects.exists())
+
+    def test_bad_request(self):
+        self.assertEqual(self.get('/changes/', {'since': 'foo'}).status_code,
+                         http_client.BAD_REQUEST)
+
+    def test_last_sequence(self):
+        resp = self.get('/changes/')
+        self.assertEqual(resp['Last-Sequence'], '0')
+
+        self.create_user(username1)
+        resp = self.post('/groups/', {'group': groupname1})
+        self.assertEqual(resp.status_code, http_client.CREATED)
+        self.assertEqual(self.get('/changes/')['Last-Sequence'], str(self.seq()))
+
+        # the group is not visible to service2, but the client can still continue after it
+        self.c.defaults['REMOTE_USER'] = self.service2.username
+        self.service2.user_permissions.add(*self.service.user_permissions.all())
+        resp = self.get('/changes/', {'since': self.seq() - 1})
+        self.assertEqual(self.parse(resp, 'list'), [])
+        self.assertEqual(resp['Last-Sequence'], str(self.seq()))
+
+    def test_sequence_numbers(self):
+        # changes from before the counter was introduced
+        Change.objects.create(pk=5, resource=Change.USER, name=username1, action=Change.CREATED)
+        self.assertFalse(ChangeCounter.objects.exists())
+
+        Change.objects.record_many([(Change.USER, username2, Change.CREATED, None),
+                                    (Change.USER, username3, Change.CREATED, None)])
+        Change.objects.user(username4, Change.CREATED)
+        self.assertEqual(list(Change.objects.order_by('pk').values_list('pk', 'name')),
+                         [(5, username1), (6, username2), (7, username3), (8, username4)])
+        self.assertEqual(ChangeCounter.objects.get().seq, 8)
+
+        # the counter is not reset by compaction or purging
+        Change.objects.purge(max_entries=0)
+        Change.objects.user(username1, Change.DELETED)
+        self.assertEqual(self.seq(), 9)
+
+    def test_purge(self):
+        for user in [username1, username2, username3]:
+            Change.objects.user(user, Change.CREATED)
+        self.assertEqual(Change.objects.horizon(), 0)
+
+        self.assertEqual(Change.objects.purge(max_entries=1), 2)
+        horizon = Change.objects.horizon()
+        resp = self.get('/changes/')
+        self.assertEqual(resp.status_code, 410)
+        self.assertEqual(resp['Last-Sequence'], str(self.seq()))
+        self.assertEqual(self.changes(since=horizon), [('user', username3, 'created')])
+        self.assertEqual(Change.objects.purge(max_entries=1), 0)
+
+        Change.objects.filter(name=username3).update(timestamp=datetime(2000, 1, 1))
+        Change.objects.user(username4, Change.CREATED)
+        self.assertEqual(Change.objects.purge(max_age=3600), 1)
+        self.assertGreater(Change.objects.horizon(), horizon)
+        self.assertEqual(self.changes(since=Change.objects.horizon()),
+                         [('user', username4, 'created')])
+
+    def test_compact(self):
+        Change.objects.user(username1, Change.CREATED)
+        Change.objects.group(groupname1, Change.CREATED, service=self.service)
+        Change.objects.group(groupname1, Change.CREATED, service=self.service2)
+        Change.objects.user(username1, Change.CHANGED)
+        Change.objects.group(groupname1, Change.DELETED, service=self.service)
+        Change.objects.user(username2, Change.CREATED)
+
+        self.assertEqual(Change.objects.compact(), 2)
+        self.assertEqual(self.changes(), [
+            ('user', username1, 'changed'),
+            ('group', groupname1, 'deleted'),
+            ('user', username2, 'created'),
+        ])
+
+    def test_command(self):
+        Change.objects.user(username1, Change.CREATED)
+        Change.objects.user(username1, Change.DELETED)
+        with self.settings(CHANGE_LOG={'MAX_ENTRIES': 1}), capture() as (stdout, stderr):
+            call_command('changelog')
+        self.assertEqual(stdout.getvalue(),
+                         'Removed 1 old changes.\nRemoved 0 superseded changes.\n')
+        self.assertEqual(self.changes(since=Change.objects.horizon()),
+                         [('user', username1, 'deleted')])
+
+        with self.settings(CHANGE_LOG=None), capture():
+            self.assertRaises(CommandError, call_command, 'changelog')
+
+    def test_cli(self):
+        self.create_user(username1)
+        restauth_user(['rename', username1, username2])
+        self.assertEqual(self.changes(), [
+            ('user', username1, 'deleted'),
+            ('user', username2, 'created'),
+        ])
+
+
+class BatchTests(RestAuthTransactionTest):
+    def batch(self, operations, **kwargs):
+        kwargs['operations'] = operations
+        resp = self.post('/batch/', kwargs)
+        self.assertEqual(resp.status_code, http_client.OK)
+        return self.parse(resp, 'list')
+
+    def test_batch(self):
+        backend.create_group(group=groupname1, service=self.service)
+        results = self.batch([
+            {'method': 'POST', 'path': '/users/', 'data': {'user': username1}},
+            {'method': 'PUT', 'path': '/users/%s/props/%s/' % (username1, propkey1),
+             'data': {'value': propval1}},
+            {'method': 'post', 'path': '/groups/%s/users/' % groupname1,
+             'data': {'user': username1}},
+            {'method': 'GET', 'path': '/users/'},
+            {'method': 'GET', 'path': '/groups/?user=%s' % username1},
+            {'method': 'GET', 'path': '/users/%s/props/%s/' % (username1, propkey1)},
+        ])
+
+        self.assertEqual(results, [
+            {'status': http_client.CREATED},
+            {'status': http_client.CREATED},
+            {'status': http_client.NO_CONTENT},
+            {'status': http_client.OK, 'body': [username1]},
+            {'status': http_client.OK, 'body': [groupname1]},
+            {'status': http_client.OK, 'body': {'value': propval1}},
+        ])
+        self.assertEqual(backend.members(group=groupname1, service=self.service), [username1])
+
+    def test_escaped_path(self):
+        backend.create_user(user='foo bar', properties={propkey1: propval1})
+        results = self.batch([
+            {'method': 'GET', 'path': '/users/foo%%20bar/props/%s/' % propkey1},
+            {'method': 'PUT', 'path': '/users/foo%20bar/props/?foo=bar', 'data': {'a b': 'c'}},
+        ])
+        self.assertEqual(results, [
+            {'status': http_client.OK, 'body': {'value': propval1}},
+            {'status': http_client.NO_CONTENT},
+        ])
+        self.assertEqual(backend.get_property(user='foo bar', key='a b'), 'c')
+
+    def test_errors(self):
+        self.create_user(username1)
+        results = self.batch([
+            {'method': 'POST', 'path': '/users/', 'data': {'user': username1}},
+            {'method': 'GET', 'path': '/users/%s/' % username2},
+            {'method': 'DELETE', 'path': '/users/'},
+            {'method': 'GET', 'path': '/foo/'},
+            {'method': 'GET', 'path': '/'},
+            {'method': 'POST', 'path': '/batch/', 'data': {'operations': []}},
+            {'method': 'POST', 'path': '/users/', 'data': {'foo': 'bar'}},
+            {'method': 'POST', 'path': '/users/', 'data': {'user': username2}},
+        ])
+
+        self.assertEqual([r['status'] for r in results], [
+            http_client.CONFLICT, http_client.NOT_FOUND, http_client.METHOD_NOT_ALLOWED,
+            http_client.NOT_FOUND, http_client.NOT_FOUND, http_client.NOT_FOUND,
+            http_client.BAD_REQUEST, http_client.CREATED,
+        ])
+        self.assertCountEqual(backend.list_users(), [username1, username2])
+
+    def test_permissions(self):
+        self.service.user_permissions.remove(
+            *self.service.user_permissions.filter(codename='user_create'))
+        results = self.batch([{'method': 'POST', 'path': '/users/', 'data': {'user': username1}}])
+        self.assertEqual(results, [{'status': http_client.FORBIDDEN}])
+        self.assertEqual(backend.list_users(), [])
+
+    @skipUnless(backend.SUPPORTS_TRANSACTION_READS, 'Backend does not support transactions')
+    def test_transaction(self):
+        self.create_user(username2)
+        operations = [
+            {'method': 'POST', 'path': '/users/', 'data': {'user': username1}},
+            {'method': 'POST', 'path': '/users/', 'data': {'user': username2}},
+            {'method': 'POST', 'path': '/users/', 'data': {'user': username3}},
+        ]
+        with self.settings(CHANGE_LOG={}):
+            results = self.batch(operations, transaction=True)
+        self.assertEqual([r['status'] for r in results], [http_client.CREATED,
+                                                          http_client.CONFLICT])
+        self.assertEqual(backend.list_users(), [username2])
+        self.assertFalse(Change.objects.exists())
+
+        results = self.batch(operations[::2], transaction=True)
+        self.assertEqual([r['status'] for r in results], [http_client.CREATED] * 2)
+        self.assertCountEqual(backend.list_users(), [username1, username2, username3])
+
+    @skipUnless(backend.SUPPORTS_TRANSACTION_READS, 'Backend does not support transactions')
+    def test_transaction_reads(self):
+        backend.create_group(group=groupname1, service=self.service)
+        results = self.batch([
+            {'method': 'POST', 'path': '/users/', 'data': {'user': username1}},
+            {'method': 'POST', 'path': '/groups/%s/users/' % groupname1,
+             'data': {'user': username1}},
+            {'method': 'GET', 'path': '/users/%s/' % username1},
+        ], transaction=True)
+        self.assertEqual([r['status'] for r in results], [
+            http_client.CREATED, http_client.NO_CONTENT, http_client.NO_CONTENT])
+
+    def test_transaction_not_supported(self):
+        supported = backend.SUPPORTS_TRANSACTION_READS
+        backend.SUPPORTS_TRANSACTION_READS = False
+        try:
+            resp = self.post('/batch/', {'operations': [], 'transaction': True})
+            self.assertEqual(resp.status_code, http_client.BAD_REQUEST)
+            self.assertEqual(self.batch([]), [])  # batches without transactions still work
+        finally:
+            backend.SUPPORTS_TRANSACTION_READS = supported
+
+    @override_settings(MAX_BATCH_OPERATIONS=2)
+    def test_max_operations(self):
+        operation = {'method': 'POST', 'path': '/users/', 'data': {'user': username1}}
+        resp = self.post('/batch/', {'operations': [operation] * 3})
+        self.assertEqual(resp.status_code, http_client.BAD_REQUEST)
+        self.assertEqual(backend.list_users(), [])
+        self.assertEqual(len(self.batch([operation] * 2)), 2)
+
+    def test_bad_request(self):
+        resp = self.post('/batch/', {'operations': 'foo'})
+        self.assertEqual(resp.status_code, http_client.BAD_REQUEST)
+        resp = self.post('/batch/', {'operations': [{'path': '/users/'}]})
+        self.assertEqual(resp.status_code, http_client.BAD_REQUEST)
+        resp = self.post('/batch/', {'operations': [
+            {'method': 'POST', 'path': '/users/', 'data': {'user': username1}},
+            {'method': 'GET', 'path': '/users/', 'foo': 'bar'},
+        ]})
+        self.assertEqual(resp.status_code, http_client.BAD_REQUEST)
+        self.assertEqual(backend.list_users(), [])
+
+
+class FakeConnection(object):
+    def __init__(self, barrier=None):
+        self.barrier = barrier
+        self.closed = False
+        self.healthy = True
+
+    def search(self):
+        if self.barrier is not None:
+            self.barrier.wait()  # only returns once all threads are in here at the same time
+        return 'result'
+
+    def check(self):
+        if not self.healthy:
+            raise IOError('connection lost')
+
+
+class ConnectionPoolTests(TestCase):
+    def setUp(self):
+        self.connections = []
+        self.barrier = None
+
+    def connect(self):
+        conn = FakeConnection(self.barrier)
+        self.connections.append(conn)
+        return conn
+
+    def close(self, conn):
+        conn.closed = True
+
+    def pool(self, **kwargs):
+        return ConnectionPool(self.connect, self.close, lambda c: c.check(), errors=(IOError, ),
+                              **kwargs)
+
+    def test_reuse(self):
+        pool = self.pool()
+        with pool.connection() as conn:
+            self.assertEqual(conn.search(), 'result')
+        with pool.connection() as conn2:
+            self.assertIs(conn, conn2)
+            with pool.connection() as conn3:
+                self.assertIsNot(conn, conn3)
+        self.assertEqual(len(self.connections), 2)
+
+    def test_broken(self):
+        pool = self.pool()
+        with self.assertRaises(IOError):
+            with pool.connection() as conn:
+                raise IOError()
+        self.assertTrue(conn.closed)
+
+        # other exceptions don't discard the connection
+        with self.assertRaises(ValueError):
+            with pool.connection() as conn:
+                raise ValueError()
+        self.assertFalse(conn.closed)
+        with pool.connection() as conn2:
+            self.assertIs(conn, conn2)
+
+    def test_idle(self):
+        pool = self.pool(idle_timeout=300, check_interval=30)
+        with pool.connection() as conn1:
+            with pool.connection() as conn2:
+                pass
+
+        # conn2 was idle for too long, conn1 was idle long enough to be checked
+        pool._idle = [(conn1, time.time() - 60), (conn2, time.time() - 600)]
+        conn1.healthy = False
+        with pool.connection() as conn:
+            self.assertNotIn(conn, [conn1, conn2])
+        self.assertTrue(conn1.closed)
+        self.assertTrue(conn2.closed)
+
+        pool.clear()
+        self.assertTrue(conn.closed)
+
+    def test_full(self):
+        pool = self.pool(size=1, timeout=0.01)
+        with pool.connection():
+            with self.assertRaises(ServiceUnavailable):
+                with pool.connection():
+                    pass
+
+    def test_concurrency(self):
+        threads = 4
+        self.barrier = threading.Barrier(threads, timeout=10)
+        pool = self.pool(size=threads)
+        results = []
+
+        def search():
+            with pool.connection() as conn:
+                results.append(conn.search())
+
+        workers = [threading.Thread(target=search) for i in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(results, ['result'] * threads)
+        self.assertEqual(len(self.connections), threads)
+
+
+class HashingPoolTests(TestCase):
+    def setUp(self):
+        self.pool = HashingPool(MAX_WORKERS=1, MAX_QUEUE=1)
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    def test_make_password(self):
+        encoded = self.pool.make_password(password1)
+        self.assertTrue(check_password(password1, encoded))
+        self.assertFalse(check_password(password2, encoded))
+
+    def test_check_password(self):
+        encoded = make_password(password1)
+        self.assertTrue(self.pool.check_password(password1, encoded))
+        self.assertFalse(self.pool.check_password(password2, encoded))
+
+    @skipUnless('fork' in multiprocessing.get_all_start_methods(), 'fork start method required.')
+    def test_setter(self):
+        # NOTE: only forked workers inherit the overridden settings, they are started on demand.
+        self.pool.shutdown()
+        self.pool = HashingPool(MAX_WORKERS=1, MAX_QUEUE=1, START_METHOD='fork')
+
+        updated = []
+        with self.settings(PASSWORD_HASHERS=('django.contrib.auth.hashers.MD5PasswordHasher',
+                                             'common.hashers.Sha512Hasher')):
+            encoded = make_password(password1, hasher='sha512')
+            self.assertFalse(self.pool.check_password(password2, encoded, updated.append))
+            self.assertEqual(updated, [])
+            self.assertTrue(self.pool.check_password(password1, encoded, updated.append))
+            self.assertEqual(updated, [password1])
+
+    def test_full(self):
+        # occupy both slots (one worker, one queued request)
+        self.pool._slots.acquire()
+        self.pool._slots.acquire()
+
+        with self.assertRaises(ServiceUnavailable):
+            self.pool.make_password(password1)
+
+        self.pool._slots.release()
+        self.assertTrue(self.pool.check_password(password1, self.pool.make_password(password1)))
+
+
 validators = (
     'Users.validators.EmailValidator',
     'Users.validators.MediaWikiValidator',
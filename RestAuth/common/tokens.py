@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of RestAuth (https://restauth.net).
+#
+# RestAuth is free software: you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# RestAuth is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with RestAuth. If not,
+# see <http://www.gnu.org/licenses/>.
+
+"""Sign and verify tokens with a list of keys, so that keys can be rotated.
+
+New tokens are always signed with the first key, tokens signed with any key are accepted. Keys can be
+rotated by adding a new key at the start of the list and removing the old key once all its tokens
+have expired.
+"""
+
+from __future__ import unicode_literals
+
+from django.core import signing
+
+
+def sign(data, keys, salt):
+    """Get a signed token containing ``data``, which must be serializable as JSON."""
+
+    return signing.dumps(data, key=keys[0], salt=salt, compress=True)
+
+
+def unsign(token, keys, salt, max_age):
+    """Get the data of a token or ``None`` if it is not signed with one of the keys or older than
+    ``max_age`` seconds."""
+
+    for key in keys:
+        try:
+            return signing.loads(token, key=key, salt=salt, max_age=max_age)
+        except signing.SignatureExpired:  # the signature is valid, so no other key will match
+            return None
+        except signing.BadSignature:
+            continue
+    return None
@@ -15,6 +15,8 @@
 
 from __future__ import unicode_literals
 
+from copy import copy
+
 import mimeparse
 
 from RestAuthCommon.error import BadRequest
@@ -37,7 +39,13 @@ def get_response_type(request):
         raise NotAcceptable()
 
 
-def parse_dict(request):
+def parse_body(request):
+    """Parse the request body, which may be a dictionary or (if the content handler supports it) a
+    list."""
+
+    if getattr(request, 'batch_data', None) is not None:  # operation of a batch request
+        return copy(request.batch_data)
+
     supported = get_supported()
 
     header = request.META['CONTENT_TYPE']
@@ -46,15 +54,19 @@ def parse_dict(request):
         handler = get_handler(mime_type)
 
         try:
-            data = handler.unmarshal_dict(request.body)
-            assert isinstance(data, dict), "Request body is not a dictionary."
-            return data
+            return handler.unmarshal_dict(request.body)
         except UnmarshalError:
             raise BadRequest()
     else:
         raise UnsupportedMediaType()
 
 
+def parse_dict(request):
+    data = parse_body(request)
+    assert isinstance(data, dict), "Request body is not a dictionary."
+    return data
+
+
 def assert_format(data, required=None, optional=None):
     retlist = []
 
@@ -19,11 +19,33 @@ This module implements common baseclasses used in other RestAuth views..
 
 from __future__ import unicode_literals
 
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.http import HttpRequest
+from django.http import HttpResponseForbidden
+from django.http import HttpResponseGone
+from django.http import HttpResponseNotFound
+from django.http import QueryDict
+from django.urls import Resolver404
+from django.urls import resolve
 from django.views.generic.base import View
+import six
+from six.moves.urllib.parse import unquote
 
+from RestAuthCommon.error import BadRequest
 from RestAuthCommon.strprep import stringprep
 
+from backends import backend
+from common.content_handlers import get_handler
+from common.middleware import exception_response
+from common.models import Change
+from common.responses import HttpResponseNotImplemented
+from common.responses import HttpRestAuthResponse
+from common.responses import HttpRestAuthStreamingResponse
 from common.types import assert_format
+from common.types import get_response_type
 from common.types import parse_dict
 
 
@@ -84,3 +106,158 @@ class RestAuthSubResourceView(RestAuthView):
 
         return super(RestAuthSubResourceView, self).dispatch(
             request, largs=largs, name=name, subname=subname, **kwargs)
+
+
+class ChangesView(RestAuthView):
+    """Handle requests to ``/changes/``."""
+
+    http_method_names = ['get']
+    log = logging.getLogger('changes')
+
+    def get(self, request, largs):
+        """Get all changes after the sequence number given by the ``since`` parameter.
+
+        The ``Last-Sequence`` header of every response contains the sequence number of the last
+        change, also if no changes are returned or the client has to fetch all data again.
+        """
+
+        if not request.user.has_perm('common.changes_list'):
+            return HttpResponseForbidden()
+        if not Change.objects.enabled():
+            return HttpResponseNotImplemented()
+
+        try:
+            since = int(request.GET.get('since', 0))
+        except ValueError:
+            raise BadRequest('"since" must be an integer.')
+
+        # Read before the changes, so it never skips changes that are not in the response
+        last = Change.objects.last_seq()
+
+        # If the client missed changes that were already removed: 410 Gone
+        if since < Change.objects.horizon():
+            response = HttpResponseGone()
+        else:
+            changes = Change.objects.since(since, service=request.user)
+            response = HttpRestAuthStreamingResponse(
+                request, (c.as_dict() for c in changes.iterator()))
+        response['Last-Sequence'] = last
+        return response
+
+
+class BatchRollback(Exception):
+    """Raised to roll back the transaction of a batch request if an operation failed."""
+    pass
+
+
+class BatchView(RestAuthView):
+    """Handle requests to ``/batch/``.
+
+    The request body is a dictionary with a list of ``operations`` and an optional boolean
+    ``transaction``. Every operation is a dictionary with the HTTP ``method``, the ``path``
+    (e.g. ``/users/<user>/props/``, optionally with a query string) and, for POST and PUT
+    requests, the ``data`` of the request body. The operations are executed in order by the same
+    views that handle the individual requests, so they require the same permissions. The response
+    is a list with one dictionary per operation containing the ``status`` code and the ``body`` of
+    the response, if any.
+
+    If ``transaction`` is true, all operations are executed in a single transaction. Execution
+    stops at the first operation that fails (with a status code of 400 or higher) and all
+    previous operations are rolled back. Transactions are only supported by backends where later
+    operations see the changes of previous operations (i.e. not the Redis and LDAP backends).
+
+    A batch may contain at most :setting:`MAX_BATCH_OPERATIONS` operations.
+    """
+
+    http_method_names = ['post']
+    log = logging.getLogger('batch')
+    post_required = (('operations', list),)
+    post_optional = (('transaction', bool),)
+    operation_required = (('method', six.string_types), ('path', six.string_types),)
+    operation_optional = (('data', (dict, list)),)
+
+    def _parse_operation(self, operation):
+        assert isinstance(operation, dict), "Operation is not a dictionary: %s" % operation
+        method, path, data = assert_format(data=dict(operation),
+                                           required=self.operation_required,
+                                           optional=self.operation_optional)
+        return method.upper(), path, data
+
+    def _request(self, request, method, path, data):
+        """Create a request for a single operation, based on the batch request."""
+
+        path, _, query = path.partition('?')
+        path = unquote(path)  # like PATH_INFO of normal requests
+        sub = HttpRequest()
+        sub.method = method
+        sub.path = sub.path_info = path
+        sub.META = dict(request.META, REQUEST_METHOD=method, PATH_INFO=path, QUERY_STRING=query)
+        sub.GET = QueryDict(query)
+        sub.user = request.user
+        sub.version = request.version
+        sub.batch_data = data if data is not None else {}
+        return sub
+
+    def _body(self, request, response):
+        if isinstance(response, HttpRestAuthResponse):
+            return response.response_object
+        elif isinstance(response, HttpRestAuthStreamingResponse):
+            handler = get_handler(get_response_type(request))
+            return handler.unmarshal_list(b''.join(response.streaming_content))
+        elif response.content:  # e.g. error messages
+            return response.content.decode('utf-8')
+
+    def _execute(self, request, method, path, data):
+        sub = self._request(request, method, path, data)
+        try:
+            match = resolve(sub.path_info)
+        except Resolver404:
+            match = None
+
+        # use the undecorated view, the service is already authenticated
+        view = getattr(match.func, '__wrapped__', None) if match is not None else None
+        view_class = getattr(view, 'view_class', None)
+        if view_class is None or not issubclass(view_class, RestAuthView) or \
+                issubclass(view_class, BatchView):
+            response = HttpResponseNotFound()
+        else:
+            try:
+                response = view(sub, *match.args, **match.kwargs)
+            except Exception as e:
+                response = exception_response(e)
+                if response is None:
+                    raise
+
+        result = {'status': response.status_code}
+        body = self._body(request, response)
+        if body is not None:
+            result['body'] = body
+        return result
+
+    def post(self, request, largs):
+        """Execute multiple operations."""
+
+        # If BadRequest: 400 Bad Request
+        operations, atomic = self._parse_post(request)
+        max_operations = getattr(settings, 'MAX_BATCH_OPERATIONS', 100)
+        if len(operations) > max_operations:
+            raise BadRequest('A batch may contain at most %s operations.' % max_operations)
+        if atomic and not backend.SUPPORTS_TRANSACTION_READS:
+            raise BadRequest('The backend does not support transactions in batches.')
+        operations = [self._parse_operation(o) for o in operations]
+
+        results = []
+        if atomic:
+            try:
+                with backend.transaction(), transaction.atomic():
+                    for method, path, data in operations:
+                        results.append(self._execute(request, method, path, data))
+                        if results[-1]['status'] >= 400:
+                            raise BatchRollback()
+            except BatchRollback:
+                self.log.info('Rolled back %s operations', len(results), extra=largs)
+        else:
+            for method, path, data in operations:
+                results.append(self._execute(request, method, path, data))
+
+        return HttpRestAuthResponse(request, results)
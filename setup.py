@@ -119,6 +119,7 @@ class build_doc_meta(Command):
         from Users.models import user_permissions
         from Users.models import prop_permissions
         from Groups.models import group_permissions
+        from common.models import change_permissions
         from common.cli import helpers
         from Services.cli import parsers as service_parser
         from Users.cli import parsers as user_parser
@@ -154,6 +155,7 @@ class build_doc_meta(Command):
         self.write_perm_table('users', user_permissions)
         self.write_perm_table('properties', prop_permissions)
         self.write_perm_table('groups', group_permissions)
+        self.write_perm_table('changes', change_permissions)
 
         pythonpath = os.environ.get('PYTHONPATH')
         if pythonpath: